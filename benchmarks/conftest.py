@@ -0,0 +1,41 @@
+"""Fixtures of the plotting benchmarks.
+
+Run them with pytest-benchmark from the repository root:
+
+    python3 -m pytest benchmarks --benchmark-json plot-perf.json
+
+The synthetic surveys and their memory limit are described in
+surveys.py.
+"""
+import platform
+
+import matplotlib as mpl
+import numpy as np
+import pytest
+import scipy
+from PIL import Image
+
+from wifi_heat_mapper import __version__
+
+
+@pytest.fixture(scope="session")
+def floor_map(tmp_path_factory):
+    """Get a function creating a blank floor map of a size."""
+    directory = tmp_path_factory.mktemp("floor_maps")
+
+    def path(size):
+        image = directory / "floor_map_{0}x{1}.png".format(*size)
+        if not image.exists():
+            Image.new("RGB", size, "white").save(image)
+        return str(image)
+    return path
+
+
+def pytest_benchmark_update_json(output_json):
+    output_json["versions"] = {
+        "wifi_heat_mapper": __version__,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "matplotlib": mpl.__version__,
+    }
@@ -0,0 +1,98 @@
+"""Synthetic surveys and helpers shared by the plotting benchmarks.
+
+The RBF of GraphPlot.fit is a dense (n x n) solve, so its memory grows
+with the square of the number of points and its time with the cube.
+10000 points need about 4 GiB and 20000 points about 12 GiB. Surveys
+estimated to need more than WHM_BENCH_MAX_MEMORY GiB (4 by default)
+are skipped with the estimate as the reason.
+"""
+import functools
+import os
+import random
+
+import pytest
+
+from wifi_heat_mapper.backends import SimulatedBackend
+from wifi_heat_mapper.graph import GraphPlot
+
+
+POINTS = (10, 100, 1000, 5000, 10000, 20000)
+SIZES = ((800, 600), (1600, 1200))
+# Every format generate_graph can save.
+FORMATS = ("png", "pdf", "ps", "eps", "svg")
+LEVELS = 100
+DPI = 300
+ROUNDS = int(os.environ.get("WHM_BENCH_ROUNDS", "3"))
+MAX_MEMORY = float(os.environ.get("WHM_BENCH_MAX_MEMORY", "4"))
+# GraphPlot.interpolate evaluates the RBF on a 100 x 100 grid.
+GRID = 100 * 100
+
+
+@functools.lru_cache(maxsize=4)
+def synthetic_survey(points, size, seed=0):
+    """Generate the results of a survey at random positions with
+    the signal and throughput of a SimulatedBackend.
+
+    Args:
+        points (int): the number of benchmark points.
+        size (tuple): (width, height) of the floor map in pixels.
+        seed (int), optional: Seed of the random generator.
+        Defaults to 0.
+
+    Returns:
+        dict: Dictionary of benchmark points in the form of the
+        results of a configuration file.
+    """
+    backend = SimulatedBackend(size, "whm-bench", seed=seed)
+    positions = random.Random(seed)
+    results = {}
+    for index in range(points):
+        x, y = positions.uniform(0, size[0]), positions.uniform(0, size[1])
+        backend.move_to(x, y)
+        signal, _ = backend.connected()
+        results[str(index)] = {
+            "position": {"x": x, "y": y},
+            "station": False,
+            "results": {
+                "signal_strength": signal,
+                "download_bits_tcp": backend.capacity(signal) * 0.65,
+            },
+        }
+    return results
+
+
+def rbf_memory(points):
+    """Estimate the peak memory in bytes of fitting the RBF of a
+    survey, which holds a few dense (n x n) float64 matrices, and
+    of evaluating it on the grid."""
+    nodes = points + 4
+    return 8 * (3 * nodes ** 2 + 2 * GRID * nodes)
+
+
+def skip_large(points):
+    """Skip a benchmark whose RBF would not fit in MAX_MEMORY."""
+    memory = rbf_memory(points) / 2 ** 30
+    if memory > MAX_MEMORY:
+        pytest.skip("RBF of {0} points needs about {1:.1f} GiB, over WHM_BENCH_MAX_MEMORY={2}".format(
+            points, memory, MAX_MEMORY))
+
+
+def rounds(points):
+    """Get the number of rounds of a survey size, a single one for
+    the surveys which take seconds to fit."""
+    return 1 if points >= 5000 else ROUNDS
+
+
+def new_plot(points, size, floor_map):
+    """Get an unprepared GraphPlot of the TCP download of a survey."""
+    return GraphPlot(synthetic_survey(points, size), "download_bits_tcp", floor_map, conversion=True)
+
+
+@functools.lru_cache(maxsize=1)
+def fitted(points, size, floor_map):
+    """Get a prepared GraphPlot with its RBF and grid, shared by the
+    benchmarks of the later stages."""
+    plot = new_plot(points, size, floor_map)
+    plot.prepare()
+    rbf = plot.fit()
+    return plot, rbf, plot.interpolate(rbf)
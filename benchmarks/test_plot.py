@@ -0,0 +1,55 @@
+"""Benchmarks of every stage of GraphPlot.generate_plot on synthetic
+surveys. The surveys and their memory limit are described in
+surveys.py."""
+import matplotlib.pyplot as plt
+import pytest
+
+from surveys import POINTS, SIZES, FORMATS, LEVELS, DPI, skip_large, rounds, new_plot, fitted
+
+
+@pytest.mark.benchmark(group="prepare")
+@pytest.mark.parametrize("points", POINTS)
+def test_prepare(benchmark, floor_map, points):
+    size = SIZES[0]
+    benchmark.pedantic(lambda plot: plot.prepare(), setup=lambda: ((new_plot(points, size, floor_map(size)),), {}),
+                       rounds=rounds(points))
+
+
+@pytest.mark.benchmark(group="fit")
+@pytest.mark.parametrize("points", POINTS)
+def test_fit(benchmark, floor_map, points):
+    skip_large(points)
+    size = SIZES[0]
+    plot = new_plot(points, size, floor_map(size))
+    plot.prepare()
+    benchmark.pedantic(plot.fit, rounds=rounds(points))
+
+
+@pytest.mark.benchmark(group="interpolate")
+@pytest.mark.parametrize("size", SIZES, ids="{0[0]}x{0[1]}".format)
+@pytest.mark.parametrize("points", POINTS)
+def test_interpolate(benchmark, floor_map, points, size):
+    skip_large(points)
+    plot, rbf, _ = fitted(points, size, floor_map(size))
+    benchmark.pedantic(plot.interpolate, args=(rbf,), rounds=rounds(points))
+
+
+@pytest.mark.benchmark(group="render")
+@pytest.mark.parametrize("size", SIZES, ids="{0[0]}x{0[1]}".format)
+@pytest.mark.parametrize("points", POINTS)
+def test_render(benchmark, floor_map, points, size):
+    skip_large(points)
+    plot, _, grid = fitted(points, size, floor_map(size))
+    benchmark.pedantic(lambda: plt.close(plot.render(*grid, LEVELS)), rounds=rounds(points))
+
+
+@pytest.mark.benchmark(group="save")
+@pytest.mark.parametrize("file_type", FORMATS)
+@pytest.mark.parametrize("size", SIZES, ids="{0[0]}x{0[1]}".format)
+@pytest.mark.parametrize("points", POINTS)
+def test_save(benchmark, floor_map, tmp_path, points, size, file_type):
+    skip_large(points)
+    plot, _, grid = fitted(points, size, floor_map(size))
+    path = str(tmp_path / "plot.{0}".format(file_type))
+    benchmark.pedantic(plot.save, setup=lambda: ((plot.render(*grid, LEVELS), DPI, file_type, path), {}),
+                       rounds=rounds(points))
@@ -0,0 +1,68 @@
+import time
+
+import pytest
+
+from wifi_heat_mapper.feed import PositionFeed, FeedError
+
+
+RECORDING = """# t,x,y
+100.0,10,10
+100.1,11,10
+100.2,12,10
+100.3,60,10
+100.4,120,10
+"""
+
+
+def replayed_feed(tmp_path):
+    path = tmp_path / "positions.csv"
+    path.write_text(RECORDING)
+    feed = PositionFeed(str(path), replay=True)
+    feed.start()
+    while not feed.finished:
+        feed.wait(timeout=1)
+    feed.stop()
+    # Replay re-bases the recorded timestamps onto the current clock.
+    return feed, feed.samples[0][0] - 100.0
+
+
+def test_replay_nearest(tmp_path):
+    feed, offset = replayed_feed(tmp_path)
+    assert len(feed.samples) == 5
+    assert feed.nearest(offset + 100.12)[1:] == (11.0, 10.0)
+    assert feed.nearest(offset + 50)[1:] == (10.0, 10.0)
+    assert feed.nearest(offset + 200)[1:] == (120.0, 10.0)
+
+
+def test_replay_alignment(tmp_path):
+    feed, offset = replayed_feed(tmp_path)
+    assert feed.align(offset + 100.0, offset + 100.2)[1:] == (11.0, 10.0)
+    with pytest.raises(FeedError, match="moved"):
+        feed.align(offset + 100.2, offset + 100.4)
+    assert feed.align(offset + 100.2, offset + 100.4, max_distance=200)[1:] == (60.0, 10.0)
+    with pytest.raises(FeedError, match="away"):
+        feed.align(offset + 105.0, offset + 106.0)
+    assert feed.align(offset + 101.0, offset + 102.0, tolerance=2.0)[1:] == (120.0, 10.0)
+
+
+def test_alignment_without_samples():
+    with pytest.raises(FeedError):
+        PositionFeed("unused").align(0.0, 1.0)
+
+
+def test_tail_partial_line(tmp_path):
+    path = tmp_path / "positions.csv"
+    path.write_text("1.0,5,5\n")
+    feed = PositionFeed(str(path))
+    feed.start()
+    try:
+        with open(path, "a") as f:
+            f.write("2.0,1")
+            f.flush()
+            time.sleep(0.3)
+            assert len(feed.samples) == 0
+            f.write("0,20\n")
+        assert feed.wait(timeout=2)
+        assert list(feed.samples) == [(2.0, 10.0, 20.0)]
+    finally:
+        feed.stop()
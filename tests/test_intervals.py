@@ -0,0 +1,80 @@
+import json
+import sys
+
+import pytest
+
+from wifi_heat_mapper.misc import ExternalError, is_stable, summarize_intervals, run_iperf_stream
+
+
+def interval(bits_per_second, omitted=False):
+    return {"sum": {"start": 0, "end": 1, "seconds": 1.0, "bytes": bits_per_second / 8,
+                    "bits_per_second": bits_per_second, "omitted": omitted}}
+
+
+def test_is_stable_within_tolerance():
+    intervals = [interval(40e6), interval(95e6), interval(100e6), interval(105e6)]
+    assert is_stable(intervals, 0.1, 3)
+    assert not is_stable(intervals, 0.04, 3)
+    assert not is_stable(intervals, 0.1, 4)
+
+
+def test_is_stable_needs_enough_intervals():
+    assert not is_stable([interval(100e6), interval(100e6)], 0.1, 3)
+    assert not is_stable([], 0.1, 1)
+
+
+def test_is_stable_ignores_omitted_intervals():
+    intervals = [interval(100e6), interval(100e6, omitted=True), interval(100e6)]
+    assert not is_stable(intervals, 0.1, 3)
+    intervals = [interval(100e6), interval(100e6), interval(10e6, omitted=True)]
+    assert is_stable(intervals, 0.1, 2)
+
+
+def test_summarize_intervals_uses_stable_intervals():
+    intervals = [interval(10e6, omitted=True), interval(40e6), interval(100e6), interval(100e6)]
+    summary = summarize_intervals(intervals, "tcp", stable_intervals=2)["sum_received"]
+    assert summary["bits_per_second"] == 100e6
+    assert summary["seconds"] == 3.0
+
+
+FAKE_IPERF = """#!{0}
+import json, os, sys
+if "--version" in sys.argv:
+    print("iperf {{0}} (cJSON 1.7.15)".format(os.environ["FAKE_IPERF_VERSION"]))
+    sys.exit(0)
+for line in os.environ["FAKE_IPERF_OUTPUT"].splitlines():
+    print(line, flush=True)
+"""
+
+
+@pytest.fixture
+def fake_iperf(tmp_path, monkeypatch):
+    path = tmp_path / "iperf3"
+    path.write_text(FAKE_IPERF.format(sys.executable))
+    path.chmod(0o755)
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=":")
+
+    def install(events, version="3.17.1"):
+        monkeypatch.setenv("FAKE_IPERF_VERSION", version)
+        monkeypatch.setenv("FAKE_IPERF_OUTPUT", "\n".join(json.dumps(event) for event in events))
+
+    return install
+
+
+def test_stream_duration_skips_omitted_intervals(fake_iperf):
+    start = {"event": "start", "data": {"test_start": {"protocol": "TCP", "num_streams": 1, "duration": 10}}}
+    fake_iperf([start] + [{"event": "interval", "data": interval(bits_per_second, omitted=omitted)}
+                          for bits_per_second, omitted in [(10e6, True), (100e6, False), (100e6, False),
+                                                           (100e6, False)]])
+    result = run_iperf_stream("127.0.0.1", 5201, "127.0.0.1", omit=1, stable_intervals=3)
+    assert result["start"]["test_start"]["duration"] == 3.0
+    assert result["end"]["sum_received"]["bits_per_second"] == 100e6
+
+
+def test_stream_without_output_reports_the_cause(fake_iperf):
+    fake_iperf([], version="3.9")
+    with pytest.raises(ExternalError, match=r"3\.17 or newer"):
+        run_iperf_stream("127.0.0.1", 5201, "127.0.0.1", retry=2)
+    fake_iperf([])
+    with pytest.raises(ExternalError, match="exited with code 0"):
+        run_iperf_stream("127.0.0.1", 5201, "127.0.0.1", retry=2)
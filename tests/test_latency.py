@@ -0,0 +1,95 @@
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+
+from wifi_heat_mapper.latency import LatencyProber, measure_latency, serve_echo
+from wifi_heat_mapper.gui import latency_metrics, echo_metrics
+
+
+class EchoServer:
+    """Runs serve_echo on a free local port in a background loop."""
+    def __init__(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(serve_echo("127.0.0.1", self.port), self.loop)
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=1).close()
+            except OSError:
+                time.sleep(0.01)
+            else:
+                return
+
+    async def cancel(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.cancel(), self.loop).result(timeout=5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+        self.loop.close()
+
+
+@pytest.fixture
+def echo_server():
+    server = EchoServer()
+    server.start()
+    yield server
+    if server.thread.is_alive():
+        server.stop()
+
+
+@pytest.mark.parametrize("protocol", ["udp", "tcp"])
+def test_measure_latency_against_echo_server(echo_server, protocol):
+    prober = measure_latency("127.0.0.1", echo_server.port, duration=0.5, interval=0.02, protocol=protocol)
+    assert prober.error is None
+    assert 20 <= prober.sent <= 30
+    assert len(prober.rtts) == prober.sent
+    assert prober.lost == 0
+    assert all(0 < rtt < 1000 for rtt in prober.rtts)
+
+    metrics = latency_metrics(prober.rtts[:10], prober.rtts[10:])
+    assert metrics["idle_latency_p50"] <= metrics["idle_latency_p95"] <= metrics["idle_latency_p99"]
+    assert metrics["latency_increase"] == metrics["loaded_latency_p50"] - metrics["idle_latency_p50"]
+    metrics = echo_metrics(prober)
+    assert metrics["echo_loss"] == 0
+    assert metrics["echo_latency"] <= metrics["echo_latency_p95"]
+
+
+def test_latency_prober_counts_loss_after_server_stops(echo_server):
+    prober = LatencyProber("127.0.0.1", echo_server.port, interval=0.02, timeout=0.2)
+    prober.start()
+    deadline = time.monotonic() + 5
+    while len(prober.rtts) < 5 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    echo_server.stop()
+    time.sleep(0.2)
+    prober.stop()
+    assert len(prober.rtts) >= 5
+    assert prober.lost > 0
+    assert prober.lost == prober.sent - len(prober.rtts)
+    assert 0 < echo_metrics(prober)["echo_loss"] < 100
+
+
+def test_measure_latency_without_server():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    prober = measure_latency("127.0.0.1", port, duration=0.2, interval=0.02, timeout=0.1)
+    assert prober.sent > 0
+    assert prober.rtts == []
+    assert latency_metrics([], prober.rtts) == {}
+    assert echo_metrics(prober) == {"echo_loss": 100.0}
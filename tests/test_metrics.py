@@ -0,0 +1,72 @@
+import http.client
+
+import pytest
+
+from wifi_heat_mapper import metrics
+
+
+@pytest.fixture
+def server():
+    server = metrics.MetricsServer(metrics.Registry(), port=0)
+    server.start()
+    # record_point, record_benchmark and record_retry use the module registry.
+    metrics.registry = server.server.registry
+    yield server
+    metrics.registry = None
+    server.stop()
+
+
+def scrape(server, path="/metrics"):
+    connection = http.client.HTTPConnection(server.host, server.port, timeout=5)
+    try:
+        connection.request("GET", path)
+        response = connection.getresponse()
+        return response.status, response.getheader("Content-Type"), response.read().decode("utf-8")
+    finally:
+        connection.close()
+
+
+def test_exporter_serves_openmetrics(server):
+    metrics.record_point({"wlan0": -52})
+    metrics.record_benchmark("tcp", 3.0, {"download_bits_tcp": 9.5e7})
+    metrics.record_benchmark("tcp", 400.0, {"download_bits_tcp": 9.0e7})
+    metrics.record_retry("iperf3_busy")
+
+    status, content_type, body = scrape(server)
+    lines = body.splitlines()
+    assert status == 200
+    assert content_type == metrics.CONTENT_TYPE
+    assert lines[-1] == "# EOF"
+    assert "# TYPE whm_points counter" in lines
+    assert "whm_points_total 1.0" in lines
+    assert 'whm_retries_total{kind="iperf3_busy"} 1.0' in lines
+    assert 'whm_signal_strength_dbm{interface="wlan0"} -52.0' in lines
+    assert 'whm_last_value{metric="download_bits_tcp",mode="tcp"} 90000000.0' in lines
+    assert 'whm_benchmark_duration_seconds_bucket{mode="tcp",le="2.5"} 0' in lines
+    assert 'whm_benchmark_duration_seconds_bucket{mode="tcp",le="5.0"} 1' in lines
+    assert 'whm_benchmark_duration_seconds_bucket{mode="tcp",le="300.0"} 1' in lines
+    assert 'whm_benchmark_duration_seconds_bucket{mode="tcp",le="+Inf"} 2' in lines
+    assert 'whm_benchmark_duration_seconds_count{mode="tcp"} 2' in lines
+    assert 'whm_benchmark_duration_seconds_sum{mode="tcp"} 403.0' in lines
+
+
+def test_exporter_rejects_other_paths(server):
+    status, _, _ = scrape(server, "/other")
+    assert status == 404
+
+
+def test_recording_without_exporter_is_a_no_op():
+    assert metrics.registry is None
+    metrics.record_point({"wlan0": -52})
+    metrics.record_retry("speedtest")
+
+
+def test_start_exporter_records_into_its_registry():
+    server = metrics.start_exporter(port=0)
+    try:
+        metrics.record_retry("speedtest")
+        _, _, body = scrape(server)
+        assert 'whm_retries_total{kind="speedtest"} 1.0' in body.splitlines()
+    finally:
+        metrics.stop_exporter(server)
+    assert metrics.registry is None
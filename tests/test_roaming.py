@@ -0,0 +1,30 @@
+from wifi_heat_mapper.roaming import RoamListener
+
+
+def event(t, message, interface="wlan0"):
+    return "{0:.6f}: {1} (phy #0): {2}".format(t, interface, message)
+
+
+def test_roam_listener_metrics():
+    listener = RoamListener()
+    assert listener.add_line(event(10.0, "connected to 02:00:00:00:00:01"))
+    assert listener.add_line(event(12.0, "disconnected (by AP) reason: 3"))
+    assert listener.add_line(event(12.5, "connected to 02:00:00:00:00:02"))
+    assert listener.add_line(event(13.0, "connected to 02:00:00:00:00:03", interface="wlan1"))
+    assert not listener.add_line(event(14.0, "new station 02:00:00:00:00:04"))
+    assert not listener.add_line("not an event")
+
+    metrics = listener.metrics("wlan0", 11.0, 15.0)
+    assert metrics["roam_count"] == 1
+    assert metrics["disconnected_ms"] == 500.0
+    assert metrics["roam_events"] == [[12.0, "disconnected", None], [12.5, "roamed", "02:00:00:00:00:02"]]
+
+
+def test_roam_listener_keeps_newest_events():
+    listener = RoamListener(max_events=3)
+    for second in range(5):
+        listener.add_line(event(float(second), "connected to 02:00:00:00:00:0{0}".format(second)))
+    assert [t for t, *_ in listener.events] == [2.0, 3.0, 4.0]
+    before, events = listener.window("wlan0", 3.0, 4.0)
+    assert before == [(2.0, "wlan0", "connected", "02:00:00:00:00:02")]
+    assert [t for t, *_ in events] == [3.0, 4.0]
@@ -0,0 +1,64 @@
+import matplotlib.pyplot as plt
+
+from wifi_heat_mapper.misc import parse_iw_scan, frequency_to_channel
+from wifi_heat_mapper.gui import scan_metrics
+from wifi_heat_mapper.graph import best_server_colormap
+
+
+SCAN = """BSS 02:00:00:00:00:01(on wlan0) -- associated
+\tfreq: 2437
+\tsignal: -45.00 dBm
+\tSSID: Home
+BSS 02:00:00:00:00:02(on wlan0)
+\tfreq: 2437.0
+\tsignal: -70.00 dBm
+\tSSID: Neighbour
+BSS 02:00:00:00:00:03(on wlan0)
+\tfreq: 5985
+\tsignal: -60.00 dBm
+\tSSID: Home
+BSS 02:00:00:00:00:04(on wlan0)
+\tfreq: 5745
+\tsignal: -65.00 dBm
+BSS 02:00:00:00:00:05(on wlan0)
+\tfreq: 5180
+"""
+
+
+def test_frequency_to_channel():
+    assert frequency_to_channel(2412) == 1
+    assert frequency_to_channel(2437) == 6
+    assert frequency_to_channel(2484) == 14
+    assert frequency_to_channel(5180) == 36
+    assert frequency_to_channel(5745) == 149
+    assert frequency_to_channel(5935) == 2
+    assert frequency_to_channel(5955) == 1
+    assert frequency_to_channel(6695) == 149
+    assert frequency_to_channel(900) == 0
+
+
+def test_parse_iw_scan():
+    table = parse_iw_scan(SCAN)
+    assert set(table) == {"02:00:00:00:00:01", "02:00:00:00:00:02", "02:00:00:00:00:03", "02:00:00:00:00:04"}
+    assert table["02:00:00:00:00:01"] == {"ssid": "Home", "signal": -45.0, "frequency": 2437, "channel": 6}
+    assert table["02:00:00:00:00:02"]["frequency"] == 2437
+    assert table["02:00:00:00:00:03"]["channel"] == 7
+    assert table["02:00:00:00:00:04"]["ssid"] == ""
+
+
+def test_scan_co_channel_compares_frequencies():
+    table = parse_iw_scan(SCAN)
+    # 6 GHz channel 149 shares its number with 5 GHz channel 149.
+    table["02:00:00:00:00:06"] = {"ssid": "Home", "signal": -80.0, "frequency": 6695, "channel": 149}
+    iw = {"channel": 149, "channel_frequency": 5745, "ssid_mac": "02:00:00:00:00:04"}
+    assert scan_metrics(iw, table)["scan_co_channel"] == 0
+    iw = {"channel": 6, "channel_frequency": 2437, "ssid_mac": "02:00:00:00:00:01"}
+    metrics = scan_metrics(iw, table)
+    assert metrics["scan_co_channel"] == 1
+    assert metrics["scan_ap_count"] == 5
+
+
+def test_best_server_colors_are_distinct():
+    for count in (3, 15, 32):
+        colors = plt.get_cmap(best_server_colormap(count), count)
+        assert len({colors(index) for index in range(count)}) == count
@@ -0,0 +1,75 @@
+import pytest
+
+from wifi_heat_mapper.misc import ExternalError, ServerBusyError
+from wifi_heat_mapper.servers import IperfServerPool
+from wifi_heat_mapper.perf import benchmark_iperf_setup
+
+
+SERVERS = [("10.0.0.1", 5201), ("10.0.0.2", 5201)]
+
+
+def new_pool(**kwargs):
+    return IperfServerPool(SERVERS, backoff=0.01, max_backoff=0.05, max_wait=2.0, **kwargs)
+
+
+def test_pool_spreads_tests_across_servers():
+    pool = new_pool(check=lambda *_: True)
+    endpoints = [pool.run(lambda iperf_ip, **_: iperf_ip)[1] for _ in range(4)]
+    assert sorted(endpoints) == ["10.0.0.1:5201", "10.0.0.1:5201", "10.0.0.2:5201", "10.0.0.2:5201"]
+
+
+def test_pool_check_reports_unreachable_servers():
+    pool = new_pool(check=lambda ip, _port: ip == "10.0.0.2")
+    assert pool.check() == ["10.0.0.2:5201"]
+    assert pool.run(lambda iperf_ip, **_: iperf_ip) == ("10.0.0.2", "10.0.0.2:5201")
+
+
+def test_pool_retries_busy_server():
+    pool = IperfServerPool(SERVERS[:1], backoff=0.01, max_backoff=0.05, max_wait=2.0, check=lambda *_: True)
+    calls = []
+
+    def test(iperf_ip, **_):
+        calls.append(iperf_ip)
+        if len(calls) < 3:
+            raise ServerBusyError("busy")
+        return "done"
+
+    assert pool.run(test) == ("done", "10.0.0.1:5201")
+    assert len(calls) == 3
+    assert pool.servers[0]["busy"] == 0
+
+
+def test_pool_fails_over_and_raises_without_healthy_server():
+    pool = new_pool(check=lambda *_: False)
+
+    def test(iperf_ip, **_):
+        if iperf_ip == "10.0.0.1":
+            raise ExternalError("failed")
+        return iperf_ip
+
+    results = {pool.run(test)[0] for _ in range(3)}
+    assert results == {"10.0.0.2"}
+    assert not pool.servers[0]["healthy"]
+
+    pool = new_pool(check=lambda *_: False)
+
+    def fail(**_):
+        raise ExternalError("failed")
+
+    with pytest.raises(ExternalError):
+        pool.run(fail)
+
+
+def test_benchmark_iperf_setup_runs_through_the_pool():
+    report = benchmark_iperf_setup(count=20)
+    assert report["tests"] == 20
+    assert report["fresh"] > 0
+    assert report["runner"] > 0
+
+
+def test_interface_pool_uses_its_own_ports():
+    pool = new_pool(check=lambda *_: True)
+    interface_pool = pool.for_interface(2)
+    assert interface_pool is pool.for_interface(2)
+    assert interface_pool.run(lambda iperf_port, **_: iperf_port)[0] == 5203
+    assert pool.for_interface(1, [("10.0.0.3", 5201)]).check() == ["10.0.0.3:5201"]
@@ -0,0 +1,75 @@
+from wifi_heat_mapper.misc import parse_station_dump
+from wifi_heat_mapper.gui import station_metrics
+
+
+STATION_DUMP = """Station aa:bb:cc:dd:ee:ff (on wlan0)
+\tinactive time:\t10 ms
+\ttx packets:\t{packets}
+\ttx retries:\t{retries}
+\ttx failed:\t{failed}
+\tbeacon loss:\t{beacon_loss}
+\tsignal avg:\t-52 dBm
+\ttx bitrate:\t{tx_rate}
+\trx bitrate:\t{rx_rate}
+\texpected throughput:\t48.828Mbps
+"""
+
+
+def station_dump(packets=1000, retries=100, failed=5, beacon_loss=0,
+                 tx_rate="866.7 MBit/s VHT-MCS 9 80MHz short GI VHT-NSS 2", rx_rate="144.4 MBit/s MCS 15 short GI"):
+    return STATION_DUMP.format(packets=packets, retries=retries, failed=failed, beacon_loss=beacon_loss,
+                               tx_rate=tx_rate, rx_rate=rx_rate).replace("\t", " ")
+
+
+def test_parse_station_dump_rates_and_counters():
+    metrics = parse_station_dump(station_dump())
+    assert metrics["tx_bitrate_bits"] == 866.7e6
+    assert metrics["tx_mcs"] == 9
+    assert metrics["tx_nss"] == 2
+    assert metrics["channel_width"] == 80
+    assert metrics["expected_throughput_bits"] == 48.828e6
+    assert metrics["tx_packets"] == 1000
+    assert metrics["tx_retries"] == 100
+    assert metrics["tx_failed"] == 5
+    assert metrics["beacon_loss"] == 0
+    assert "tx_retry_percent" not in metrics
+
+
+def test_parse_station_dump_ht_mcs_per_stream():
+    metrics = parse_station_dump(station_dump())
+    assert metrics["rx_mcs"] == 7
+    assert metrics["rx_nss"] == 2
+
+
+def test_parse_station_dump_legacy_rate_has_no_mcs():
+    metrics = parse_station_dump(station_dump(tx_rate="54.0 MBit/s", rx_rate="6.0 MBit/s"))
+    assert metrics["tx_bitrate_bits"] == 54e6
+    assert metrics["channel_width"] == 20
+    for key in ("tx_mcs", "rx_mcs", "tx_nss", "rx_nss"):
+        assert key not in metrics
+
+
+def reading(bssid="aa:bb:cc:dd:ee:ff", **counters):
+    return {"ssid_mac": bssid, "station": parse_station_dump(station_dump(**counters))}
+
+
+def test_station_metrics_uses_change_over_benchmarks():
+    start = reading(packets=1000, retries=100, failed=5, beacon_loss=1)
+    end = reading(packets=3000, retries=300, failed=25, beacon_loss=3)
+    metrics = station_metrics(start, end)
+    assert metrics["tx_retries"] == 200
+    assert metrics["tx_failed"] == 20
+    assert metrics["beacon_loss"] == 2
+    assert metrics["tx_retry_percent"] == 10
+    assert metrics["tx_failed_percent"] == 1
+    assert "tx_packets" not in metrics
+    assert metrics["tx_mcs"] == 9
+
+
+def test_station_metrics_drops_counters_after_reassociation():
+    start = reading(packets=1000, retries=100)
+    for end in (reading(packets=50, retries=1), reading(bssid="11:22:33:44:55:66", packets=3000, retries=300), None):
+        metrics = station_metrics(start, end)
+        for key in ("tx_retries", "tx_failed", "beacon_loss", "tx_retry_percent", "tx_failed_percent"):
+            assert key not in metrics
+        assert metrics["tx_bitrate_bits"] == 866.7e6
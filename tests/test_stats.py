@@ -0,0 +1,59 @@
+import statistics
+import math
+
+import pytest
+
+from wifi_heat_mapper.stats import RunningStats, pack_samples, unpack_samples
+
+
+SAMPLES = [94.1, 97.3, 95.8, 96.2, 93.9, 95.1]
+
+
+def running(values):
+    stats = RunningStats()
+    for value in values:
+        stats.add(value)
+    return stats
+
+
+def test_running_stats_match_batch_statistics():
+    stats = running(SAMPLES)
+    assert stats.count == len(SAMPLES)
+    assert stats.mean == pytest.approx(statistics.mean(SAMPLES))
+    assert stats.variance == pytest.approx(statistics.variance(SAMPLES))
+
+
+def test_running_stats_half_width():
+    stats = running(SAMPLES)
+    # t(0.975, 5) = 2.5706
+    expected = 2.5706 * statistics.stdev(SAMPLES) / len(SAMPLES) ** 0.5
+    assert stats.half_width() == pytest.approx(expected, rel=1e-4)
+    assert stats.half_width(0.99) > stats.half_width(0.95)
+
+
+def test_running_stats_need_two_samples():
+    stats = running([95.0])
+    assert stats.variance is None
+    assert stats.half_width() is None
+    assert not stats.converged(0.5)
+
+
+def test_running_stats_converged():
+    assert running(SAMPLES).converged(0.05)
+    assert not running(SAMPLES).converged(0.001)
+    assert not running([10.0, 90.0, 20.0]).converged(0.05)
+
+
+def test_pack_samples_round_trip():
+    values = [-52.0, 0.5, 941000000.0, float("inf")]
+    packed = pack_samples(values)
+    assert isinstance(packed, str)
+    assert unpack_samples(packed) == values
+    assert unpack_samples(pack_samples([])) == []
+
+
+def test_pack_samples_are_little_endian_float32():
+    assert pack_samples([1.0]) == "AACAPw=="
+    # float32 keeps about 7 significant digits.
+    assert unpack_samples(pack_samples([0.1]))[0] == pytest.approx(0.1, rel=1e-7)
+    assert math.isnan(unpack_samples(pack_samples([float("nan")]))[0])
@@ -0,0 +1,54 @@
+from wifi_heat_mapper.misc import parse_iw_survey
+from wifi_heat_mapper.gui import survey_metrics
+
+
+SURVEY_DUMP = """Survey data from wlan0
+\tfrequency:\t\t\t5180 MHz
+Survey data from wlan0
+\tfrequency:\t\t\t5500 MHz [in use]
+\tnoise:\t\t\t\t-92 dBm
+\tchannel active time:\t\t{active} ms
+\tchannel busy time:\t\t{busy} ms
+\tchannel receive time:\t\t{receive} ms
+\tchannel transmit time:\t\t{transmit} ms
+Survey data from wlan0
+\tfrequency:\t\t\t5520 MHz
+\tnoise:\t\t\t\t-95 dBm
+"""
+
+
+def reading(frequency=5500, **times):
+    iw = {"signal_strength": -52, "channel_frequency": frequency}
+    iw.update(parse_iw_survey(SURVEY_DUMP.format(**times)))
+    return iw
+
+
+def test_parse_iw_survey_reads_in_use_channel():
+    survey = parse_iw_survey(SURVEY_DUMP.format(active=1000, busy=300, receive=200, transmit=50))
+    assert survey == {"noise": -92, "channel_active_time": 1000, "channel_busy_time": 300,
+                      "channel_receive_time": 200, "channel_transmit_time": 50}
+
+
+def test_parse_iw_survey_without_in_use_channel():
+    assert parse_iw_survey("Survey data from wlan0\n\tfrequency:\t5180 MHz\n") == {}
+
+
+def test_survey_metrics_uses_change_over_benchmarks():
+    start = reading(active=100000, busy=90000, receive=80000, transmit=1000)
+    end = reading(active=110000, busy=92000, receive=81000, transmit=1500)
+    metrics = survey_metrics(start, end)
+    assert metrics["noise_floor"] == -92
+    assert metrics["snr"] == 40
+    assert metrics["channel_busy_percent"] == 20
+    assert metrics["channel_rx_percent"] == 10
+    assert metrics["channel_tx_percent"] == 5
+
+
+def test_survey_metrics_drops_utilization_after_channel_change():
+    start = reading(active=100000, busy=90000, receive=80000, transmit=1000)
+    for end in (reading(frequency=5180, active=110000, busy=92000, receive=81000, transmit=1500),
+                reading(active=100000, busy=90000, receive=80000, transmit=1000),
+                reading(active=500, busy=100, receive=50, transmit=10),
+                None):
+        metrics = survey_metrics(start, end)
+        assert metrics == {"noise_floor": -92, "snr": 40}
@@ -0,0 +1,570 @@
+from wifi_heat_mapper import misc
+from wifi_heat_mapper.misc import SpeedTestMode, ParseError, ExternalError, ServerBusyError, frequency_to_channel
+from wifi_heat_mapper.misc import parse_iw, parse_iw_scan
+from collections import defaultdict, deque
+from abc import ABC, abstractmethod
+import threading
+import json
+import random
+import math
+import time
+import logging
+
+
+class Backend(ABC):
+    """Base class of the measurement backends.
+
+    A backend takes the wireless metrics, scans, iperf3 tests and
+    speedtests of a survey. The results use the layout of the
+    functions of the same name in misc.
+    """
+    unsupported_modes = ()
+
+    def end_point(self, position):
+        """Called once the benchmarks of a point are done.
+
+        Args:
+            position (tuple): (x, y) of the point, None if the
+            point was discarded.
+        """
+        logging.debug("Benchmarks done at {0}".format(position))
+
+    def close(self):
+        """Called once the survey is done."""
+        logging.debug("Closed {0}".format(type(self).__name__))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @abstractmethod
+    def process_iw(self, target_interface):
+        """Get metrics from a wireless interface, see misc.process_iw."""
+
+    @abstractmethod
+    def scan_iw(self, target_interface):
+        """Scan for access points, see misc.scan_iw."""
+
+    @abstractmethod
+    def verify_iperf(self, ip, port):
+        """Check if an iperf3 server is reachable, see
+        misc.verify_iperf."""
+
+    @abstractmethod
+    def run_iperf(self, ip, port, bind_address, **options):
+        """Run an iperf3 test with libiperf, see misc.run_iperf."""
+
+    @abstractmethod
+    def run_iperf_stream(self, ip, port, bind_address, **options):
+        """Run an iperf3 test with the iperf3 binary, see
+        misc.run_iperf_stream."""
+
+    @abstractmethod
+    def probe_udp_capacity(self, ip, port, bind_address, **options):
+        """Search for the UDP capacity, see misc.probe_udp_capacity."""
+
+    @abstractmethod
+    def run_speedtest(self, mode, bind_address, **options):
+        """Run a speedtest, see misc.run_speedtest."""
+
+    @abstractmethod
+    def get_speedtest_server(self, mode, speedtest_result, libre_speed_server_list=None):
+        """Get the server a speedtest ran against, see
+        misc.get_speedtest_server."""
+
+
+class SystemBackend(Backend):
+    """Measures with the wireless interfaces and tools of this
+    machine."""
+    def process_iw(self, target_interface):
+        return parse_iw(self.read_iw(target_interface))
+
+    def read_iw(self, target_interface):
+        """Get the output of the iw commands, see misc.read_iw."""
+        return misc.read_iw(target_interface)
+
+    def scan_iw(self, target_interface):
+        return parse_iw_scan(self.read_iw_scan(target_interface))
+
+    def read_iw_scan(self, target_interface):
+        """Get the output of iw scan, see misc.read_iw_scan."""
+        return misc.read_iw_scan(target_interface)
+
+    def verify_iperf(self, ip, port):
+        return misc.verify_iperf(ip, port)
+
+    def run_iperf(self, ip, port, bind_address, **options):
+        return misc.run_iperf(ip, port, bind_address, **options)
+
+    def run_iperf_stream(self, ip, port, bind_address, **options):
+        return misc.run_iperf_stream(ip, port, bind_address, **options)
+
+    def probe_udp_capacity(self, ip, port, bind_address, **options):
+        return misc.probe_udp_capacity(ip, port, bind_address, **options)
+
+    def run_speedtest(self, mode, bind_address, **options):
+        return misc.run_speedtest(mode, bind_address, **options)
+
+    def get_speedtest_server(self, mode, speedtest_result, libre_speed_server_list=None):
+        return misc.get_speedtest_server(mode, speedtest_result, libre_speed_server_list)
+
+
+class SimulatedBackend(Backend):
+    """Produces synthetic measurements from a log-distance path
+    loss model over the floor map, so surveys can run without a
+    wireless interface, iperf3 server or internet connection.
+
+    The client connects to the access point with the strongest
+    signal at its position, set with move_to. The signal is
+    tx_power minus the path loss and a random shadowing term, and
+    the throughput follows the Shannon capacity of the SNR on an
+    80 MHz channel.
+
+    Args:
+        size (tuple): (width, height) of the floor map in pixels.
+        ssid (str): SSID of the simulated network.
+        aps (int), optional: Number of access points placed at
+        random. Defaults to 3.
+        scale (float), optional: Meters per pixel. Defaults to
+        None which makes the longer side of the map 40 m.
+        seed (int), optional: Seed of the random generator.
+        Defaults to None.
+        latency (float), optional: Mean time in seconds every
+        tool call takes. Defaults to 0.
+        failure_rate (float), optional: Probability of a failed
+        iperf3 test (busy server) or speedtest. Defaults to 0.
+        tx_power (float), optional: Access point transmit power
+        in dBm. Defaults to 20.
+        exponent (float), optional: Path loss exponent. Defaults
+        to 3.
+        shadowing (float), optional: Standard deviation of the
+        shadowing in dB. Defaults to 2.
+        noise (float), optional: Noise floor in dBm. Defaults to
+        -95.
+    """
+    unsupported_modes = ("latency", "echo", "roaming")
+    channels = (36, 52, 100, 116, 132, 149)
+    max_phy_rate = 866.7e6
+    width = 80
+
+    def __init__(self, size, ssid, aps=3, scale=None, seed=None, latency=0.0, failure_rate=0.0, tx_power=20.0,
+                 exponent=3.0, shadowing=2.0, noise=-95.0):
+        self.size = size
+        self.ssid = ssid
+        self.scale = scale if scale is not None else 40.0 / max(size)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.tx_power = tx_power
+        self.exponent = exponent
+        self.shadowing = shadowing
+        self.noise = noise
+        self.random = random.Random(seed)
+        self.aps = [{
+            "bssid": "02:00:00:00:01:{0:02x}".format(index),
+            "x": self.random.uniform(0, size[0]),
+            "y": self.random.uniform(0, size[1]),
+            "frequency": 5000 + 5 * self.channels[index % len(self.channels)],
+        } for index in range(aps)]
+        self.position = (size[0] / 2, size[1] / 2)
+        self.speedtests = 0
+        self.counters = {"tx_packets": 0, "tx_retries": 0, "tx_failed": 0, "beacon_loss": 0}
+        self.survey = {"channel_active_time": 0, "channel_busy_time": 0, "channel_receive_time": 0,
+                       "channel_transmit_time": 0}
+        self._lock = threading.Lock()
+
+    def move_to(self, x, y):
+        """Move the simulated client to a position on the floor
+        map."""
+        self.position = (x, y)
+
+    def signal(self, ap):
+        """Get the signal of an access point at the current
+        position in dBm."""
+        distance = max(math.hypot(ap["x"] - self.position[0], ap["y"] - self.position[1]) * self.scale, 1.0)
+        reference = 20 * math.log10(ap["frequency"]) - 27.55
+        with self._lock:
+            shadowing = self.random.gauss(0, self.shadowing)
+        return self.tx_power - reference - 10 * self.exponent * math.log10(distance) + shadowing
+
+    def capacity(self, signal):
+        """Get the link capacity in bits/s for a signal in dBm."""
+        snr = 10 ** ((signal - self.noise) / 10)
+        return min(self.width * 1e6 * math.log2(1 + snr) * 0.75, self.max_phy_rate)
+
+    def connected(self):
+        """Get the access point the client is connected to and its
+        signal."""
+        signals = [(self.signal(ap), ap) for ap in self.aps]
+        return max(signals, key=lambda item: item[0])
+
+    def process_iw(self, target_interface):
+        self._wait()
+        signal, ap = self.connected()
+        phy_rate = self.capacity(signal)
+        mcs = max(0, min(9, int((signal - self.noise) / 4) - 1))
+        nss = 2 if signal - self.noise > 25 else 1
+        # The station counters grow since association, faster where the signal is weak.
+        retry_rate = max(0.0, min(0.5, (30 - (signal - self.noise)) / 60))
+        # The channel is busier where more access points are heard well.
+        busy = 0.1 + 0.1 * len([other for other in self.aps if self.signal(other) > self.noise + 20])
+        with self._lock:
+            active = self.random.randint(800, 1200)
+            self.survey["channel_active_time"] += active
+            self.survey["channel_busy_time"] += int(active * min(busy, 0.9))
+            self.survey["channel_receive_time"] += int(active * min(busy, 0.9) * 0.6)
+            self.survey["channel_transmit_time"] += int(active * 0.05)
+            survey = dict(self.survey)
+            packets = self.random.randint(500, 1500)
+            self.counters["tx_packets"] += packets
+            self.counters["tx_retries"] += int(packets * retry_rate)
+            self.counters["tx_failed"] += int(packets * retry_rate / 20)
+            self.counters["beacon_loss"] += int(retry_rate > 0.25)
+            counters = dict(self.counters)
+        return {
+            **survey,
+            "interface": target_interface,
+            "interface_mac": "02:00:00:00:00:01",
+            "channel": frequency_to_channel(ap["frequency"]),
+            "channel_frequency": ap["frequency"],
+            "ssid": self.ssid,
+            "ssid_mac": ap["bssid"],
+            "signal_strength": round(signal),
+            "station": {
+                **counters,
+                "expected_throughput_bits": phy_rate * 0.65,
+                "tx_bitrate_bits": phy_rate,
+                "rx_bitrate_bits": phy_rate,
+                "tx_mcs": mcs,
+                "rx_mcs": mcs,
+                "tx_nss": nss,
+                "rx_nss": nss,
+                "channel_width": self.width,
+            },
+            "noise": int(self.noise),
+        }
+
+    def scan_iw(self, target_interface):
+        self._wait()
+        table = {}
+        for ap in self.aps:
+            signal = self.signal(ap)
+            if signal < self.noise + 5:
+                continue
+            table[ap["bssid"]] = {
+                "ssid": self.ssid,
+                "signal": round(signal, 2),
+                "frequency": ap["frequency"],
+                "channel": frequency_to_channel(ap["frequency"]),
+            }
+        return table
+
+    def verify_iperf(self, ip, port):
+        return True
+
+    def run_iperf(self, ip, port, bind_address, download=True, protocol="tcp", num_streams=1, duration=None,
+                  bandwidth=None, bidirectional=False, **options):
+        self._wait()
+        if self._failed():
+            raise ServerBusyError("iperf3 server {0}:{1} is busy".format(ip, port))
+        return self.iperf_result(download, protocol, num_streams, duration or 10, bandwidth, bidirectional)
+
+    def run_iperf_stream(self, ip, port, bind_address, download=True, protocol="tcp", num_streams=1, duration=10,
+                         bandwidth=None, bidirectional=False, **options):
+        return self.run_iperf(ip, port, bind_address, download=download, protocol=protocol, num_streams=num_streams,
+                              duration=duration, bandwidth=bandwidth, bidirectional=bidirectional)
+
+    def probe_udp_capacity(self, ip, port, bind_address, download=True, loss_threshold=1.0, **options):
+        self._wait()
+        if self._failed():
+            raise ServerBusyError("iperf3 server {0}:{1} is busy".format(ip, port))
+        signal, _ = self.connected()
+        return {
+            "rate": int(self.capacity(signal) * 0.7 * self._variation()),
+            "lost_percent": self.random.uniform(0, loss_threshold),
+            "jitter_ms": self.random.uniform(0.1, 2.0),
+            "probes": self.random.randint(6, 12),
+        }
+
+    def run_speedtest(self, mode, bind_address, **options):
+        self._wait()
+        if self._failed():
+            raise ParseError("Simulated speedtest failed")
+        signal, _ = self.connected()
+        download = min(self.capacity(signal) * 0.6, 500e6) * self._variation()
+        upload = min(self.capacity(signal) * 0.5, 100e6) * self._variation()
+        latency = 10 + self.random.uniform(0, 5) + max(0, self.noise + 30 - signal) / 5
+        jitter = self.random.uniform(0.5, 3.0)
+        self.speedtests += 1
+        if mode == SpeedTestMode.OOKLA:
+            return {
+                "ping": {"jitter": jitter, "latency": latency},
+                "download": {"bandwidth": download / 8, "bytes": int(download), "elapsed": 10000},
+                "upload": {"bandwidth": upload / 8, "bytes": int(upload), "elapsed": 10000},
+                "server": {"id": 1, "name": "Simulated"},
+            }
+        if mode == SpeedTestMode.SIVEL:
+            return {
+                "server": {"id": "1", "name": "Simulated", "latency": latency},
+                "download": download,
+                "upload": upload,
+                "bytes_received": int(download),
+                "bytes_sent": int(upload),
+            }
+        return {
+            "server": {"name": "Simulated", "url": "http://simulated/"},
+            "jitter": jitter,
+            "ping": latency,
+            "download": download / (1 << 20),
+            "upload": upload / (1 << 20),
+            "bytes_received": int(download),
+            "bytes_sent": int(upload),
+        }
+
+    def get_speedtest_server(self, mode, speedtest_result, libre_speed_server_list=None):
+        return ("1", "Simulated")
+
+    def iperf_result(self, download, protocol, num_streams, duration, bandwidth=None, bidirectional=False):
+        """Build an iperf3 json result from the link capacity at
+        the current position.
+
+        Args:
+            download (bool): True if testing download.
+            protocol (str): 'tcp' or 'udp'.
+            num_streams (int): Number of parallel streams.
+            duration (int): Test duration in seconds.
+            bandwidth (int), optional: UDP target bandwidth in
+            bits/s. Defaults to None which uses 1 Mbit/s like
+            iperf3.
+            bidirectional (bool), optional: True to test both
+            directions at once. Defaults to False.
+
+        Returns:
+            dict: Dictionary in the layout of the iperf3 json
+            output.
+        """
+        signal, _ = self.connected()
+        goodput = self.capacity(signal) * (0.65 if protocol == "tcp" else 0.7)
+        directions = [(not download, goodput * (1.0 if download else 0.85))]
+        if bidirectional:
+            directions = [(True, goodput * 0.45), (False, goodput * 0.5)]
+        result = {
+            "start": {"test_start": {"protocol": protocol.upper(), "num_streams": num_streams, "duration": duration}},
+            "intervals": [{"streams": [], "sum": {}} for _ in range(duration)],
+            "end": {"streams": []},
+        }
+        for sender, goodput_rate in directions:
+            rate = goodput_rate
+            loss = 0.0
+            if protocol == "udp":
+                target = bandwidth or 1000000
+                loss = max(0.0, 1 - rate / target) * 100
+                rate = min(rate, target)
+            suffix = "" if sender or not bidirectional else "_bidir_reverse"
+            rates = [rate * self._variation() for _ in range(duration)]
+            for second, interval in enumerate(result["intervals"]):
+                streams = [dict(self._summary(protocol, sender, second, 1, rates[second] / num_streams, loss),
+                                socket=5 + index) for index in range(num_streams)]
+                if protocol == "tcp" and sender:
+                    for stream in streams:
+                        stream["snd_cwnd"] = int(rates[second] / num_streams * 0.02 / 8)
+                interval["streams"] += streams
+                interval["sum" + suffix] = self._summary(protocol, sender, second, 1, rates[second], loss)
+            mean = sum(rates) / duration
+            if protocol == "tcp":
+                result["end"]["sum_sent" + suffix] = self._summary(protocol, sender, 0, duration, mean, loss)
+                result["end"]["sum_received" + suffix] = self._summary(protocol, sender, 0, duration, mean, loss)
+                for index in range(num_streams):
+                    result["end"]["streams"].append({
+                        "sender": self._summary(protocol, sender, 0, duration, mean / num_streams, loss),
+                        "receiver": self._summary(protocol, sender, 0, duration, mean / num_streams, loss),
+                    })
+            else:
+                result["end"]["sum" + suffix] = self._summary(protocol, sender, 0, duration, mean, loss, end=True)
+                for index in range(num_streams):
+                    result["end"]["streams"].append(
+                        {"udp": self._summary(protocol, sender, 0, duration, mean / num_streams, loss, end=True)})
+        return result
+
+    def _summary(self, protocol, sender, start, seconds, rate, loss, end=False):
+        summary = {
+            "start": start,
+            "end": start + seconds,
+            "seconds": seconds,
+            "bytes": int(rate * seconds / 8),
+            "bits_per_second": rate,
+            "omitted": False,
+            "sender": sender,
+        }
+        if protocol == "tcp" and sender:
+            summary["retransmits"] = int(self.random.expovariate(1.0) * seconds)
+        if protocol == "udp":
+            summary["packets"] = max(1, int(rate * seconds / 8 / 1448))
+            if end or not sender:
+                summary["jitter_ms"] = self.random.uniform(0.05, 1.0)
+                summary["lost_packets"] = int(summary["packets"] * loss / 100)
+                summary["lost_percent"] = loss
+        return summary
+
+    def _variation(self):
+        with self._lock:
+            return max(0.0, self.random.gauss(1.0, 0.05))
+
+    def _failed(self):
+        with self._lock:
+            return self.random.random() < self.failure_rate
+
+    def _wait(self):
+        if self.latency > 0:
+            with self._lock:
+                delay = self.random.uniform(0.5, 1.5) * self.latency
+            time.sleep(delay)
+
+
+class RecordingBackend(SystemBackend):
+    """Measures like SystemBackend and appends the raw output of
+    every tool to a capture file for ReplayBackend.
+
+    Every line of the capture file is a json object with the
+    'call', the 'key' (interface, bind address or speedtest mode)
+    and either the 'output' of the tool or the 'error' it raised.
+    A 'point' line with the 'position' closes every point.
+
+    Args:
+        capture_file (str): Path to the capture file. Existing
+        captures are appended to.
+    """
+    def __init__(self, capture_file):
+        self.capture_file = capture_file
+        self._lock = threading.Lock()
+
+    def end_point(self, position):
+        self._record("point", None, position=position)
+
+    def read_iw(self, target_interface):
+        return self._capture("iw", target_interface, super().read_iw, target_interface)
+
+    def read_iw_scan(self, target_interface):
+        return self._capture("scan", target_interface, super().read_iw_scan, target_interface)
+
+    def run_iperf(self, ip, port, bind_address, **options):
+        return self._capture("iperf", bind_address, super().run_iperf, ip, port, bind_address, **options)
+
+    def run_iperf_stream(self, ip, port, bind_address, **options):
+        return self._capture("iperf", bind_address, super().run_iperf_stream, ip, port, bind_address, **options)
+
+    def probe_udp_capacity(self, ip, port, bind_address, **options):
+        return self._capture("udp_probe", bind_address, super().probe_udp_capacity, ip, port, bind_address,
+                             **options)
+
+    def run_speedtest(self, mode, bind_address, **options):
+        return self._capture("speedtest", bind_address, super().run_speedtest, mode, bind_address, **options)
+
+    def get_speedtest_server(self, mode, speedtest_result, libre_speed_server_list=None):
+        return self._capture("speedtest_server", int(mode), super().get_speedtest_server, mode, speedtest_result,
+                             libre_speed_server_list)
+
+    def _capture(self, call, key, function, *args, **kwargs):
+        try:
+            output = function(*args, **kwargs)
+        except (ParseError, ExternalError) as error:
+            self._record(call, key, error={"type": type(error).__name__, "message": str(error)})
+            raise
+        self._record(call, key, output=output)
+        return output
+
+    def _record(self, call, key, **fields):
+        line = json.dumps(dict(call=call, key=key, t=time.time(), **fields))
+        # Every line is written through, so a crashed survey keeps its capture.
+        with self._lock, open(self.capture_file, "a") as f:
+            f.write(line + "\n")
+
+
+class ReplayBackend(Backend):
+    """Feeds the outputs of a RecordingBackend capture file back
+    through the parsers and result extraction at full speed.
+
+    Outputs are replayed in recorded order for every call and
+    key, and recorded errors are raised again.
+
+    Args:
+        capture_file (str): Path to the capture file.
+    """
+    unsupported_modes = ("latency", "echo", "roaming")
+    errors = {
+        "ParseError": ParseError,
+        "ExternalError": ExternalError,
+        "ServerBusyError": ServerBusyError,
+    }
+
+    def __init__(self, capture_file):
+        self.points = []
+        self._queues = defaultdict(deque)
+        self._lock = threading.Lock()
+        with open(capture_file) as capture:
+            for line in capture:
+                if line.strip() == "":
+                    continue
+                record = json.loads(line)
+                if record["call"] == "point":
+                    self.points.append(record["position"])
+                else:
+                    self._queues[(record["call"], record["key"])].append(record)
+        logging.debug("Loaded {0} points from {1}".format(len(self.points), capture_file))
+
+    def process_iw(self, target_interface):
+        return parse_iw(self._next("iw", target_interface))
+
+    def scan_iw(self, target_interface):
+        return parse_iw_scan(self._next("scan", target_interface))
+
+    def verify_iperf(self, ip, port):
+        return True
+
+    def run_iperf(self, ip, port, bind_address, **options):
+        return self._next("iperf", bind_address)
+
+    def run_iperf_stream(self, ip, port, bind_address, **options):
+        return self._next("iperf", bind_address)
+
+    def probe_udp_capacity(self, ip, port, bind_address, **options):
+        return self._next("udp_probe", bind_address)
+
+    def run_speedtest(self, mode, bind_address, **options):
+        return self._next("speedtest", bind_address)
+
+    def get_speedtest_server(self, mode, speedtest_result, libre_speed_server_list=None):
+        return tuple(self._next("speedtest_server", int(mode)))
+
+    def _next(self, call, key):
+        with self._lock:
+            queue = self._queues[(call, key)]
+            if not queue:
+                raise ExternalError("The capture has no more {0} output for {1}".format(call, key))
+            record = queue.popleft()
+        if "error" in record:
+            raise self.errors.get(record["error"]["type"], ExternalError)(record["error"]["message"])
+        return record["output"]
+
+
+backend = SystemBackend()
+
+
+def get_backend():
+    """Get the backend taking the measurements."""
+    return backend
+
+
+def set_backend(new_backend):
+    """Replace the backend taking the measurements.
+
+    Args:
+        new_backend (Backend): the backend to use.
+
+    Returns:
+        None
+    """
+    global backend
+    backend = new_backend
+    logging.debug("Using {0}".format(type(new_backend).__name__))
@@ -1,5 +1,6 @@
 from wifi_heat_mapper.misc import TColor, check_application, process_iw, save_json, get_application_output
 from wifi_heat_mapper.misc import check_speedtest, SpeedTestMode, get_ip_address_from_interface, test_libre_speed
+from wifi_heat_mapper.misc import validate_ipv4
 from wifi_heat_mapper.debugger import log_arguments
 from wifi_heat_mapper import __version__
 from collections import OrderedDict
@@ -37,6 +38,188 @@ class ConfigurationOptions:
         "conversion": False,
         "reverse": False,
     }
+    configuration["tx_bitrate_bits"] = {
+        "description": "Wi-Fi PHY Tx Rate (in {0}/s)",
+        "requirements": ["base"],
+        "vmin": 0,
+        "mode": ["base"],
+        "conversion": True,
+        "reverse": False,
+        "optional": True,
+    }
+    configuration["rx_bitrate_bits"] = {
+        "description": "Wi-Fi PHY Rx Rate (in {0}/s)",
+        "requirements": ["base"],
+        "vmin": 0,
+        "mode": ["base"],
+        "conversion": True,
+        "reverse": False,
+        "optional": True,
+    }
+    configuration["expected_throughput_bits"] = {
+        "description": "Wi-Fi Expected Throughput (in {0}/s)",
+        "requirements": ["base"],
+        "vmin": 0,
+        "mode": ["base"],
+        "conversion": True,
+        "reverse": False,
+        "optional": True,
+    }
+    configuration["tx_mcs"] = {
+        "description": "Wi-Fi Tx MCS Index",
+        "requirements": ["base"],
+        "vmin": 0,
+        "mode": ["base"],
+        "conversion": False,
+        "reverse": False,
+        "optional": True,
+    }
+    configuration["rx_mcs"] = {
+        "description": "Wi-Fi Rx MCS Index",
+        "requirements": ["base"],
+        "vmin": 0,
+        "mode": ["base"],
+        "conversion": False,
+        "reverse": False,
+        "optional": True,
+    }
+    configuration["tx_nss"] = {
+        "description": "Wi-Fi Tx Spatial Streams",
+        "requirements": ["base"],
+        "vmin": 0,
+        "mode": ["base"],
+        "conversion": False,
+        "reverse": False,
+        "optional": True,
+    }
+    configuration["rx_nss"] = {
+        "description": "Wi-Fi Rx Spatial Streams",
+        "requirements": ["base"],
+        "vmin": 0,
+        "mode": ["base"],
+        "conversion": False,
+        "reverse": False,
+        "optional": True,
+    }
+    configuration["channel_width"] = {
+        "description": "Wi-Fi Channel Width (in MHz)",
+        "requirements": ["base"],
+        "vmin": 0,
+        "mode": ["base"],
+        "conversion": False,
+        "reverse": False,
+        "optional": True,
+    }
+    configuration["tx_retry_percent"] = {
+        "description": "Wi-Fi Tx Retries (in % of Tx Packets)",
+        "requirements": ["base"],
+        "vmin": 0,
+        "mode": ["base"],
+        "conversion": False,
+        "reverse": True,
+        "optional": True,
+    }
+    configuration["tx_failed_percent"] = {
+        "description": "Wi-Fi Tx Failed (in % of Tx Packets)",
+        "requirements": ["base"],
+        "vmin": 0,
+        "mode": ["base"],
+        "conversion": False,
+        "reverse": True,
+        "optional": True,
+    }
+    configuration["tx_retries"] = {
+        "description": "Wi-Fi Tx Retries",
+        "requirements": ["base"],
+        "vmin": 0,
+        "mode": ["base"],
+        "conversion": False,
+        "reverse": True,
+        "optional": True,
+    }
+    configuration["tx_failed"] = {
+        "description": "Wi-Fi Tx Failed",
+        "requirements": ["base"],
+        "vmin": 0,
+        "mode": ["base"],
+        "conversion": False,
+        "reverse": True,
+        "optional": True,
+    }
+    configuration["beacon_loss"] = {
+        "description": "Wi-Fi Beacon Loss",
+        "requirements": ["base"],
+        "vmin": 0,
+        "mode": ["base"],
+        "conversion": False,
+        "reverse": True,
+        "optional": True,
+    }
+    configuration["roam_count"] = {
+        "description": "Wi-Fi Roams During Benchmark",
+        "requirements": ["roaming"],
+        "vmin": 0,
+        "mode": ["base"],
+        "conversion": False,
+        "reverse": True,
+    }
+    configuration["disconnected_ms"] = {
+        "description": "Wi-Fi Disconnected Time During Benchmark (in ms)",
+        "requirements": ["roaming"],
+        "vmin": 0,
+        "mode": ["base"],
+        "conversion": False,
+        "reverse": True,
+    }
+    configuration["noise_floor"] = {
+        "description": "Wi-Fi Noise Floor (in dBm)",
+        "requirements": ["base"],
+        "vmin": -110,
+        "vmax": -60,
+        "mode": ["base"],
+        "conversion": False,
+        "reverse": True,
+        "optional": True,
+    }
+    configuration["snr"] = {
+        "description": "Wi-Fi Signal to Noise Ratio (in dB)",
+        "requirements": ["base"],
+        "vmin": 0,
+        "mode": ["base"],
+        "conversion": False,
+        "reverse": False,
+        "optional": True,
+    }
+    configuration["channel_busy_percent"] = {
+        "description": "Wi-Fi Channel Busy Time (in %)",
+        "requirements": ["base"],
+        "vmin": 0,
+        "vmax": 100,
+        "mode": ["base"],
+        "conversion": False,
+        "reverse": True,
+        "optional": True,
+    }
+    configuration["channel_rx_percent"] = {
+        "description": "Wi-Fi Channel Receive Time (in %)",
+        "requirements": ["base"],
+        "vmin": 0,
+        "vmax": 100,
+        "mode": ["base"],
+        "conversion": False,
+        "reverse": True,
+        "optional": True,
+    }
+    configuration["channel_tx_percent"] = {
+        "description": "Wi-Fi Channel Transmit Time (in %)",
+        "requirements": ["base"],
+        "vmin": 0,
+        "vmax": 100,
+        "mode": ["base"],
+        "conversion": False,
+        "reverse": True,
+        "optional": True,
+    }
     configuration["download_bits_tcp"] = {
         "description": "Wi-Fi Download [TCP] (in {0}/s)",
         "requirements": ["tcp_r"],
@@ -115,6 +298,212 @@ class ConfigurationOptions:
         "conversion": False,
         "reverse": True,
     }
+    configuration["download_cv_tcp"] = {
+        "description": "Wi-Fi Download [TCP] Throughput Variation (coefficient of variation)",
+        "requirements": ["tcp_r"],
+        "mode": ["iperf3"],
+        "vmin": 0,
+        "conversion": False,
+        "reverse": True,
+    }
+    configuration["upload_cv_tcp"] = {
+        "description": "Wi-Fi Upload [TCP] Throughput Variation (coefficient of variation)",
+        "requirements": ["tcp"],
+        "mode": ["iperf3"],
+        "vmin": 0,
+        "conversion": False,
+        "reverse": True,
+    }
+    configuration["download_cv_udp"] = {
+        "description": "Wi-Fi Download [UDP] Throughput Variation (coefficient of variation)",
+        "requirements": ["udp_r"],
+        "mode": ["iperf3"],
+        "vmin": 0,
+        "conversion": False,
+        "reverse": True,
+    }
+    configuration["upload_cv_udp"] = {
+        "description": "Wi-Fi Upload [UDP] Throughput Variation (coefficient of variation)",
+        "requirements": ["udp"],
+        "mode": ["iperf3"],
+        "vmin": 0,
+        "conversion": False,
+        "reverse": True,
+    }
+    configuration["download_steady_time_tcp"] = {
+        "description": "Wi-Fi Download [TCP] Time to Steady State (in s)",
+        "requirements": ["tcp_r"],
+        "mode": ["iperf3"],
+        "vmin": 0,
+        "conversion": False,
+        "reverse": True,
+    }
+    configuration["upload_steady_time_tcp"] = {
+        "description": "Wi-Fi Upload [TCP] Time to Steady State (in s)",
+        "requirements": ["tcp"],
+        "mode": ["iperf3"],
+        "vmin": 0,
+        "conversion": False,
+        "reverse": True,
+    }
+    configuration["download_capacity_bits_udp"] = {
+        "description": "Wi-Fi Max Lossless Download [UDP] (in {0}/s)",
+        "requirements": ["udp_probe_r"],
+        "mode": ["iperf3"],
+        "vmin": 0,
+        "conversion": True,
+        "reverse": False,
+    }
+    configuration["download_capacity_loss_udp"] = {
+        "description": "Wi-Fi Max Lossless Download [UDP] Packet Loss (in %)",
+        "requirements": ["udp_probe_r"],
+        "mode": ["iperf3"],
+        "vmin": 0,
+        "conversion": False,
+        "reverse": True,
+    }
+    configuration["download_capacity_jitter_udp"] = {
+        "description": "Wi-Fi Max Lossless Download [UDP] Jitter (in ms)",
+        "requirements": ["udp_probe_r"],
+        "mode": ["iperf3"],
+        "conversion": False,
+        "reverse": True,
+    }
+    configuration["upload_capacity_bits_udp"] = {
+        "description": "Wi-Fi Max Lossless Upload [UDP] (in {0}/s)",
+        "requirements": ["udp_probe"],
+        "mode": ["iperf3"],
+        "vmin": 0,
+        "conversion": True,
+        "reverse": False,
+    }
+    configuration["upload_capacity_loss_udp"] = {
+        "description": "Wi-Fi Max Lossless Upload [UDP] Packet Loss (in %)",
+        "requirements": ["udp_probe"],
+        "mode": ["iperf3"],
+        "vmin": 0,
+        "conversion": False,
+        "reverse": True,
+    }
+    configuration["upload_capacity_jitter_udp"] = {
+        "description": "Wi-Fi Max Lossless Upload [UDP] Jitter (in ms)",
+        "requirements": ["udp_probe"],
+        "mode": ["iperf3"],
+        "conversion": False,
+        "reverse": True,
+    }
+    configuration["idle_latency_p50"] = {
+        "description": "Idle Wi-Fi Latency [p50] (in ms)",
+        "requirements": ["latency"],
+        "mode": ["base"],
+        "vmin": 0,
+        "conversion": False,
+        "reverse": True,
+    }
+    configuration["idle_latency_p95"] = {
+        "description": "Idle Wi-Fi Latency [p95] (in ms)",
+        "requirements": ["latency"],
+        "mode": ["base"],
+        "vmin": 0,
+        "conversion": False,
+        "reverse": True,
+    }
+    configuration["loaded_latency_p50"] = {
+        "description": "Wi-Fi Latency Under Load [p50] (in ms)",
+        "requirements": ["latency", "tcp_r", "tcp"],
+        "mode": ["iperf3"],
+        "vmin": 0,
+        "conversion": False,
+        "reverse": True,
+    }
+    configuration["loaded_latency_p95"] = {
+        "description": "Wi-Fi Latency Under Load [p95] (in ms)",
+        "requirements": ["latency", "tcp_r", "tcp"],
+        "mode": ["iperf3"],
+        "vmin": 0,
+        "conversion": False,
+        "reverse": True,
+    }
+    configuration["loaded_latency_p99"] = {
+        "description": "Wi-Fi Latency Under Load [p99] (in ms)",
+        "requirements": ["latency", "tcp_r", "tcp"],
+        "mode": ["iperf3"],
+        "vmin": 0,
+        "conversion": False,
+        "reverse": True,
+    }
+    configuration["latency_increase"] = {
+        "description": "Wi-Fi Latency Increase Under Load [p50] (in ms)",
+        "requirements": ["latency", "tcp_r", "tcp"],
+        "mode": ["iperf3"],
+        "vmin": 0,
+        "conversion": False,
+        "reverse": True,
+    }
+    configuration["echo_latency"] = {
+        "description": "Wi-Fi Echo Latency [p50] (in ms)",
+        "requirements": ["echo"],
+        "mode": ["base"],
+        "vmin": 0,
+        "conversion": False,
+        "reverse": True,
+    }
+    configuration["echo_latency_p95"] = {
+        "description": "Wi-Fi Echo Latency [p95] (in ms)",
+        "requirements": ["echo"],
+        "mode": ["base"],
+        "vmin": 0,
+        "conversion": False,
+        "reverse": True,
+    }
+    configuration["echo_jitter"] = {
+        "description": "Wi-Fi Echo Jitter (in ms)",
+        "requirements": ["echo"],
+        "mode": ["base"],
+        "vmin": 0,
+        "conversion": False,
+        "reverse": True,
+    }
+    configuration["echo_loss"] = {
+        "description": "Wi-Fi Echo Packet Loss (in %)",
+        "requirements": ["echo"],
+        "mode": ["base"],
+        "vmin": 0,
+        "conversion": False,
+        "reverse": True,
+    }
+    configuration["scan_signal"] = {
+        "description": "Wi-Fi Signal Strength per BSSID (in dBm)",
+        "requirements": ["scan"],
+        "vmin": -100,
+        "vmax": -20,
+        "mode": ["base"],
+        "conversion": False,
+        "reverse": False,
+    }
+    configuration["scan_best_server"] = {
+        "description": "Wi-Fi Best Server",
+        "requirements": ["scan"],
+        "mode": ["base"],
+        "conversion": False,
+        "reverse": False,
+    }
+    configuration["scan_ap_count"] = {
+        "description": "Wi-Fi Visible Access Points",
+        "requirements": ["scan"],
+        "vmin": 0,
+        "mode": ["base"],
+        "conversion": False,
+        "reverse": True,
+    }
+    configuration["scan_co_channel"] = {
+        "description": "Wi-Fi Co-Channel Access Points",
+        "requirements": ["scan"],
+        "vmin": 0,
+        "mode": ["base"],
+        "conversion": False,
+        "reverse": True,
+    }
     configuration["speedtest_latency"] = {
         "description": "Speedtest Wi-Fi Latency (in ms)",
         "requirements": ["speedtest"],
@@ -231,6 +620,22 @@ def start_config(config_file):
             logging.debug("SSID: {0}".format(ssid))
             break
 
+    interfaces = []
+    question = "Do you want to benchmark on more wireless interfaces at the same time (eg: one per band)? (y/N) "
+    if ask_y_n(question):
+        while True:
+            response = input("Please enter an additional wireless interface (leave empty to finish): ").strip()
+            if response == "":
+                break
+            interface = ask_interface(response)
+            if interface is None or response == target_interface or \
+                    response in [itm["target_interface"] for itm in interfaces]:
+                print("Invalid interface please try again.")
+                continue
+            interfaces.append(interface)
+
+    logging.debug("Additional Interfaces: {0}".format(interfaces))
+
     while True:
         try:
             repeat_count = int(input("How many times do you want to repeat benchmarking? "))
@@ -242,6 +647,19 @@ def start_config(config_file):
             logging.debug("Benchmark Iterations: {0}".format(repeat_count))
             break
 
+    adaptive = {
+        "enabled": False,
+        "tolerance": 0.05,
+        "confidence": 0.95,
+        "min_iterations": min(2, repeat_count),
+        "max_iterations": repeat_count,
+    }
+    if repeat_count > 2:
+        question = "Do you want to stop repeating a benchmark once its measurements converge? (y/N) "
+        adaptive["enabled"] = ask_y_n(question)
+
+    logging.debug("Adaptive Iterations: {0}".format(adaptive))
+
     if "librespeed-cli" in supported_modes and speedtest_type != SpeedTestMode.UNKNOWN:
         question = "We detected librespeed-cli. Do you prefer librespeed over speedtest? (y/N) "
         if ask_y_n(question):
@@ -324,6 +742,142 @@ def start_config(config_file):
         exit(1)
     selection = tuple(set(selection))
 
+    iperf_options = {
+        "streaming": False,
+        "omit": 0,
+        "tolerance": 0.1,
+        "stable_intervals": 3,
+        "duration": 10,
+        "parallel": 1,
+        "window_size": 0,
+        "bandwidth": 0,
+        "bidirectional": False,
+        "servers": [],
+        "busy_backoff": 1.0,
+        "max_backoff": 30.0,
+        "max_wait": 120.0,
+        "udp_probe": {
+            "loss_threshold": 1.0,
+            "start_rate": 10000000,
+            "max_rate": 10000000000,
+            "probe_duration": 2,
+            "max_time": 30,
+        },
+    }
+    if set(selection).intersection({"tcp", "tcp_r", "udp", "udp_r", "udp_probe", "udp_probe_r"}):
+        question = "Do you want to end iperf3 tests early once throughput is stable? Requires iperf3 3.17+ (y/N) "
+        if ask_y_n(question):
+            iperf_options["streaming"] = True
+            iperf_options["omit"] = 1
+
+        if {"tcp", "tcp_r"}.issubset(selection) or {"udp", "udp_r"}.issubset(selection):
+            question = "Do you want to test upload and download at the same time? Requires iperf3 3.7+ (y/N) "
+            iperf_options["bidirectional"] = ask_y_n(question)
+
+        while True:
+            try:
+                response = input("How many parallel streams should iperf3 use? (default 1) ").strip()
+                if response != "":
+                    iperf_options["parallel"] = int(response)
+                if iperf_options["parallel"] <= 0:
+                    raise ValueError
+            except ValueError:
+                print("Invalid value please try again.")
+                iperf_options["parallel"] = 1
+            else:
+                break
+
+        while True:
+            try:
+                response = input("How many seconds should every iperf3 test run at most? (default 10) ").strip()
+                if response != "":
+                    iperf_options["duration"] = int(response)
+                if iperf_options["duration"] <= 0:
+                    raise ValueError
+            except ValueError:
+                print("Invalid value please try again.")
+                iperf_options["duration"] = 10
+            else:
+                break
+
+        while True:
+            try:
+                response = input("What socket buffer (window) size in bytes should iperf3 use? "
+                                 "(default 0, the system default) ").strip()
+                if response != "":
+                    iperf_options["window_size"] = int(response)
+                if iperf_options["window_size"] < 0:
+                    raise ValueError
+            except ValueError:
+                print("Invalid value please try again.")
+                iperf_options["window_size"] = 0
+            else:
+                break
+
+        while set(selection).intersection({"udp", "udp_r"}):
+            try:
+                response = input("What target bandwidth in bits/s should iperf3 use for UDP tests? "
+                                 "(default 0, the iperf3 default of 1 Mbit/s) ").strip()
+                if response != "":
+                    iperf_options["bandwidth"] = int(response)
+                if iperf_options["bandwidth"] < 0:
+                    raise ValueError
+            except ValueError:
+                print("Invalid value please try again.")
+                iperf_options["bandwidth"] = 0
+            else:
+                break
+
+        while True:
+            response = input("Please enter your iperf3 servers separated by commas, or leave empty to pass them "
+                             "with --server (example: 192.168.1.100,192.168.1.101:5202): ").strip()
+            servers = [server.strip() for server in response.split(",") if server.strip() != ""]
+            if all(validate_ipv4(server.rsplit(":", 1)[0]) if ":" in server else validate_ipv4(server)
+                   for server in servers):
+                iperf_options["servers"] = servers
+                break
+            print("Invalid value please try again.")
+
+        # The interfaces run their tests at the same time, every one needs iperf3 servers of its own.
+        for index, interface in enumerate(interfaces, 1):
+            while True:
+                response = input("Please enter the iperf3 servers for {0} separated by commas, or leave empty to "
+                                 "use the servers above on their port + {1}: ".format(interface["target_interface"],
+                                                                                     index)).strip()
+                servers = [server.strip() for server in response.split(",") if server.strip() != ""]
+                if all(validate_ipv4(server.rsplit(":", 1)[0]) if ":" in server else validate_ipv4(server)
+                       for server in servers):
+                    interface["iperf3_servers"] = servers
+                    break
+                print("Invalid value please try again.")
+
+    logging.debug("iperf3 Options: {0}".format(iperf_options))
+
+    latency = {
+        "target": "",
+        "interval": 0.05,
+        "timeout": 1.0,
+        "idle_duration": 1.0,
+    }
+    if "latency" in selection:
+        latency["target"] = ask_echo_server("Please enter the UDP echo server for latency probes "
+                                            "(example: 192.168.1.100:7007): ")
+
+    logging.debug("Latency Options: {0}".format(latency))
+
+    echo = {
+        "target": latency["target"],
+        "protocol": "udp",
+        "count": 40,
+        "interval": 0.05,
+        "timeout": 1.0,
+    }
+    if "echo" in selection and echo["target"] == "":
+        echo["target"] = ask_echo_server("Please enter the echo server for latency probes "
+                                         "(example: 192.168.1.100:7007): ")
+
+    logging.debug("Echo Options: {0}".format(echo))
+
     config_data = {
         "configuration":
             {
@@ -334,9 +888,15 @@ def start_config(config_file):
                 "target_interface": target_interface,
                 "target_ip": bind_ip,
                 "ssid": ssid,
+                "interfaces": interfaces,
                 "speedtest": speedtest_type,
+                "speedtest_server": {"id": "", "name": ""},
                 "libre-speed-list": libre_speed_list,
                 "benchmark_iterations": repeat_count,
+                "adaptive": adaptive,
+                "iperf3": iperf_options,
+                "latency": latency,
+                "echo": echo,
             },
         "results": {}
     }
@@ -395,3 +955,51 @@ def ask_y_n(question):
             return False
         else:
             print("Invalid option. Please try again.")
+
+
+def ask_interface(target_interface):
+    """Check an additional wireless interface and ask the user
+    to confirm its SSID.
+
+    Args:
+        target_interface (str): the wireless interface.
+
+    Returns:
+        dict or None: Dictionary containing the target_interface,
+        target_ip and ssid. None if the interface is not usable.
+    """
+    if not target_interface.isalnum():
+        return None
+    check_interface = get_application_output("cat /sys/class/net/{0}/operstate".format(target_interface),
+                                             shell=True, timeout=10)
+    if check_interface.split("\n")[0] != "up":
+        print("Interface {0} is not ready.".format(target_interface))
+        return None
+    bind_ip = get_ip_address_from_interface(target_interface)
+    if bind_ip is None:
+        print("Interface {0} does not have a valid IPv4 address assigned.".format(target_interface))
+        return None
+    ssid = process_iw(target_interface)["ssid"]
+    question = "{0} is connected to {1}{2}{3}. Is this correct? (y/N) ".format(
+               target_interface, TColor.BLUE, ssid, TColor.RESET)
+    if not ask_y_n(question):
+        return None
+    return {"target_interface": target_interface, "target_ip": bind_ip, "ssid": ssid}
+
+
+def ask_echo_server(question):
+    """Ask the user for the address of an echo server.
+
+    Args:
+        question (str): the question to ask.
+
+    Returns:
+        str : the echo server address in the form
+        ip:port. Repeats the question if invalid.
+    """
+    while True:
+        response = input(question).strip()
+        if ":" in response and validate_ipv4(response.rsplit(":", 1)[0]) and \
+                response.rsplit(":", 1)[1].isdecimal():
+            return response
+        print("Invalid value please try again.")
@@ -1,13 +1,74 @@
 from functools import wraps
+import inspect
 import logging
+import reprlib
+
+
+class ArgumentRepr(reprlib.Repr):
+    """Size-bounded repr of function arguments.
+
+    Containers are cut after a few items and levels, with the number
+    of items noted when cut, and arrays only show their shape and
+    dtype. A survey results dictionary stays a short line however
+    many points it holds.
+    """
+    def __init__(self):
+        super().__init__()
+        self.maxlevel = 3
+        self.maxdict = 6
+        self.maxlist = 6
+        self.maxtuple = 6
+        self.maxstring = 120
+        self.maxother = 120
+
+    def repr1(self, x, level):
+        if hasattr(x, "shape") and hasattr(x, "dtype"):
+            return "{0}(shape={1}, dtype={2})".format(type(x).__name__, tuple(x.shape), x.dtype)
+        return super().repr1(x, level)
+
+    def repr_dict(self, x, level):
+        return self.with_length(super().repr_dict(x, level), len(x), self.maxdict, level)
+
+    def repr_list(self, x, level):
+        return self.with_length(super().repr_list(x, level), len(x), self.maxlist, level)
+
+    def with_length(self, text, length, limit, level):
+        if length > limit and level > 0:
+            return "{0} ({1} items)".format(text, length)
+        return text
+
+
+argument_repr = ArgumentRepr()
+
+
+def format_arguments(signature, args, kwargs):
+    """Format the arguments of a call with their parameter names.
+
+    Args:
+        signature (Signature): Signature of the called function.
+        args (tuple): Positional arguments of the call.
+        kwargs (dict): Keyword arguments of the call.
+
+    Returns:
+        str: name=value pairs of the arguments.
+    """
+    try:
+        arguments = signature.bind(*args, **kwargs).arguments
+    except TypeError:
+        arguments = dict({"arg{0}".format(index): value for index, value in enumerate(args)}, **kwargs)
+    return ", ".join("{0}={1}".format(name, argument_repr.repr(value)) for name, value in arguments.items())
 
 
 def log_arguments(func):
+    """Decorator logging the name and arguments of every call of
+    a function. Nothing is formatted unless debug logging is
+    enabled."""
+    signature = inspect.signature(func)
 
     @wraps(func)
     def new_func(*args, **kwargs):
-        args_passed = locals()
-        logging.debug("Calling {0}".format(func.__name__))
-        logging.debug("Arguments: {0}".format(args_passed))
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("Calling {0}".format(func.__name__))
+            logging.debug("Arguments: {0}".format(format_arguments(signature, args, kwargs)))
         return func(*args, **kwargs)
     return new_func
@@ -0,0 +1,241 @@
+from collections import deque
+from bisect import bisect_left
+import threading
+import socket
+import time
+import math
+import os
+import logging
+
+
+class FeedError(Exception):
+    pass
+
+
+class PositionFeed:
+    """Collects (t, x, y) position samples from a local stream in a
+    background thread.
+
+    The source is either a UNIX socket (``unix:/path/to/socket``) or a
+    file that is tailed for new lines. Every line is expected to be of
+    the form ``t,x,y`` where ``t`` is a UNIX timestamp in seconds and
+    ``x``, ``y`` are floor map pixel co-ordinates with the origin at the
+    bottom left, the same convention the benchmark canvas uses. Only the
+    newest ``max_samples`` samples are kept.
+
+    Args:
+        source (str): path to the file or ``unix:`` prefixed socket path.
+        max_samples (int), optional: number of samples to buffer.
+        Defaults to 4096.
+        replay (bool), optional: True to replay a recorded file in real
+        time, re-basing its timestamps onto the current clock. False to
+        follow the file like ``tail -f``, from the lines written after
+        the feed started. Defaults to False.
+    """
+    def __init__(self, source, max_samples=4096, replay=False):
+        self.source = source
+        self.replay = replay
+        self.samples = deque(maxlen=max_samples)
+        self.dropped = 0
+        self.finished = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._updated = threading.Event()
+        self._thread = None
+        self._opened = threading.Event()
+
+    def start(self):
+        """Start reading the source in a daemon thread."""
+        if self.source.startswith("unix:"):
+            target = self._read_socket
+        elif os.path.isfile(self.source):
+            target = self._read_file
+        else:
+            raise FeedError("Invalid position feed {0}".format(self.source))
+        self._thread = threading.Thread(target=target, name="position-feed", daemon=True)
+        self._thread.start()
+        if target == self._read_file:
+            # Lines written once start returns are read, even before the thread got to run.
+            self._opened.wait(timeout=2)
+        logging.debug("Started position feed from {0}".format(self.source))
+
+    def stop(self):
+        """Stop reading the source and wait for the reader to exit."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    def wait(self, timeout=None):
+        """Block until a new sample arrives or the feed ends.
+
+        Args:
+            timeout (float, None), optional: max time in seconds to wait.
+
+        Returns:
+            bool: True if the feed was updated, False on timeout.
+        """
+        updated = self._updated.wait(timeout)
+        self._updated.clear()
+        return updated
+
+    def latest(self):
+        """Get the newest position sample.
+
+        Returns:
+            tuple or None: (t, x, y) or None if nothing was received yet.
+        """
+        with self._lock:
+            if len(self.samples) == 0:
+                return None
+            return self.samples[-1]
+
+    def nearest(self, timestamp):
+        """Get the position sample closest in time to a timestamp.
+
+        Args:
+            timestamp (float): UNIX timestamp in seconds.
+
+        Returns:
+            tuple or None: (t, x, y) or None if nothing was received yet.
+        """
+        with self._lock:
+            samples = list(self.samples)
+        if len(samples) == 0:
+            return None
+        index = bisect_left(samples, (timestamp,))
+        if index == 0:
+            return samples[0]
+        if index == len(samples):
+            return samples[-1]
+        before, after = samples[index - 1], samples[index]
+        if timestamp - before[0] <= after[0] - timestamp:
+            return before
+        return after
+
+    def align(self, started, finished, tolerance=1.0, max_distance=50.0):
+        """Get the position of a measurement window, the sample
+        closest to its middle.
+
+        Args:
+            started (float): UNIX timestamp of the window start.
+            finished (float): UNIX timestamp of the window end.
+            tolerance (float), optional: Time in seconds the sample
+            may lie outside the window. Defaults to 1.
+            max_distance (float), optional: Max distance in pixels
+            between the positions at the start and the end of the
+            window. Defaults to 50.
+
+        Returns:
+            tuple: (t, x, y) of the sample.
+
+        Raises:
+            FeedError: When there is no sample, the sample is stale
+            or the position moved during the window.
+        """
+        middle = (started + finished) / 2
+        sample = self.nearest(middle)
+        if sample is None:
+            raise FeedError("No position sample received")
+        if abs(sample[0] - middle) > (finished - started) / 2 + tolerance:
+            raise FeedError("Position sample is {0:.1f}s away from the benchmark".format(abs(sample[0] - middle)))
+        first, last = self.nearest(started), self.nearest(finished)
+        distance = math.hypot(last[1] - first[1], last[2] - first[2])
+        if distance > max_distance:
+            raise FeedError("Position moved {0:.0f} pixels during the benchmark".format(distance))
+        return sample
+
+    def add_line(self, line):
+        """Parse a ``t,x,y`` line and buffer the sample.
+
+        Args:
+            line (str): line read from the source.
+
+        Returns:
+            bool: True if the line produced a sample, False otherwise.
+        """
+        line = line.strip()
+        if line == "" or line.startswith("#"):
+            return False
+        try:
+            t, x, y = (float(value) for value in line.split(","))
+        except ValueError:
+            logging.warning("Invalid position sample: {0}".format(line))
+            return False
+        with self._lock:
+            if len(self.samples) != 0 and t < self.samples[-1][0]:
+                # Keep the buffer sorted for nearest lookups.
+                logging.warning("Out of order position sample: {0}".format(line))
+                return False
+            if len(self.samples) == self.samples.maxlen:
+                self.dropped += 1
+            self.samples.append((t, x, y))
+        self._updated.set()
+        return True
+
+    def _finish(self):
+        self.finished = True
+        self._updated.set()
+        logging.debug("Position feed finished. Dropped samples: {0}".format(self.dropped))
+
+    def _read_file(self):
+        offset = None
+        pending = ""
+        with open(self.source, "r") as f:
+            if not self.replay:
+                # Follow the file like tail -f, from the lines written after the start.
+                f.seek(0, os.SEEK_END)
+            self._opened.set()
+            while not self._stop.is_set():
+                line = f.readline()
+                if line == "":
+                    if self.replay:
+                        break
+                    time.sleep(0.1)
+                    continue
+                if self.replay:
+                    offset = self._replay_line(line, offset)
+                    continue
+                # The writer may not have flushed the whole line yet.
+                pending += line
+                if pending.endswith("\n"):
+                    self.add_line(pending)
+                    pending = ""
+        self._finish()
+
+    def _replay_line(self, line, offset):
+        try:
+            t, x, y = line.strip().split(",")
+            t = float(t)
+        except ValueError:
+            self.add_line(line)
+            return offset
+        if offset is None:
+            offset = time.time() - t
+        delay = t + offset - time.time()
+        if delay > 0:
+            self._stop.wait(delay)
+        self.add_line("{0},{1},{2}".format(t + offset, x, y))
+        return offset
+
+    def _read_socket(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.source[len("unix:"):])
+            sock.settimeout(0.5)
+            buffer = b""
+            while not self._stop.is_set():
+                try:
+                    chunk = sock.recv(4096)
+                except TimeoutError:
+                    continue
+                if not chunk:
+                    break
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    self.add_line(line.decode(errors="replace"))
+        except OSError:
+            logging.exception("Position feed socket failed")
+        finally:
+            sock.close()
+            self._finish()
@@ -1,8 +1,11 @@
 from wifi_heat_mapper.config import ConfigurationOptions
 from wifi_heat_mapper.misc import load_json, get_property_from, bytes_to_human_readable
 from wifi_heat_mapper.debugger import log_arguments
+from wifi_heat_mapper.tracing import span, traced
+from wifi_heat_mapper.stats import AGGREGATIONS, aggregate, unpack_samples
 from PIL import Image
 import matplotlib.pyplot as plt
+from matplotlib.patches import Patch
 import numpy as np
 import math
 from matplotlib.pyplot import imread
@@ -18,7 +21,8 @@ class MissingMetricError(Exception):
 
 
 class GraphPlot:
-    def __init__(self, results, key, floor_map, vmin=None, vmax=None, conversion=False, reverse=False):
+    def __init__(self, results, key, floor_map, vmin=None, vmax=None, conversion=False, reverse=False,
+                 aggregate="mean", label=None, optional=False):
         self.results = results
         self.floor_map = floor_map
         self.vmin = vmin
@@ -29,23 +33,60 @@ class GraphPlot:
         self.conversion = conversion
         self.suffix = None
         self.reverse = reverse
+        self.aggregate = aggregate
+        self.label = label
+        self.optional = optional
+        self.skipped = 0
 
     def process_result(self):
-        """Process the results captured for a metric. """
-        processed_results = {"x": [], "y": [], "z": [], "sx": [], "sy": []}
+        """Process the results captured for a metric. Points
+        without an optional metric are skipped. """
+        processed_results = {"x": [], "y": [], "z": [], "sx": [], "sy": [], "rx": [], "ry": [], "dx": [], "dy": []}
+        self.skipped = 0
         for result in self.results.keys():
             if self.results[result]["results"] is not None:
-                processed_results["x"].append(self.results[result]["position"]["x"])
-                processed_results["y"].append(self.results[result]["position"]["y"])
                 try:
-                    processed_results["z"].append(self.results[result]["results"][self.key])
+                    value = self.get_value(self.results[result]["results"])
                 except KeyError:
+                    if self.optional:
+                        self.skipped += 1
+                        continue
                     raise MissingMetricError("Missing Metric {0}".format(self.key)) from None
+                processed_results["x"].append(self.results[result]["position"]["x"])
+                processed_results["y"].append(self.results[result]["position"]["y"])
+                processed_results["z"].append(value)
                 if self.results[result]["station"]:
                     processed_results["sx"].append(self.results[result]["position"]["x"])
                     processed_results["sy"].append(self.results[result]["position"]["y"])
+                for event in self.results[result]["results"].get("roam_events", []):
+                    if event[1] == "connected":
+                        continue
+                    # Events without a position happened at the benchmark point.
+                    x, y = event[3:5] if len(event) == 5 else (self.results[result]["position"]["x"],
+                                                               self.results[result]["position"]["y"])
+                    prefix = "d" if event[1] == "disconnected" else "r"
+                    processed_results[prefix + "x"].append(x)
+                    processed_results[prefix + "y"].append(y)
+        if len(processed_results["z"]) == 0:
+            raise MissingMetricError("No benchmark point reported {0}".format(self.key))
         self.processed_results = processed_results
 
+    def get_value(self, results):
+        """Get the value of the metric for a benchmark point,
+        aggregating the per-iteration samples if available.
+
+        Args:
+            results (dict): Dictionary containing the metrics of
+            a benchmark point.
+
+        Returns:
+            float: the value of the metric.
+        """
+        samples = results.get("samples", {})
+        if self.aggregate == "mean" or self.key not in samples:
+            return results[self.key]
+        return aggregate(unpack_samples(samples[self.key]), self.aggregate)
+
     def add_zero_boundary(self):
         """Add 4 zero (vmin or vmax) benchmark points. """
         self.processed_results["x"] += [0, 0, self.floor_map_dimensions[0],
@@ -102,27 +143,70 @@ class GraphPlot:
         Returns:
             None
         """
+        with span("prepare", self.key):
+            self.prepare()
+        with span("rbf_fit", self.key):
+            rbf = self.fit()
+        with span("grid_eval", self.key):
+            xi, yi, zi = self.interpolate(rbf)
+        with span("render", self.key):
+            fig = self.render(xi, yi, zi, levels)
+        with span("savefig", self.key):
+            self.save(fig, dpi, file_type)
+
+    def prepare(self):
+        """Collect the values of the metric, add the boundary
+        points and apply the unit conversion. """
         self.process_result()
         self.set_floor_map_dimensions()
         self.add_zero_boundary()
         if self.conversion:
             self.apply_conversion()
 
-        fdimx, fdimy = self.floor_map_dimensions
-        xi = np.linspace(0, fdimx, 100)
-        yi = np.linspace(0, fdimy, 100)
+    def fit(self):
+        """Fit the radial basis function interpolating the metric.
 
-        xi, yi = np.meshgrid(xi, yi)
-        di = Rbf(self.processed_results["x"], self.processed_results["y"],
-                 self.processed_results["z"], function="linear")
-        zi = di(xi, yi)
+        Returns:
+            Rbf: the fitted interpolator.
+        """
+        return Rbf(self.processed_results["x"], self.processed_results["y"],
+                   self.processed_results["z"], function="linear")
+
+    def interpolate(self, rbf, resolution=100):
+        """Evaluate the interpolator on a grid over the floor map,
+        clipped to vmin and vmax.
+
+        Args:
+            rbf (Rbf): the fitted interpolator.
+            resolution (int), optional: grid points per axis.
+            Defaults to 100.
+
+        Returns:
+            tuple: the grid in the form of (xi, yi, zi).
+        """
+        fdimx, fdimy = self.floor_map_dimensions
+        xi, yi = np.meshgrid(np.linspace(0, fdimx, resolution), np.linspace(0, fdimy, resolution))
+        zi = rbf(xi, yi)
         zi[zi < self.vmin] = self.vmin
         zi[zi > self.vmax] = self.vmax
+        return (xi, yi, zi)
+
+    def render(self, xi, yi, zi, levels):
+        """Draw the heatmap, benchmark points and floor map.
+
+        Args:
+            xi (ndarray): x coordinates of the grid.
+            yi (ndarray): y coordinates of the grid.
+            zi (ndarray): values of the grid.
+            levels (int): number of countour levels.
 
+        Returns:
+            Figure: the drawn figure.
+        """
+        fdimx, fdimy = self.floor_map_dimensions
         fig, ax = plt.subplots(1, 1, figsize=(fdimx / 100, fdimy / 100))
 
-        bench_plot = ax.contourf(xi, yi, zi, cmap="RdYlBu_r", vmin=self.vmin, vmax=self.vmax,
-                                 alpha=0.5, zorder=150, antialiased=True, levels=levels)
+        bench_plot = self.contour(ax, xi, yi, zi, levels)
 
         fdim_coef = math.sqrt(fdimx * fdimy)
         marker_size = max(4, fdim_coef // 210)
@@ -134,6 +218,15 @@ class GraphPlot:
                 markeredgecolor='black', markerfacecolor="orange", markeredgewidth=0.5,
                 linestyle='None', markersize=marker_size, label="Base Station")
 
+        if len(self.processed_results["rx"]) != 0:
+            ax.plot(self.processed_results["rx"], self.processed_results["ry"], zorder=300, marker='X',
+                    markeredgecolor='black', markerfacecolor="red", markeredgewidth=0.5,
+                    linestyle='None', markersize=marker_size * 1.5, label="Roam")
+        if len(self.processed_results["dx"]) != 0:
+            ax.plot(self.processed_results["dx"], self.processed_results["dy"], zorder=300, marker='v',
+                    markeredgecolor='black', markerfacecolor="white", markeredgewidth=0.5,
+                    linestyle='None', markersize=marker_size * 1.5, label="Disconnect")
+
         ax.imshow(imread(self.floor_map)[::-1], interpolation='bicubic', zorder=1, alpha=1,
                   origin="lower")
 
@@ -145,6 +238,10 @@ class GraphPlot:
         desc = ConfigurationOptions.configuration[self.key]["description"]
         if self.suffix is not None:
             desc = desc.format(self.suffix)
+        if self.aggregate != "mean":
+            desc = "{0} [{1}]".format(desc, self.aggregate)
+        if self.label is not None:
+            desc = "{0} ({1})".format(desc, self.label)
 
         plt.title("{0}".format(desc), fontsize=title_size)
         plt.axis('off')
@@ -154,12 +251,46 @@ class GraphPlot:
             ncol=2,
             prop={"size": label_size}
         )
-        file_name = "{0}.{1}".format(self.key, file_type)
-        plt.savefig(file_name, format=file_type, dpi=dpi)
+        return fig
+
+    def contour(self, ax, xi, yi, zi, levels):
+        """Draw the filled contours of the grid on an axes.
+
+        Returns:
+            QuadContourSet: the drawn contours.
+        """
+        return ax.contourf(xi, yi, zi, cmap="RdYlBu_r", vmin=self.vmin, vmax=self.vmax,
+                           alpha=0.5, zorder=150, antialiased=True, levels=levels)
+
+    def save(self, fig, dpi, file_type, path=None):
+        """Save and close a figure drawn by render.
+
+        Args:
+            fig (Figure): the figure to save.
+            dpi (int): Dots Per Inch resolution for
+            certain image types such as png.
+            file_type (str): Plot save file type.
+            path (str), optional: Save path. Defaults to None
+            which names the file after the metric in the current
+            directory.
+
+        Returns:
+            None
+        """
+        if path is None:
+            file_name = self.key
+            if self.aggregate != "mean":
+                file_name = "{0}_{1}".format(file_name, self.aggregate)
+            if self.label is not None:
+                file_name = "{0}_{1}".format(file_name, self.label.replace(":", "").replace(", ", "_"))
+            path = "{0}.{1}".format(file_name, file_type)
+        fig.savefig(path, format=file_type, dpi=dpi)
+        plt.close(fig)
 
 
 @log_arguments
-def generate_graph(data, floor_map, levels=100, dpi=300, file_type="png"):
+def generate_graph(data, floor_map, levels=100, dpi=300, file_type="png", aggregate="mean", interface=None,
+                   all_bssids=False):
     """Starting point for the plot submodule for whm.
 
     Args:
@@ -169,6 +300,13 @@ def generate_graph(data, floor_map, levels=100, dpi=300, file_type="png"):
         dpi (int): Dots Per Inch resolution for
         certain image types such as png.
         file_type (str): Plot save file type.
+        aggregate (str): Aggregation applied to the
+        per-iteration samples of a metric.
+        interface (str): Plot the results of this wireless
+        interface. Default is None which plots the target
+        interface.
+        all_bssids (bool): Include the access points of other
+        networks in the scan plots. Default is False.
 
     Returns:
         None
@@ -179,6 +317,10 @@ def generate_graph(data, floor_map, levels=100, dpi=300, file_type="png"):
         print("Unsupported file type.")
         exit(1)
 
+    if aggregate not in AGGREGATIONS:
+        print("Unsupported aggregation.")
+        exit(1)
+
     if not isinstance(data, dict):
         data = os.path.abspath(data)
         data = load_json(data)
@@ -187,8 +329,31 @@ def generate_graph(data, floor_map, levels=100, dpi=300, file_type="png"):
             exit(1)
     benchmark_results = get_property_from(data, "results")
     configuration = get_property_from(data, "configuration")
+    if interface == configuration["target_interface"]:
+        interface = None
+    if interface is not None:
+        if interface not in [itm["target_interface"] for itm in configuration.get("interfaces", [])]:
+            print("Interface {0} was not benchmarked.".format(interface))
+            exit(1)
+        benchmark_results = {index: dict(point, results=point.get("interfaces", {}).get(interface))
+                             for index, point in benchmark_results.items()}
     graph_modes = ConfigurationOptions.configuration
+    bssids = scanned_bssids(benchmark_results, None if all_bssids else configuration["ssid"])
     for key_name in tqdm(configuration["graphs"], desc="Generating Plots"):
+        if key_name in ("scan_signal", "scan_best_server") and len(bssids) == 0:
+            print("No scanned access points to plot for {0}.".format(key_name))
+            continue
+        if key_name == "scan_signal":
+            for bssid in bssids:
+                plot_metric(GraphPlot(bssid_results(benchmark_results, bssid), key_name, floor_map,
+                                      vmin=graph_modes[key_name]["vmin"], vmax=graph_modes[key_name]["vmax"],
+                                      label=bssid if interface is None else "{0}, {1}".format(bssid, interface)),
+                            levels, dpi, file_type)
+            continue
+        if key_name == "scan_best_server":
+            generate_best_server_plot(benchmark_results, bssids, floor_map, dpi=dpi, file_type=file_type,
+                                      label=interface)
+            continue
         vmin = None
         vmax = None
         if "vmin" in graph_modes[key_name]:
@@ -196,10 +361,176 @@ def generate_graph(data, floor_map, levels=100, dpi=300, file_type="png"):
         if "vmax" in graph_modes[key_name]:
             vmax = graph_modes[key_name]["vmax"]
         logging.debug("Generating plot for {0} with (vmin, vmax) = ({1}, {2})".format(key_name, vmin, vmax))
-        GraphPlot(benchmark_results, key_name, floor_map, vmin=vmin, vmax=vmax,
-                  conversion=graph_modes[key_name]["conversion"],
-                  reverse=graph_modes[key_name]["reverse"])\
-            .generate_plot(levels=levels, dpi=dpi, file_type=file_type)
+        plot_metric(GraphPlot(benchmark_results, key_name, floor_map, vmin=vmin, vmax=vmax,
+                              conversion=graph_modes[key_name]["conversion"],
+                              reverse=graph_modes[key_name]["reverse"], aggregate=aggregate, label=interface,
+                              optional=graph_modes[key_name].get("optional", False)),
+                    levels, dpi, file_type)
         logging.debug("Finished generating plot")
     print("Finished plotting.")
     logging.debug("Finished plotting")
+
+
+def plot_metric(plot, levels, dpi, file_type):
+    """Generate the plot of a metric, skipping it with a message
+    if the benchmark points did not report it.
+
+    Args:
+        plot (GraphPlot): the plot to generate.
+        levels (int): number of countour levels.
+        dpi (int): Dots Per Inch resolution for
+        certain image types such as png.
+        file_type (str): Plot save file type.
+
+    Returns:
+        bool: True if the plot was generated, False otherwise.
+    """
+    try:
+        plot.generate_plot(levels=levels, dpi=dpi, file_type=file_type)
+    except MissingMetricError as error:
+        print("Skipping {0}: {1}.".format(plot.key, error))
+        logging.debug("Skipped plot of {0}: {1}".format(plot.key, error))
+        return False
+    if plot.skipped != 0:
+        print("Plotted {0} without {1} benchmark points that did not report it.".format(plot.key, plot.skipped))
+    return True
+
+
+def scanned_bssids(benchmark_results, ssid=None):
+    """Get the access points seen by the scans of the benchmark
+    points.
+
+    Args:
+        benchmark_results (dict): Dictionary containing the
+        benchmark points.
+        ssid (str), optional: Only include access points of
+        this SSID. Defaults to None which includes all.
+
+    Returns:
+        dict: Dictionary of BSSID and SSID sorted by BSSID.
+    """
+    bssids = {}
+    for point in benchmark_results.values():
+        if point["results"] is None:
+            continue
+        for bssid, ap in point["results"].get("scan", {}).items():
+            if ssid is None or ap["ssid"] == ssid:
+                bssids[bssid] = ap["ssid"]
+    return dict(sorted(bssids.items()))
+
+
+def bssid_results(benchmark_results, bssid, floor=-100):
+    """Get benchmark points with the signal strength of an
+    access point as their scan_signal metric.
+
+    Args:
+        benchmark_results (dict): Dictionary containing the
+        benchmark points.
+        bssid (str): The BSSID of the access point.
+        floor (float), optional: Signal strength used where the
+        access point was not seen. Defaults to -100.
+
+    Returns:
+        dict: Dictionary containing the benchmark points.
+    """
+    points = {}
+    for index, point in benchmark_results.items():
+        results = point["results"]
+        if results is None or "scan" not in results:
+            points[index] = dict(point, results=None)
+            continue
+        ap = results["scan"].get(bssid)
+        points[index] = dict(point, results={"scan_signal": ap["signal"] if ap is not None else floor})
+    return points
+
+
+@traced("best_server_plot")
+def best_server_colormap(count):
+    """Get a colormap with a distinct color for every access
+    point of the best server plot.
+
+    Args:
+        count (int): Number of access points.
+
+    Returns:
+        str: The name of the colormap. The qualitative colormaps
+        repeat their colors past 10 and 20 access points, so
+        a continuous colormap is sampled beyond that.
+    """
+    if count <= 10:
+        return "tab10"
+    if count <= 20:
+        return "tab20"
+    return "turbo"
+
+
+def generate_best_server_plot(benchmark_results, bssids, floor_map, dpi=300, file_type="png", label=None,
+                              floor=-100):
+    """Plot the access point with the strongest interpolated
+    signal at every position of the floor map.
+
+    Args:
+        benchmark_results (dict): Dictionary containing the
+        benchmark points.
+        bssids (dict): Dictionary of BSSID and SSID of the access
+        points to include.
+        floor_map (str): the path to the floor map.
+        dpi (int): Dots Per Inch resolution for
+        certain image types such as png.
+        file_type (str): Plot save file type.
+        label (str), optional: Appended to the title and the
+        file name. Defaults to None.
+        floor (float), optional: Signal strength used where an
+        access point was not seen. Defaults to -100.
+
+    Returns:
+        None
+    """
+    fdimx, fdimy = Image.open(floor_map).size
+    x, y, signals = [], [], {bssid: [] for bssid in bssids}
+    for point in benchmark_results.values():
+        if point["results"] is None or "scan" not in point["results"]:
+            continue
+        x.append(point["position"]["x"])
+        y.append(point["position"]["y"])
+        for bssid in bssids:
+            signals[bssid].append(point["results"]["scan"].get(bssid, {}).get("signal", floor))
+
+    xi, yi = np.meshgrid(np.linspace(0, fdimx, 100), np.linspace(0, fdimy, 100))
+    boundary_x = [0, 0, fdimx, fdimx]
+    boundary_y = [0, fdimy, fdimy, 0]
+    surfaces = [Rbf(x + boundary_x, y + boundary_y, signals[bssid] + [floor] * 4, function="linear")(xi, yi)
+                for bssid in bssids]
+    best = np.argmax(surfaces, axis=0)
+
+    fig, ax = plt.subplots(1, 1, figsize=(fdimx / 100, fdimy / 100))
+    colors = plt.get_cmap(best_server_colormap(len(bssids)), max(len(bssids), 2))
+    ax.pcolormesh(xi, yi, best, cmap=colors, vmin=-0.5, vmax=colors.N - 0.5, alpha=0.5, zorder=150,
+                  shading="auto")
+
+    fdim_coef = math.sqrt(fdimx * fdimy)
+    marker_size = max(4, fdim_coef // 210)
+    ax.plot(x, y, zorder=200, marker='o', markeredgecolor='black', markeredgewidth=0.5, linestyle='None',
+            markersize=marker_size)
+    ax.imshow(imread(floor_map)[::-1], interpolation='bicubic', zorder=1, alpha=1, origin="lower")
+
+    title_size = max(10, fdim_coef // 70)
+    label_size = max(7, title_size - 5)
+    desc = ConfigurationOptions.configuration["scan_best_server"]["description"]
+    file_name = "scan_best_server"
+    if label is not None:
+        desc = "{0} ({1})".format(desc, label)
+        file_name = "{0}_{1}".format(file_name, label)
+
+    plt.title(desc, fontsize=title_size)
+    plt.axis('off')
+    plt.legend(
+        handles=[Patch(color=colors(index), alpha=0.5, label="{0} ({1})".format(ssid, bssid))
+                 for index, (bssid, ssid) in enumerate(bssids.items())],
+        loc='upper center',
+        bbox_to_anchor=(0.5, -0.05),
+        ncol=2,
+        prop={"size": label_size}
+    )
+    plt.savefig("{0}.{1}".format(file_name, file_type), format=file_type, dpi=dpi)
+    plt.close(fig)
@@ -1,21 +1,48 @@
 import FreeSimpleGUI as sg
 import os.path
-from wifi_heat_mapper.misc import run_iperf, run_speedtest, process_iw, load_json, save_json, verify_iperf
-from wifi_heat_mapper.misc import get_property_from, SpeedTestMode
+from wifi_heat_mapper.misc import load_json, save_json, get_property_from, SpeedTestMode, ParseError, IperfRunner
+from wifi_heat_mapper.misc import ExternalError
+from wifi_heat_mapper.backends import get_backend, set_backend, SimulatedBackend, ReplayBackend
 from wifi_heat_mapper.graph import generate_graph
 from wifi_heat_mapper.debugger import log_arguments
+from wifi_heat_mapper.feed import PositionFeed, FeedError
+from wifi_heat_mapper.stats import RunningStats, pack_samples, pack_columns, coefficient_of_variation
+from wifi_heat_mapper.stats import steady_state_time, percentile, jitter
+from wifi_heat_mapper.latency import LatencyProber, measure_latency
+from wifi_heat_mapper.servers import IperfServerPool
+from wifi_heat_mapper.roaming import RoamListener
+from wifi_heat_mapper.tracing import span, traced
+from wifi_heat_mapper.metrics import record_point, record_benchmark, record_retry
 from PIL import Image, ImageTk
 import io
 from tqdm import tqdm
 from collections import defaultdict
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import random
+import time
 
 
 class ConfigurationError(Exception):
     pass
 
 
-iperf3_modes = ["tcp", "tcp_r", "udp", "udp_r"]
+iperf3_modes = ["tcp", "tcp_r", "udp", "udp_r", "udp_probe", "udp_probe_r"]
+benchmark_order = ["tcp_r", "tcp", "udp_r", "udp", "udp_probe_r", "udp_probe", "echo", "speedtest"]
+interval_columns = ["start", "bits_per_second", "retransmits", "snd_cwnd", "jitter_ms", "lost_percent"]
+convergence_metrics = {
+    "tcp_r": ["download_bits_tcp"],
+    "tcp": ["upload_bits_tcp"],
+    "tcp_bidir": ["download_bits_tcp", "upload_bits_tcp"],
+    "udp_r": ["download_bits_udp"],
+    "udp": ["upload_bits_udp"],
+    "udp_bidir": ["download_bits_udp", "upload_bits_udp"],
+    "udp_probe_r": ["download_capacity_bits_udp"],
+    "udp_probe": ["upload_capacity_bits_udp"],
+    "echo": ["echo_latency"],
+    "speedtest": ["speedtest_download_bandwidth"],
+}
 
 
 @log_arguments
@@ -24,8 +51,8 @@ def start_gui(floor_map, iperf_server, config_file, output_file=None):
 
     Args:
         floor_map (str): the path to the floor map image.
-        iperf_server (str): the ip address (and port)
-        for the iperf3 server.
+        iperf_server (str): comma separated ip addresses
+        (and ports) of the iperf3 servers.
         config_file (str): the path to the configuration
         file.
         output_file (str): the path to the output file.
@@ -33,51 +60,17 @@ def start_gui(floor_map, iperf_server, config_file, output_file=None):
     Returns:
         None
     """
-    if os.path.isfile(config_file):
-        config_file = os.path.abspath(config_file)
-        data = load_json(config_file)
-        if data is not False:
-            configuration = get_property_from(data, "configuration")
-            logging.debug("Configuration Loaded: {0}".format(configuration))
-            ssid = get_property_from(configuration, "ssid")
-            target_interface = get_property_from(configuration, "target_interface")
-            target_ip = get_property_from(configuration, "target_ip")
-            speedtest_mode = SpeedTestMode(get_property_from(configuration, "speedtest"))
-            libre_speed_server_list = get_property_from(configuration, "libre-speed-list").strip()
-            if libre_speed_server_list == "":
-                libre_speed_server_list = None
-
-            connected_ssid = process_iw(target_interface)["ssid"]
-            logging.debug("SSID Connected: {0}".format(connected_ssid))
-            if connected_ssid != ssid:
-                print("Configuration file is for {0} but user connected to {1}"
-                      .format(ssid, connected_ssid))
-                print("Please connect to {0} and try benchmarking again."
-                      .format(ssid))
-                exit(1)
-
-            if output_file is None:
-                output_file = config_file
-
-    else:
-        raise ConfigurationError("Missing configuration file")
+    data, configuration, config_file = load_configuration(config_file)
+    ssid = get_property_from(configuration, "ssid")
+    target_interface = get_property_from(configuration, "target_interface")
+    target_ip = get_property_from(configuration, "target_ip")
+    speedtest_mode = SpeedTestMode(get_property_from(configuration, "speedtest"))
+    libre_speed_server_list = get_libre_speed_server_list(configuration)
 
-    modes = get_property_from(configuration, "modes")
-
-    if len(set(iperf3_modes).intersection(set(modes))) > 0 and iperf_server is None:
-        print("Please specify your iperf3 server IP address.")
-        exit(1)
-
-    iperf_ip = iperf_server
-    iperf_port = 5201
+    if output_file is None:
+        output_file = config_file
 
-    if iperf_server is not None:
-        if ":" in iperf_server:
-            iperf_ip = iperf_server.split(":")[0]
-            iperf_port = iperf_server.split(":")[1]
-        else:
-            iperf_ip = iperf_server
-            iperf_port = 5201
+    iperf_pool = get_iperf_server_pool(configuration, iperf_server)
 
     print("Loaded configuration file from: {0}".format(config_file))
     print("Target Interface: {0} and SSID: {1}".format(target_interface, ssid))
@@ -108,11 +101,11 @@ def start_gui(floor_map, iperf_server, config_file, output_file=None):
         layout.append(
             [sg.Button("Exit"), output_path_index, sg.FileSaveAs(button_text="Save Results",
              file_types=(('JSON file', '*.json'),), default_extension="json", key="FileName"),
-             sg.Button("Plot"), sg.Button("Clear All")])
+             sg.Button("Plot"), sg.Button("Clear All"), sg.Text("", size=(30, 1), key="Status")])
     else:
         layout.append(
             [sg.Button("Exit"), output_path_index, sg.Button("Save Results"),
-             sg.Button("Plot"), sg.Button("Clear All")])
+             sg.Button("Plot"), sg.Button("Clear All"), sg.Text("", size=(30, 1), key="Status")])
 
     window = sg.Window("Wi-Fi heat mapper", layout, finalize=True)
 
@@ -121,6 +114,18 @@ def start_gui(floor_map, iperf_server, config_file, output_file=None):
 
     graph = window.Element("Floor Map")
 
+    def report_progress(message):
+        # Tk may only be updated from the main thread, which shows it on the Progress event.
+        window.write_event_value("Progress", message)
+
+    def run_benchmark(iw):
+        try:
+            return (collect_point_results(iw, configuration, iperf_pool, speedtest_mode, target_ip,
+                                          libre_speed_server_list, roam_listener=roam_listener,
+                                          progress=report_progress), None)
+        except Exception as error:
+            return (None, error)
+
     logging.info("Drawing on canvas")
     graph.DrawImage(data=get_img_data(floor_map, first=True), location=(0, canvas_size[1]))
     logging.info("Updated canvas")
@@ -136,14 +141,17 @@ def start_gui(floor_map, iperf_server, config_file, output_file=None):
         print("Restoring previous benchmark points [{0}]".format(benchmark_count))
         benchmark_points, current_selection = replot(graph, benchmark_points)
 
-    if "iperf3" in configuration["modes"] and not verify_iperf(iperf_ip, iperf_port):
+    if iperf_pool is not None and len(iperf_pool.check()) == 0:
         print("Could not connect to iperf3 server.")
         sg.popup_error("Could not connect to iperf3 server.")
         exit(1)
 
+    roam_listener = start_roam_listener(configuration)
+
     print("Ready for benchmarking.")
 
     post_process = False
+    benchmarking = None
 
     while True:
         event, values = window.read()
@@ -151,6 +159,43 @@ def start_gui(floor_map, iperf_server, config_file, output_file=None):
         if event == "Exit" or event == sg.WIN_CLOSED:
             break
 
+        if event == "Progress":
+            window["Status"].update(values["Progress"])
+            continue
+
+        if event == "Benchmark Done":
+            window["Status"].update("")
+            point_results, benchmark_error = values["Benchmark Done"]
+            if benchmark_error is not None:
+                # Keep the survey going, the point can be benchmarked again.
+                get_backend().end_point(None)
+                benchmarking = None
+                logging.error("Benchmark failed: {0}".format(benchmark_error))
+                print("Benchmark failed: {0}".format(benchmark_error))
+                sg.popup_error("Benchmark failed: {0}".format(benchmark_error))
+                continue
+            results, interface_results = point_results
+            get_backend().end_point(get_point(benchmark_points, benchmarking))
+            record_point(point_signals(target_interface, results, interface_results))
+            benchmark_points[benchmarking]["results"] = results
+            if interface_results is not None:
+                benchmark_points[benchmarking]["interfaces"] = interface_results
+
+            benchmark_points[benchmarking]["fill_color"] = "lightblue"
+            benchmark_points, current_selection = replot(graph, benchmark_points)
+            benchmarking = None
+
+            print("Completed benchmark.")
+            logging.info("Completed benchmark")
+            if not save_results_to_disk(output_file, configuration, benchmark_points):
+                print("Unable to save to disk")
+                logging.warning("Unable to save to disk.")
+            continue
+
+        if benchmarking is not None:
+            # The canvas stays as is until the running benchmark is done.
+            continue
+
         mouse = values["Floor Map"]
         if event == "Floor Map":
             if mouse == (None, None):
@@ -199,7 +244,8 @@ def start_gui(floor_map, iperf_server, config_file, output_file=None):
         if event == "Benchmark":
             if current_selection is not None:
 
-                iw = process_iw(target_interface)
+                with span("process_iw"):
+                    iw = get_backend().process_iw(target_interface)
                 if iw["ssid"] != ssid:
                     sg.popup_error("SSID mismatch!")
                     print("SSID mismatch!")
@@ -207,26 +253,9 @@ def start_gui(floor_map, iperf_server, config_file, output_file=None):
                 else:
                     logging.info("Running benchmark")
                     print("Running benchmark")
-                    results = {}
-                    benchmark_modes = get_property_from(configuration, "modes")
-                    benchmark_iterations = get_property_from(configuration, "benchmark_iterations")
-                    results = run_benchmarks(benchmark_modes, benchmark_iterations, iperf_ip, iperf_port,
-                                             speedtest_mode, target_ip, libre_speed_server_list)
-                    results["signal_strength"] = iw["signal_strength"]
-                    results["signal_quality"] = iw["signal_strength"] + 110
-                    results["signal_quality_percent"] = min((iw["signal_strength"] + 110) * (10 / 7), 100)
-                    results["channel"] = iw["channel"]
-                    results["channel_frequency"] = iw["channel_frequency"]
-                    benchmark_points[current_selection]["results"] = results
-
-                    benchmark_points[current_selection]["fill_color"] = "lightblue"
-                    benchmark_points, current_selection = replot(graph, benchmark_points)
-
-                    print("Completed benchmark.")
-                    logging.info("Completed benchmark")
-                    if not save_results_to_disk(output_file, configuration, benchmark_points):
-                        print("Unable to save to disk")
-                        logging.warning("Unable to save to disk.")
+                    window["Status"].update("Running benchmark")
+                    benchmarking = current_selection
+                    window.start_thread(lambda iw=iw: run_benchmark(iw), "Benchmark Done")
             else:
                 print("Please select a benchmark point.")
                 sg.popup_error("Please select a benchmark point.")
@@ -284,6 +313,10 @@ def start_gui(floor_map, iperf_server, config_file, output_file=None):
             logging.error("Wiped all benchmark points")
 
     window.close()
+    if roam_listener is not None:
+        roam_listener.stop()
+    if iperf_pool is not None:
+        iperf_pool.runner.close()
 
     if post_process:
         data = {
@@ -293,6 +326,780 @@ def start_gui(floor_map, iperf_server, config_file, output_file=None):
         generate_graph(data, floor_map)
 
 
+@log_arguments
+def start_feed(floor_map, iperf_server, config_file, feed_source, replay=False, output_file=None):
+    """Starting point for benchmarking with positions taken from a
+    position feed instead of mouse clicks.
+
+    Benchmarks run back to back and each one is stored at the position
+    sample closest to the middle of its measurement window. A benchmark
+    is discarded if that sample is stale or the position moved during
+    the window.
+
+    Args:
+        floor_map (str): the path to the floor map image.
+        iperf_server (str): comma separated ip addresses
+        (and ports) of the iperf3 servers.
+        config_file (str): the path to the configuration
+        file.
+        feed_source (str): the path to the position file or
+        a ``unix:`` prefixed socket path.
+        replay (bool), optional: True to replay a recorded
+        position file in real time. Defaults to False.
+        output_file (str): the path to the output file.
+
+    Returns:
+        None
+    """
+    data, configuration, config_file = load_configuration(config_file)
+    ssid = get_property_from(configuration, "ssid")
+    target_interface = get_property_from(configuration, "target_interface")
+    target_ip = get_property_from(configuration, "target_ip")
+    speedtest_mode = SpeedTestMode(get_property_from(configuration, "speedtest"))
+    libre_speed_server_list = get_libre_speed_server_list(configuration)
+
+    if output_file is None:
+        output_file = config_file
+
+    iperf_pool = get_iperf_server_pool(configuration, iperf_server)
+
+    im = Image.open(floor_map)
+    canvas_size = (im.size[0], im.size[1])
+    logging.info("Loaded floor map with dims: {0}".format(canvas_size))
+
+    if iperf_pool is not None and len(iperf_pool.check()) == 0:
+        print("Could not connect to iperf3 server.")
+        exit(1)
+
+    benchmark_points = get_property_from(data, "results")
+    index = next_point_index(benchmark_points)
+
+    roam_listener = start_roam_listener(configuration)
+    alignment = configuration.get("position_feed", {})
+    feed = PositionFeed(feed_source, replay=replay)
+    feed.start()
+    print("Waiting for position feed from: {0}".format(feed_source))
+
+    try:
+        while not feed.finished:
+            if feed.latest() is None:
+                feed.wait(timeout=1)
+                continue
+
+            with span("process_iw"):
+                iw = get_backend().process_iw(target_interface)
+            if iw["ssid"] != ssid:
+                print("SSID mismatch!")
+                logging.error("SSID mismatched. Config: {0} | User: {1}".format(ssid, iw["ssid"]))
+                feed.wait(timeout=1)
+                continue
+
+            started = time.time()
+            try:
+                results, interface_results = collect_point_results(iw, configuration, iperf_pool, speedtest_mode,
+                                                                   target_ip, libre_speed_server_list,
+                                                                   roam_listener=roam_listener)
+            except Exception:
+                get_backend().end_point(None)
+                raise
+            finished = time.time()
+
+            try:
+                sample = feed.align(started, finished, **alignment)
+            except FeedError as error:
+                get_backend().end_point(None)
+                print("{0}, discarded the benchmark.".format(error))
+                logging.warning("Discarded benchmark window ({0}, {1}): {2}".format(started, finished, error))
+                continue
+            logging.debug("Aligned benchmark window ({0}, {1}) to position {2}".format(started, finished, sample))
+            if not (0 <= sample[1] <= canvas_size[0] and 0 <= sample[2] <= canvas_size[1]):
+                get_backend().end_point(None)
+                print("Position ({0}, {1}) is outside the floor map.".format(sample[1], sample[2]))
+                logging.warning("Discarded benchmark at position {0}".format(sample))
+                continue
+
+            get_backend().end_point((sample[1], sample[2]))
+            record_point(point_signals(target_interface, results, interface_results))
+            benchmark_points[str(index)] = {
+                "position": {
+                    "x": sample[1],
+                    "y": sample[2]
+                },
+                "fill_color": "lightblue",
+                "selected": False,
+                "station": False,
+                "results": results
+            }
+            if interface_results is not None:
+                benchmark_points[str(index)]["interfaces"] = interface_results
+            for point_results in [results] + list((interface_results or {}).values()):
+                for event in (point_results or {}).get("roam_events", []):
+                    event.extend(feed.nearest(event[0])[1:])
+            index += 1
+            print("Completed benchmark at ({0}, {1}).".format(sample[1], sample[2]))
+            if not save_results_to_disk(output_file, configuration, benchmark_points):
+                print("Unable to save to disk")
+                logging.warning("Unable to save to disk.")
+    except KeyboardInterrupt:
+        print("Stopping position feed.")
+    finally:
+        feed.stop()
+        if roam_listener is not None:
+            roam_listener.stop()
+        if iperf_pool is not None:
+            iperf_pool.runner.close()
+
+    print("Finished benchmarking {0} points.".format(processed_results(benchmark_points)))
+
+
+@log_arguments
+def start_simulation(floor_map, iperf_server, config_file, points=1000, aps=3, seed=None, latency=0.0,
+                     failure_rate=0.0, output_file="simulation.json", save_every=100, plot=False):
+    """Starting point for the simulate submodule for whm. Runs a
+    survey of random points with the SimulatedBackend, without a
+    wireless interface or the benchmark tools.
+
+    Args:
+        floor_map (str): the path to the floor map image.
+        iperf_server (str): comma separated ip addresses
+        (and ports) of the iperf3 servers, only used to fill the
+        endpoints of the results.
+        config_file (str): the path to the configuration
+        file.
+        points (int), optional: the number of points to survey.
+        Defaults to 1000.
+        aps (int), optional: the number of access points.
+        Defaults to 3.
+        seed (int), optional: seed of the random generator.
+        Defaults to None.
+        latency (float), optional: mean time in seconds every
+        simulated tool call takes. Defaults to 0.
+        failure_rate (float), optional: probability of a failed
+        iperf3 test or speedtest. Defaults to 0.
+        output_file (str), optional: the path to the output file.
+        Defaults to simulation.json.
+        save_every (int), optional: save the results every
+        save_every points. Defaults to 100.
+        plot (bool), optional: True to plot the results when the
+        survey is done. Defaults to False.
+
+    Returns:
+        None
+    """
+    data = load_json(config_file)
+    if data is False:
+        raise ConfigurationError("Unable to read configuration file")
+    canvas_size = Image.open(floor_map).size
+    backend = SimulatedBackend(canvas_size, get_property_from(data["configuration"], "ssid"), aps=aps, seed=seed,
+                               latency=latency, failure_rate=failure_rate)
+    set_backend(backend)
+
+    data, configuration, config_file = load_configuration(config_file)
+    for interface in configuration.get("interfaces", []):
+        interface["ssid"] = configuration["ssid"]
+    drop_unsupported_modes(configuration, backend)
+    speedtest_mode = SpeedTestMode(get_property_from(configuration, "speedtest"))
+    target_ip = get_property_from(configuration, "target_ip")
+    iperf_pool = get_iperf_server_pool(configuration, iperf_server or "127.0.0.1")
+    if iperf_pool is not None:
+        # A simulated busy server is free again after a simulated call, keep the default 1:30 backoff range.
+        iperf_pool.backoff = latency
+        iperf_pool.max_backoff = latency * 30
+
+    positions = random.Random(seed)
+    benchmark_points = {}
+    failed = 0
+    started = time.monotonic()
+    for index in range(1, points + 1):
+        x, y = positions.uniform(0, canvas_size[0]), positions.uniform(0, canvas_size[1])
+        backend.move_to(x, y)
+        with span("process_iw"):
+            iw = backend.process_iw(configuration["target_interface"])
+        try:
+            results, interface_results = collect_point_results(iw, configuration, iperf_pool, speedtest_mode,
+                                                               target_ip, None)
+        except (ExternalError, ParseError) as error:
+            logging.warning("Simulated benchmark at ({0}, {1}) failed: {2}".format(x, y, error))
+            failed += 1
+            continue
+        benchmark_points[str(index)] = {
+            "position": {
+                "x": x,
+                "y": y
+            },
+            "fill_color": "lightblue",
+            "selected": False,
+            "station": False,
+            "results": results
+        }
+        if interface_results is not None:
+            benchmark_points[str(index)]["interfaces"] = interface_results
+        if index % save_every == 0:
+            save_results_to_disk(output_file, configuration, benchmark_points)
+    elapsed = time.monotonic() - started
+    if iperf_pool is not None:
+        iperf_pool.runner.close()
+
+    if not save_results_to_disk(output_file, configuration, benchmark_points):
+        print("Unable to save to disk")
+        exit(1)
+    print("Simulated {0} points ({1} failed) in {2:.1f}s, {3:.1f} points/s.".format(
+        len(benchmark_points), failed, elapsed, points / max(elapsed, 1e-9)))
+    print("Saved results to {0}".format(output_file))
+    if plot:
+        generate_graph(output_file, floor_map)
+
+
+@log_arguments
+def start_replay(capture_file, config_file, iperf_server=None, output_file="replay.json"):
+    """Starting point for the replay submodule for whm. Runs the
+    parsers and result extraction of a survey again on the tool
+    outputs captured with benchmark --record.
+
+    Args:
+        capture_file (str): the path to the capture file.
+        config_file (str): the path to the configuration
+        file the capture was recorded with.
+        iperf_server (str), optional: comma separated ip
+        addresses (and ports) of the iperf3 servers, only used to
+        fill the endpoints of the results. Defaults to None.
+        output_file (str), optional: the path to the output file.
+        Defaults to replay.json.
+
+    Returns:
+        None
+    """
+    backend = ReplayBackend(capture_file)
+    set_backend(backend)
+
+    _, configuration, config_file = load_configuration(config_file)
+    drop_unsupported_modes(configuration, backend)
+    ssid = get_property_from(configuration, "ssid")
+    target_interface = get_property_from(configuration, "target_interface")
+    target_ip = get_property_from(configuration, "target_ip")
+    speedtest_mode = SpeedTestMode(get_property_from(configuration, "speedtest"))
+    libre_speed_server_list = get_libre_speed_server_list(configuration)
+    if iperf_server is None and len(configuration.get("iperf3", {}).get("servers", [])) == 0:
+        iperf_server = "127.0.0.1"
+    iperf_pool = get_iperf_server_pool(configuration, iperf_server)
+
+    benchmark_points = {}
+    failed = 0
+    started = time.monotonic()
+    for index, position in enumerate(backend.points, start=1):
+        try:
+            # Points benchmarked after an SSID mismatch come after the mismatched iw output.
+            with span("process_iw"):
+                iw = backend.process_iw(target_interface)
+                while iw["ssid"] != ssid:
+                    iw = backend.process_iw(target_interface)
+            results, interface_results = collect_point_results(iw, configuration, iperf_pool, speedtest_mode,
+                                                               target_ip, libre_speed_server_list)
+        except (ExternalError, ParseError) as error:
+            logging.warning("Replaying point {0} failed: {1}".format(index, error))
+            failed += 1
+            continue
+        if position is None:
+            continue
+        benchmark_points[str(index)] = {
+            "position": {
+                "x": position[0],
+                "y": position[1]
+            },
+            "fill_color": "lightblue",
+            "selected": False,
+            "station": False,
+            "results": results
+        }
+        if interface_results is not None:
+            benchmark_points[str(index)]["interfaces"] = interface_results
+    elapsed = time.monotonic() - started
+    if iperf_pool is not None:
+        iperf_pool.runner.close()
+
+    if not save_results_to_disk(output_file, configuration, benchmark_points):
+        print("Unable to save to disk")
+        exit(1)
+    print("Replayed {0} points ({1} failed) in {2:.2f}s, {3:.1f} points/s.".format(
+        len(benchmark_points), failed, elapsed, len(backend.points) / max(elapsed, 1e-9)))
+    print("Saved results to {0}".format(output_file))
+
+
+def drop_unsupported_modes(configuration, backend):
+    """Removes the modes a backend cannot measure from the
+    configuration.
+
+    Args:
+        configuration (dict): Dictionary containing the
+        configuration, updated in place.
+        backend (Backend): The backend taking the measurements.
+
+    Returns:
+        None
+    """
+    modes = get_property_from(configuration, "modes")
+    skipped = [mode for mode in modes if mode in backend.unsupported_modes]
+    if skipped:
+        print("Skipping modes {0} does not support: {1}".format(type(backend).__name__, ", ".join(skipped)))
+        configuration["modes"] = [mode for mode in modes if mode not in backend.unsupported_modes]
+
+
+def load_configuration(config_file):
+    """Loads a configuration file and verifies that the
+    configured wireless network is connected.
+
+    Args:
+        config_file (str): the path to the configuration
+        file.
+
+    Returns:
+        data (dict): Dictionary containing the configuration
+        and the results.
+        configuration (dict): Dictionary containing the
+        configuration.
+        config_file (str): the absolute path to the
+        configuration file.
+
+    Raises:
+        ConfigurationError: When the configuration file
+        does not exist or cannot be read.
+    """
+    if not os.path.isfile(config_file):
+        raise ConfigurationError("Missing configuration file")
+    config_file = os.path.abspath(config_file)
+    data = load_json(config_file)
+    if data is False:
+        raise ConfigurationError("Unable to read configuration file")
+    configuration = get_property_from(data, "configuration")
+    logging.debug("Configuration Loaded: {0}".format(configuration))
+
+    ssid = get_property_from(configuration, "ssid")
+    connected_ssid = get_backend().process_iw(get_property_from(configuration, "target_interface"))["ssid"]
+    logging.debug("SSID Connected: {0}".format(connected_ssid))
+    if connected_ssid != ssid:
+        print("Configuration file is for {0} but user connected to {1}"
+              .format(ssid, connected_ssid))
+        print("Please connect to {0} and try benchmarking again."
+              .format(ssid))
+        exit(1)
+    for interface in configuration.get("interfaces", []):
+        connected_ssid = get_backend().process_iw(interface["target_interface"])["ssid"]
+        if connected_ssid != interface["ssid"]:
+            print("Configuration file is for {0} on {1} but it is connected to {2}"
+                  .format(interface["ssid"], interface["target_interface"], connected_ssid))
+            exit(1)
+    return (data, configuration, config_file)
+
+
+def get_libre_speed_server_list(configuration):
+    """Gets the custom librespeed server list from the
+    configuration.
+
+    Args:
+        configuration (dict): Dictionary containing the
+        configuration.
+
+    Returns:
+        str or None: The path to the server list, None
+        if the official list is used.
+    """
+    libre_speed_server_list = get_property_from(configuration, "libre-speed-list").strip()
+    if libre_speed_server_list == "":
+        return None
+    return libre_speed_server_list
+
+
+def get_iperf_server_pool(configuration, iperf_server):
+    """Builds the pool of iperf3 servers from the server
+    argument, falling back to the servers listed in the
+    configuration.
+
+    Args:
+        configuration (dict): Dictionary containing the
+        configuration.
+        iperf_server (str): comma separated ip addresses
+        (and ports) of the iperf3 servers.
+
+    Returns:
+        IperfServerPool or None: The server pool, None if
+        no iperf3 mode is selected.
+    """
+    modes = get_property_from(configuration, "modes")
+    if len(set(iperf3_modes).intersection(set(modes))) == 0:
+        return None
+
+    iperf_options = configuration.get("iperf3", {})
+    servers = iperf_options.get("servers", [])
+    if iperf_server is not None:
+        servers = iperf_server.split(",")
+    if len(servers) == 0:
+        print("Please specify your iperf3 server IP address.")
+        exit(1)
+
+    return IperfServerPool([parse_iperf_server(server) for server in servers],
+                           backoff=iperf_options.get("busy_backoff", 1.0),
+                           max_backoff=iperf_options.get("max_backoff", 30.0),
+                           max_wait=iperf_options.get("max_wait", 120.0),
+                           runner=IperfRunner(), check=get_backend().verify_iperf)
+
+
+def get_interface_iperf_pool(iperf_pool, interface, index):
+    """Gets the iperf3 servers of an additional interface, so
+    it does not wait for the servers of the other interfaces.
+
+    Args:
+        iperf_pool (IperfServerPool): The iperf3 servers of the
+        target interface or None.
+        interface (dict): Dictionary containing the configuration
+        of the interface.
+        index (int): Index of the interface, starting at 1.
+
+    Returns:
+        IperfServerPool or None: The iperf3 servers listed for
+        the interface, by default the servers of the target
+        interface on their port plus index. None if no iperf3
+        mode is selected.
+    """
+    if iperf_pool is None:
+        return None
+    servers = [parse_iperf_server(server) for server in interface.get("iperf3_servers", [])]
+    return iperf_pool.for_interface(index, servers)
+
+
+def parse_iperf_server(iperf_server):
+    """Splits an iperf3 server into ip address and port.
+
+    Args:
+        iperf_server (str): the ip address (and port)
+        for the iperf3 server.
+
+    Returns:
+        tuple: Containing the ip address and the port in
+        the form of (ip, port).
+    """
+    iperf_ip = iperf_server.strip()
+    iperf_port = 5201
+
+    if ":" in iperf_ip:
+        iperf_ip, iperf_port = iperf_ip.split(":")
+        iperf_port = int(iperf_port)
+
+    return (iperf_ip, iperf_port)
+
+
+def start_roam_listener(configuration):
+    """Starts listening for roaming events if a roaming graph
+    is selected.
+
+    Args:
+        configuration (dict): Dictionary containing the
+        configuration.
+
+    Returns:
+        RoamListener or None: The running listener, None if
+        roaming is not selected or iw event failed.
+    """
+    if "roaming" not in get_property_from(configuration, "modes"):
+        return None
+    roam_listener = RoamListener()
+    if not roam_listener.start():
+        print("Unable to listen for roaming events.")
+        return None
+    return roam_listener
+
+
+def collect_point_results(iw, configuration, iperf_pool, speedtest_mode, bind_address,
+                          libre_speed_server_list, roam_listener=None, progress=None):
+    """Runs the configured benchmarks on the target interface
+    and, concurrently, on every additional interface of the
+    configuration.
+
+    Args:
+        iw (dict): Dictionary containing the wireless metrics
+        of the target interface from process_iw.
+        configuration (dict): Dictionary containing the
+        configuration.
+        iperf_pool (IperfServerPool): The iperf3 servers.
+        speedtest_mode (SpeedTestMode): Speedtest backend to use.
+        bind_address (str): The target interface ip address.
+        libre_speed_server_list (str): The path to the
+        librespeed server json file or None.
+        roam_listener (RoamListener), optional: Listener for
+        roaming events. Default is None.
+        progress (function), optional: Called with progress
+        messages of the target interface. Default is None.
+
+    Returns:
+        tuple: Containing the results of the target interface
+        and a dictionary of interface name and results of the
+        additional interfaces, or None if there are none.
+    """
+    interfaces = configuration.get("interfaces", [])
+    if len(interfaces) == 0:
+        return (collect_results(iw, configuration, iperf_pool, speedtest_mode, bind_address,
+                                libre_speed_server_list, roam_listener=roam_listener, progress=progress), None)
+
+    # libiperf can only run one test per process, use the iperf3 binary instead.
+    configuration = dict(configuration, iperf3=dict(configuration.get("iperf3", {}), subprocess=True))
+    with ThreadPoolExecutor(max_workers=len(interfaces) + 1, thread_name_prefix="survey") as executor:
+        target = executor.submit(collect_results, iw, configuration, iperf_pool, speedtest_mode, bind_address,
+                                 libre_speed_server_list, roam_listener=roam_listener, progress=progress)
+        others = {interface["target_interface"]: executor.submit(
+                      collect_interface_results, interface, configuration,
+                      get_interface_iperf_pool(iperf_pool, interface, index), speedtest_mode,
+                      libre_speed_server_list, roam_listener=roam_listener)
+                  for index, interface in enumerate(interfaces, 1)}
+        return (target.result(), {name: future.result() for name, future in others.items()})
+
+
+def collect_interface_results(interface, configuration, iperf_pool, speedtest_mode, libre_speed_server_list,
+                              roam_listener=None):
+    """Runs the configured benchmarks on an additional
+    interface.
+
+    Args:
+        interface (dict): Dictionary containing the
+        target_interface, target_ip and ssid of the
+        interface.
+        configuration (dict): Dictionary containing the
+        configuration.
+        iperf_pool (IperfServerPool): The iperf3 servers.
+        speedtest_mode (SpeedTestMode): Speedtest backend to use.
+        libre_speed_server_list (str): The path to the
+        librespeed server json file or None.
+        roam_listener (RoamListener), optional: Listener for
+        roaming events. Default is None.
+
+    Returns:
+        dict or None: Dictionary containing metrics and their
+        values, None if the interface is connected to another
+        SSID.
+    """
+    with span("process_iw", interface["target_interface"]):
+        iw = get_backend().process_iw(interface["target_interface"])
+    if iw["ssid"] != interface["ssid"]:
+        print("SSID mismatch on {0}!".format(interface["target_interface"]))
+        logging.error("SSID mismatched on {0}. Config: {1} | User: {2}"
+                      .format(interface["target_interface"], interface["ssid"], iw["ssid"]))
+        return None
+    return collect_results(iw, configuration, iperf_pool, speedtest_mode, interface["target_ip"],
+                           libre_speed_server_list, roam_listener=roam_listener)
+
+
+def collect_results(iw, configuration, iperf_pool, speedtest_mode, bind_address,
+                    libre_speed_server_list, roam_listener=None, progress=None):
+    """Runs the configured benchmarks and combines them with
+    the wireless metrics of a benchmark point.
+
+    Args:
+        iw (dict): Dictionary containing the wireless metrics
+        from process_iw.
+        configuration (dict): Dictionary containing the
+        configuration.
+        iperf_pool (IperfServerPool): The iperf3 servers.
+        speedtest_mode (SpeedTestMode): Speedtest backend to use.
+        bind_address (str): The wireless interface ip
+        address of the client which is being used to
+        benchmark.
+        libre_speed_server_list (str): The path to the
+        librespeed server json file or None.
+        roam_listener (RoamListener), optional: Listener for
+        roaming events. The roam count and disconnected time
+        during the benchmarks are added to the results.
+        Default is None.
+        progress (function), optional: Called with progress
+        messages. Default is None.
+
+    Returns:
+        dict: Dictionary containing metrics and their values in
+        corresponding key value pairs.
+    """
+    started = time.time()
+    benchmark_modes = get_property_from(configuration, "modes")
+    benchmark_iterations = get_property_from(configuration, "benchmark_iterations")
+    start_iw = iw
+    if "scan" in benchmark_modes:
+        logging.debug("Scanning on {0}".format(iw["interface"]))
+        with span("scan_iw"):
+            scan = get_backend().scan_iw(iw["interface"])
+        # A scan leaves the channel, which can reset the survey counters.
+        start_iw = read_link_metrics(iw["interface"]) or iw
+    results = run_benchmarks(benchmark_modes, benchmark_iterations, iperf_pool,
+                             speedtest_mode, bind_address, libre_speed_server_list,
+                             adaptive=configuration.get("adaptive"),
+                             iperf_options=configuration.get("iperf3"),
+                             latency=configuration.get("latency"),
+                             echo=configuration.get("echo"),
+                             speedtest_server=configuration.get("speedtest_server"),
+                             progress=progress)
+    end_iw = read_link_metrics(iw["interface"])
+    results["signal_strength"] = iw["signal_strength"]
+    results["signal_quality"] = iw["signal_strength"] + 110
+    results["signal_quality_percent"] = min((iw["signal_strength"] + 110) * (10 / 7), 100)
+    results["channel"] = iw["channel"]
+    results["channel_frequency"] = iw["channel_frequency"]
+    results.update(station_metrics(start_iw, end_iw))
+    results.update(survey_metrics(start_iw, end_iw))
+    if roam_listener is not None:
+        results.update(roam_listener.metrics(iw["interface"], started, time.time()))
+    if "scan" in benchmark_modes:
+        results.update(scan_metrics(iw, scan))
+    return results
+
+
+def point_signals(target_interface, results, interface_results):
+    """Get the signal strength of every interface benchmarked at
+    a point.
+
+    Args:
+        target_interface (str): the target interface.
+        results (dict): Dictionary containing the metrics of the
+        target interface.
+        interface_results (dict): Dictionary of interface name and
+        metrics of the additional interfaces, or None.
+
+    Returns:
+        dict: Dictionary of interface name and signal strength.
+    """
+    signals = {target_interface: results["signal_strength"]}
+    for interface, interface_result in (interface_results or {}).items():
+        if interface_result is not None:
+            signals[interface] = interface_result["signal_strength"]
+    return signals
+
+
+def read_link_metrics(interface):
+    """Read the wireless metrics of an interface around the
+    benchmarks of a point.
+
+    Args:
+        interface (str): the wireless interface.
+
+    Returns:
+        dict or None: Dictionary containing the wireless metrics
+        from process_iw, None if they could not be parsed.
+    """
+    try:
+        with span("process_iw"):
+            return get_backend().process_iw(interface)
+    except ParseError:
+        logging.warning("Unable to read the link metrics of {0}".format(interface))
+        return None
+
+
+def station_metrics(start, end):
+    """Extracts the link metrics of a benchmark point from the
+    station dumps read before and after its benchmarks.
+
+    The rates come from the dump after the benchmarks, when the
+    link just carried traffic, or the dump before them if the
+    driver left a rate out. The counters are replaced by their
+    change over the benchmarks and dropped if the client
+    reassociated in between, which resets them.
+
+    Args:
+        start (dict): Dictionary containing the wireless metrics
+        from process_iw before the benchmarks.
+        end (dict): Dictionary containing the wireless metrics
+        from process_iw after the benchmarks, or None.
+
+    Returns:
+        dict: Dictionary containing metrics and their values in
+        corresponding key value pairs.
+    """
+    counters = ("tx_packets", "tx_retries", "tx_failed", "beacon_loss")
+    before = start.get("station", {})
+    after = end.get("station", {}) if end is not None else {}
+    metrics = {key: value for key, value in dict(before, **after).items() if key not in counters}
+    shared = [key for key in counters if key in before and key in after]
+    if end is None or end.get("ssid_mac") != start.get("ssid_mac") or any(after[key] < before[key] for key in shared):
+        return metrics
+    deltas = {key: after[key] - before[key] for key in shared}
+    for key in ("tx_retries", "tx_failed", "beacon_loss"):
+        if key in deltas:
+            metrics[key] = deltas[key]
+    if deltas.get("tx_packets", 0) > 0:
+        for key, name in (("tx_retries", "tx_retry_percent"), ("tx_failed", "tx_failed_percent")):
+            if key in deltas:
+                metrics[name] = deltas[key] * 100 / deltas["tx_packets"]
+    return metrics
+
+
+def survey_metrics(start, end):
+    """Extracts the noise and channel utilization metrics from
+    the surveys of the in-use channel read before and after the
+    benchmarks of a point. Metrics the driver does not report are
+    left out.
+
+    The survey times count since the last channel switch, so the
+    utilization is the change of the busy, receive and transmit
+    times over the change of the active time. It is left out if
+    the channel changed or a time did not grow.
+
+    Args:
+        start (dict): Dictionary containing the wireless metrics
+        from process_iw before the benchmarks.
+        end (dict): Dictionary containing the wireless metrics
+        from process_iw after the benchmarks, or None.
+
+    Returns:
+        dict: Dictionary containing metrics and their values in
+        corresponding key value pairs.
+    """
+    metrics = {}
+    if "noise" in start:
+        metrics["noise_floor"] = start["noise"]
+        metrics["snr"] = start["signal_strength"] - start["noise"]
+    if end is None or end.get("channel_frequency") != start.get("channel_frequency"):
+        return metrics
+    if "channel_active_time" not in start or "channel_active_time" not in end:
+        return metrics
+    active = end["channel_active_time"] - start["channel_active_time"]
+    if active <= 0:
+        return metrics
+    for key, name in (("channel_busy_time", "busy"), ("channel_receive_time", "rx"),
+                      ("channel_transmit_time", "tx")):
+        if key in start and key in end and end[key] >= start[key]:
+            metrics["channel_{0}_percent".format(name)] = (end[key] - start[key]) * 100 / active
+    return metrics
+
+
+def scan_metrics(iw, scan):
+    """Extracts the metrics from a scan.
+
+    Args:
+        iw (dict): Dictionary containing the wireless metrics
+        from process_iw.
+        scan (dict): Dictionary of BSSID and access point
+        from scan_iw.
+
+    Returns:
+        dict: Dictionary containing metrics and their values in
+        corresponding key value pairs, and the scan table.
+    """
+    return {
+        "scan": scan,
+        "scan_ap_count": len(scan),
+        "scan_co_channel": len([bssid for bssid, ap in scan.items()
+                                if ap["frequency"] == iw["channel_frequency"]
+                                and bssid != iw.get("ssid_mac", "").lower()]),
+    }
+
+
+def next_point_index(benchmark_points):
+    """Gets an unused index for a new benchmark point.
+
+    Args:
+        benchmark_points (dict): Dictionary containing
+        the benchmark points.
+
+    Returns:
+        int: Index greater than any existing index.
+    """
+    indices = [int(itm) for itm in benchmark_points.keys()]
+    return max(indices, default=0) + 1
+
+
 def contains(pt1, pt2):
     """Check if tuple (x, y) of first point lies in
     a circle contructed from the center point of
@@ -324,6 +1131,7 @@ def get_point(data, index):
     return (data[index]["position"]["x"], data[index]["position"]["y"])
 
 
+@traced("replot")
 def replot(graph, benchmark_points, clear=False):
     """Redraws the circles on the canvas from a
     dictionary containing benchmark points.
@@ -407,6 +1215,7 @@ def get_img_data(f, first=False):
     return ImageTk.PhotoImage(img)
 
 
+@traced("save")
 def save_results_to_disk(file_path, configuration_data, benchmark_points):
     """Saves the results to disk.
 
@@ -429,8 +1238,9 @@ def save_results_to_disk(file_path, configuration_data, benchmark_points):
     return save_json(file_path, data)
 
 
-def run_benchmarks(benchmark_modes, benchmark_iterations, iperf_ip, iperf_port, speedtest_mode, bind_address,
-                   libre_speed_server_list):
+def run_benchmarks(benchmark_modes, benchmark_iterations, iperf_pool, speedtest_mode, bind_address,
+                   libre_speed_server_list, adaptive=None, iperf_options=None, latency=None, echo=None,
+                   speedtest_server=None, progress=None):
     """Runs benchmark for a given benchmark point.
 
     Args:
@@ -438,8 +1248,7 @@ def run_benchmarks(benchmark_modes, benchmark_iterations, iperf_ip, iperf_port,
         of modes to use for benchmarking.
         benchmark_iterations (int): Number of times to repeat
         benchmarking.
-        iperf_ip (str): ip address of the iperf3 server.
-        iperf_port (int): port of the iperf3 server.
+        iperf_pool (IperfServerPool): The iperf3 servers.
         speedtest_mode (SpeedTestMode): Speedtest backend to use.
         bind_address (str): The wireless interface ip
         address of the client which is being used to
@@ -448,93 +1257,542 @@ def run_benchmarks(benchmark_modes, benchmark_iterations, iperf_ip, iperf_port,
         path to the librespeed server json file.
         Default is None which forces librespeed to use
         global list.
+        adaptive (dict), optional: Adaptive iteration settings.
+        When enabled every mode is repeated between
+        'min_iterations' and 'max_iterations' times and stops
+        once the confidence interval half-width of its main
+        metric falls below 'tolerance' relative to the mean.
+        Default is None which repeats every mode
+        benchmark_iterations times.
+        iperf_options (dict), optional: iperf3 settings from
+        the configuration. Default is None which runs iperf3
+        with its default settings.
+        latency (dict), optional: Latency prober settings from
+        the configuration. Used when the 'latency' mode is
+        selected to measure idle latency and latency during
+        every iperf3 test. Default is None.
+        echo (dict), optional: Echo probe settings from the
+        configuration. Required by the 'echo' mode. Default
+        is None.
+        speedtest_server (dict), optional: The pinned speedtest
+        server from the configuration, updated in place when a
+        server is selected. Default is None which lets the
+        speedtest backend select a server every time.
+        progress (function), optional: Called with a progress
+        message before every benchmark and while a speedtest
+        runs. Default is None.
 
     Returns:
         dict: Dictionary containing metrics and their values in
         corresponding key value pairs.
     """
-    results = defaultdict(float)
-    if "base" in benchmark_modes:
-        progress = (len(benchmark_modes) - 1) * benchmark_iterations
-    else:
-        progress = len(benchmark_modes) * benchmark_iterations
-    pbar = tqdm(total=progress)
-    for _ in range(benchmark_iterations):
-        if "tcp_r" in benchmark_modes:
-            logging.debug("Running iperf3 in tcp_r mode")
-            iperf_download = run_iperf(iperf_ip, iperf_port, bind_address, download=True, protocol="tcp")
-            results["download_bits_tcp"] += iperf_download["end"]["sum_received"]["bits_per_second"]
-            results["download_bytes_tcp"] += iperf_download["end"]["sum_received"]["bits_per_second"] / 8
-            results["download_bytes_data_tcp"] += iperf_download["end"]["sum_received"]["bytes"]
-            results["download_time_tcp"] += iperf_download["start"]["test_start"]["duration"]
+    adaptive_enabled = adaptive is not None and adaptive.get("enabled", False)
+    min_iterations = max_iterations = benchmark_iterations
+    if adaptive_enabled:
+        min_iterations = adaptive.get("min_iterations", 2)
+        max_iterations = adaptive.get("max_iterations", benchmark_iterations)
+        tolerance = adaptive.get("tolerance", 0.05)
+        confidence = adaptive.get("confidence", 0.95)
+
+    modes = [mode for mode in benchmark_order if mode in benchmark_modes]
+    bidirectional = iperf_options is not None and iperf_options.get("bidirectional", False)
+    if bidirectional:
+        for protocol in ("tcp", "udp"):
+            if protocol in modes and protocol + "_r" in modes:
+                modes.remove(protocol)
+                modes[modes.index(protocol + "_r")] = protocol + "_bidir"
+    stats = defaultdict(RunningStats)
+    samples = defaultdict(list)
+    intervals = defaultdict(list)
+    streams = defaultdict(list)
+    endpoints = defaultdict(list)
+    iterations = defaultdict(int)
+    converged = set()
+
+    latency_enabled = latency is not None and "latency" in benchmark_modes
+    loaded_rtts = []
+    if latency_enabled:
+        latency_ip, latency_port = latency["target"].rsplit(":", 1)
+        prober_options = {
+            "interval": latency.get("interval", 0.05),
+            "timeout": latency.get("timeout", 1.0),
+            "bind_address": bind_address,
+        }
+        logging.debug("Measuring idle latency")
+        idle_prober = measure_latency(latency_ip, latency_port, duration=latency.get("idle_duration", 1.0),
+                                      **prober_options)
+
+    pbar = tqdm(total=len(modes) * max_iterations)
+    for _ in range(max_iterations):
+        pending = [mode for mode in modes if mode not in converged]
+        if not pending:
+            break
+        for mode in pending:
+            if progress is not None:
+                progress("Running {0} ({1}/{2})".format(mode, pbar.n + 1, pbar.total))
+            mode_started = time.monotonic()
+            if mode == "speedtest":
+                logging.debug("Running speedtest enum value: {0}".format(speedtest_mode))
+                speedtest_result = run_pinned_speedtest(speedtest_mode, bind_address, libre_speed_server_list,
+                                                        speedtest_server, progress=progress)
+                metrics = speedtest_metrics(speedtest_mode, speedtest_result)
+            elif mode == "echo":
+                logging.debug("Running echo probe against {0}".format(echo["target"]))
+                echo_ip, echo_port = echo["target"].rsplit(":", 1)
+                echo_count = echo.get("count", 40)
+                echo_interval = echo.get("interval", 0.05)
+                echo_prober = measure_latency(echo_ip, echo_port, duration=echo_count * echo_interval,
+                                              interval=echo_interval, timeout=echo.get("timeout", 1.0),
+                                              bind_address=bind_address, protocol=echo.get("protocol", "udp"))
+                metrics = echo_metrics(echo_prober)
+            else:
+                prober = nullcontext()
+                if latency_enabled:
+                    prober = LatencyProber(latency_ip, latency_port, **prober_options)
+                with prober:
+                    if mode.startswith("udp_probe"):
+                        logging.debug("Running UDP capacity probe in {0} mode".format(mode))
+                        probe_result, endpoint = iperf_pool.run(run_udp_probe, mode, bind_address=bind_address,
+                                                                iperf_options=iperf_options,
+                                                                runner=iperf_pool.runner)
+                    else:
+                        logging.debug("Running iperf3 in {0} mode".format(mode))
+                        iperf_result, endpoint = iperf_pool.run(run_iperf_mode, mode, bind_address=bind_address,
+                                                                iperf_options=iperf_options,
+                                                                runner=iperf_pool.runner)
+                    endpoints[mode].append(endpoint)
+                if latency_enabled:
+                    loaded_rtts += prober.rtts
+
+                if mode.startswith("udp_probe"):
+                    metrics = udp_probe_metrics(mode, probe_result)
+                else:
+                    if mode.endswith("_bidir"):
+                        protocol = mode.split("_")[0]
+                        parts = zip((protocol + "_r", protocol), split_bidirectional(iperf_result), strict=True)
+                    else:
+                        parts = [(mode, iperf_result)]
+                    metrics = {}
+                    for part_mode, part_result in parts:
+                        metrics.update(iperf_metrics(part_mode, part_result))
+                        series = iperf_intervals(part_result)
+                        metrics.update(interval_metrics(part_mode, series))
+                        intervals[part_mode].append(pack_columns(series))
+                        stream_results = iperf_streams(part_mode, part_result)
+                        if len(stream_results) > 1:
+                            streams[part_mode].append(stream_results)
+
+            record_benchmark(mode, time.monotonic() - mode_started,
+                             {key: metrics[key] for key in convergence_metrics[mode] if key in metrics})
+            for key, value in metrics.items():
+                stats[key].add(value)
+                samples[key].append(value)
+            iterations[mode] += 1
             pbar.update(1)
 
-        if "tcp" in benchmark_modes:
-            logging.debug("Running iperf3 in tcp mode")
-            iperf_download = run_iperf(iperf_ip, iperf_port, bind_address, download=False, protocol="tcp")
-            results["upload_bits_tcp"] += iperf_download["end"]["sum_sent"]["bits_per_second"]
-            results["upload_bytes_tcp"] += iperf_download["end"]["sum_sent"]["bits_per_second"] / 8
-            results["upload_bytes_data_tcp"] += iperf_download["end"]["sum_sent"]["bytes"]
-            results["upload_time_tcp"] += iperf_download["start"]["test_start"]["duration"]
-            pbar.update(1)
+            if adaptive_enabled and iterations[mode] >= min_iterations and \
+                    all(stats[key].converged(tolerance, confidence) for key in convergence_metrics[mode]):
+                logging.debug("Mode {0} converged after {1} iterations".format(mode, iterations[mode]))
+                converged.add(mode)
+    pbar.total = pbar.n
+    pbar.close()
 
-        if "udp_r" in benchmark_modes:
-            logging.debug("Running iperf3 in udp_r mode")
-            iperf_download = run_iperf(iperf_ip, iperf_port, bind_address, download=True, protocol="udp")
-            results["download_bits_udp"] += iperf_download["end"]["sum"]["bits_per_second"]
-            results["download_bytes_udp"] += iperf_download["end"]["sum"]["bits_per_second"] / 8
-            results["download_bytes_data_udp"] += iperf_download["end"]["sum"]["bytes"]
-            results["download_time_udp"] += iperf_download["start"]["test_start"]["duration"]
-            results["download_jitter_udp"] += iperf_download["end"]["sum"]["jitter_ms"]
-            results["download_jitter_packets_udp"] += iperf_download["end"]["sum"]["packets"]
-            results["download_jitter_lost_packets_udp"] += iperf_download["end"]["sum"]["lost_packets"]
-            pbar.update(1)
+    results = {key: value.mean for key, value in stats.items()}
+    results["samples"] = {key: pack_samples(values) for key, values in samples.items()}
+    if intervals:
+        results["intervals"] = dict(intervals)
+    if streams:
+        results["streams"] = dict(streams)
+    if endpoints:
+        results["endpoints"] = dict(endpoints)
+    if any(mode.endswith("_bidir") for mode in modes):
+        results["bidirectional"] = True
+    if latency_enabled:
+        results.update(latency_metrics(idle_prober.rtts, loaded_rtts))
+        results["latency_samples"] = {
+            "idle": pack_samples(idle_prober.rtts),
+            "loaded": pack_samples(loaded_rtts),
+        }
 
-        if "udp" in benchmark_modes:
-            logging.debug("Running iperf3 in udp mode")
-            iperf_download = run_iperf(iperf_ip, iperf_port, bind_address, download=False, protocol="udp")
-            results["upload_bits_udp"] += iperf_download["end"]["sum"]["bits_per_second"]
-            results["upload_bytes_udp"] += iperf_download["end"]["sum"]["bits_per_second"] / 8
-            results["upload_bytes_data_udp"] += iperf_download["end"]["sum"]["bytes"]
-            results["upload_time_udp"] += iperf_download["start"]["test_start"]["duration"]
-            results["upload_jitter_udp"] += iperf_download["end"]["sum"]["jitter_ms"]
-            results["upload_jitter_packets_udp"] += iperf_download["end"]["sum"]["packets"]
-            results["upload_jitter_lost_packets_udp"] += iperf_download["end"]["sum"]["lost_packets"]
-            pbar.update(1)
+    if adaptive_enabled:
+        results["iterations"] = dict(iterations)
+        results["confidence_interval"] = {key: value.half_width(confidence) for key, value in stats.items()}
 
-        if "speedtest" in benchmark_modes:
-            logging.debug("Running speedtest enum value: {0}".format(speedtest_mode))
-            speedtest_download = run_speedtest(speedtest_mode, bind_address,
-                                               libre_speed_server_list=libre_speed_server_list)
-            if speedtest_mode == SpeedTestMode.OOKLA:
-                results["speedtest_jitter"] += speedtest_download["ping"]["jitter"]
-                results["speedtest_latency"] += speedtest_download["ping"]["latency"]
-                results["speedtest_download_bandwidth"] += speedtest_download["download"]["bandwidth"]
-                results["speedtest_download_size"] += speedtest_download["download"]["bytes"]
-                results["speedtest_download_elapsed_ms"] += speedtest_download["download"]["elapsed"]
-                results["speedtest_upload_bandwidth"] += speedtest_download["upload"]["bandwidth"]
-                results["speedtest_upload_size"] += speedtest_download["upload"]["bytes"]
-                results["speedtest_upload_elapsed_ms"] += speedtest_download["upload"]["elapsed"]
-                pbar.update(1)
-
-            elif speedtest_mode == SpeedTestMode.SIVEL:
-                results["speedtest_latency"] += speedtest_download["server"]["latency"]
-                results["speedtest_download_bandwidth"] += speedtest_download["download"] / 8
-                results["speedtest_download_size"] += speedtest_download["bytes_received"]
-                results["speedtest_upload_bandwidth"] += speedtest_download["upload"] / 8
-                results["speedtest_upload_size"] += speedtest_download["bytes_sent"]
-                pbar.update(1)
-
-            elif speedtest_mode == SpeedTestMode.LIBRESPEED:
-                results["speedtest_jitter"] += speedtest_download["jitter"]
-                results["speedtest_latency"] += speedtest_download["ping"]
-                results["speedtest_download_bandwidth"] += (speedtest_download["download"] * (1 << 20) / 8)
-                results["speedtest_download_size"] += speedtest_download["bytes_received"]
-                results["speedtest_upload_bandwidth"] += (speedtest_download["upload"] * (1 << 20) / 8)
-                results["speedtest_upload_size"] += speedtest_download["bytes_sent"]
-                pbar.update(1)
-    pbar.close()
+    return results
 
-    results = {key: value / benchmark_iterations for key, value in results.items()}
 
-    return results
+def run_iperf_mode(mode, iperf_ip, iperf_port, bind_address, iperf_options=None, runner=None):
+    """Runs iperf3 for a benchmark mode.
+
+    Args:
+        mode (str): The iperf3 mode (tcp, tcp_r, tcp_bidir, udp,
+        udp_r or udp_bidir).
+        iperf_ip (str): ip address of the iperf3 server.
+        iperf_port (int): port of the iperf3 server.
+        bind_address (str): The wireless interface ip
+        address of the client which is being used to
+        benchmark.
+        iperf_options (dict), optional: iperf3 settings from
+        the configuration.
+        runner (IperfRunner), optional: Runner shared by the
+        libiperf tests of the survey.
+
+    Returns:
+        dict: Dictionary containing the iperf3 results.
+    """
+    if iperf_options is None:
+        iperf_options = {}
+    download = mode.endswith("_r")
+    protocol = mode.split("_")[0]
+    tuning = {
+        "bidirectional": mode.endswith("_bidir"),
+        "num_streams": iperf_options.get("parallel", 1),
+        "window_size": iperf_options.get("window_size"),
+        "bandwidth": iperf_options.get("bandwidth") if protocol == "udp" else None,
+    }
+    streaming = iperf_options.get("streaming", False)
+    if streaming or iperf_options.get("subprocess", False):
+        with span("run_iperf_stream", mode):
+            return get_backend().run_iperf_stream(iperf_ip, iperf_port, bind_address, download=download,
+                                                  protocol=protocol, omit=iperf_options.get("omit", 1),
+                                                  tolerance=iperf_options.get("tolerance", 0.1),
+                                                  stable_intervals=iperf_options.get("stable_intervals", 3),
+                                                  duration=iperf_options.get("duration", 10),
+                                                  early_stop=streaming, **tuning)
+    with span("run_iperf", mode):
+        return get_backend().run_iperf(iperf_ip, iperf_port, bind_address, download=download, protocol=protocol,
+                                       duration=iperf_options.get("duration"), omit=iperf_options.get("omit"),
+                                       runner=runner, **tuning)
+
+
+def run_udp_probe(mode, iperf_ip, iperf_port, bind_address, iperf_options=None, runner=None):
+    """Runs the UDP capacity probe for a benchmark mode.
+
+    Args:
+        mode (str): The probe mode (udp_probe or udp_probe_r).
+        iperf_ip (str): ip address of the iperf3 server.
+        iperf_port (int): port of the iperf3 server.
+        bind_address (str): The wireless interface ip
+        address of the client which is being used to
+        benchmark.
+        iperf_options (dict), optional: iperf3 settings from
+        the configuration.
+        runner (IperfRunner), optional: Runner shared by the
+        libiperf probes of the survey.
+
+    Returns:
+        dict: Dictionary containing the probe results.
+    """
+    if iperf_options is None:
+        iperf_options = {}
+    probe_options = iperf_options.get("udp_probe", {})
+    with span("probe_udp_capacity", mode):
+        return get_backend().probe_udp_capacity(iperf_ip, iperf_port, bind_address, download=mode.endswith("_r"),
+                                                window_size=iperf_options.get("window_size"),
+                                                streamed=iperf_options.get("subprocess", False), runner=runner,
+                                                **probe_options)
+
+
+@traced("run_speedtest")
+def run_pinned_speedtest(speedtest_mode, bind_address, libre_speed_server_list, speedtest_server=None,
+                         progress=None):
+    """Runs a speedtest against the pinned server. If no server
+    is pinned or the pinned server fails, the backend selects a
+    server which is then pinned.
+
+    Args:
+        speedtest_mode (SpeedTestMode): Speedtest backend to use.
+        bind_address (str): The wireless interface ip
+        address of the client which is being used to
+        benchmark.
+        libre_speed_server_list (str): The path to the
+        librespeed server json file or None.
+        speedtest_server (dict), optional: Dictionary containing
+        the 'id' and 'name' of the pinned server, updated in
+        place. Default is None which does not pin a server.
+        progress (function), optional: Called with progress
+        messages. Default is None.
+
+    Returns:
+        dict: Dictionary containing the speedtest results.
+    """
+    backend = get_backend()
+    if speedtest_server is None:
+        return backend.run_speedtest(speedtest_mode, bind_address, libre_speed_server_list=libre_speed_server_list,
+                                     progress=progress)
+
+    if speedtest_server.get("id"):
+        try:
+            return backend.run_speedtest(speedtest_mode, bind_address,
+                                         libre_speed_server_list=libre_speed_server_list,
+                                         server_id=speedtest_server["id"], progress=progress, retries=0)
+        except ParseError:
+            print("Speedtest server {0} failed. Selecting a new server.".format(speedtest_server.get("name")))
+            logging.warning("Pinned speedtest server {0} failed".format(speedtest_server["id"]))
+            record_retry("speedtest_server")
+
+    speedtest_result = backend.run_speedtest(speedtest_mode, bind_address,
+                                             libre_speed_server_list=libre_speed_server_list, progress=progress)
+    server_id, server_name = backend.get_speedtest_server(speedtest_mode, speedtest_result, libre_speed_server_list)
+    if server_id is not None:
+        logging.debug("Pinned speedtest server {0} ({1})".format(server_name, server_id))
+        speedtest_server.update(id=server_id, name=server_name)
+    return speedtest_result
+
+
+def udp_probe_metrics(mode, probe_result):
+    """Extracts the metrics from a UDP capacity probe result.
+
+    Args:
+        mode (str): The probe mode (udp_probe or udp_probe_r).
+        probe_result (dict): Dictionary containing the probe
+        results.
+
+    Returns:
+        dict: Dictionary containing metrics and their values in
+        corresponding key value pairs.
+    """
+    direction = "download" if mode.endswith("_r") else "upload"
+    return {
+        "{0}_capacity_bits_udp".format(direction): probe_result["rate"],
+        "{0}_capacity_loss_udp".format(direction): probe_result["lost_percent"],
+        "{0}_capacity_jitter_udp".format(direction): probe_result["jitter_ms"],
+        "{0}_capacity_probes_udp".format(direction): probe_result["probes"],
+    }
+
+
+def iperf_metrics(mode, iperf_result):
+    """Extracts the metrics from an iperf3 result.
+
+    Args:
+        mode (str): The iperf3 mode (tcp, tcp_r, udp or udp_r).
+        iperf_result (dict): Dictionary containing the iperf3
+        results.
+
+    Returns:
+        dict: Dictionary containing metrics and their values in
+        corresponding key value pairs.
+    """
+    metrics = {}
+    end = iperf_result["end"]
+    direction = "download" if mode.endswith("_r") else "upload"
+    if mode == "tcp_r":
+        summary = end["sum_received"]
+    elif mode == "tcp":
+        summary = end["sum_sent"]
+    else:
+        summary = end["sum"]
+    protocol = mode.split("_")[0]
+    metrics["{0}_bits_{1}".format(direction, protocol)] = summary["bits_per_second"]
+    metrics["{0}_bytes_{1}".format(direction, protocol)] = summary["bits_per_second"] / 8
+    metrics["{0}_bytes_data_{1}".format(direction, protocol)] = summary["bytes"]
+    metrics["{0}_time_{1}".format(direction, protocol)] = iperf_result["start"]["test_start"]["duration"]
+    if protocol == "udp":
+        metrics["{0}_jitter_udp".format(direction)] = summary["jitter_ms"]
+        metrics["{0}_jitter_packets_udp".format(direction)] = summary["packets"]
+        metrics["{0}_jitter_lost_packets_udp".format(direction)] = summary["lost_packets"]
+    return metrics
+
+
+def split_bidirectional(iperf_result):
+    """Splits a bidirectional iperf3 result into a download
+    and an upload result in the layout of a single direction
+    test.
+
+    Args:
+        iperf_result (dict): Dictionary containing the
+        bidirectional iperf3 results.
+
+    Returns:
+        tuple: Containing the download and the upload results
+        in the form of (download, upload).
+    """
+    def is_sender(stream):
+        return next(iter(stream.values())).get("sender", True)
+
+    end = iperf_result["end"]
+    download = {
+        "start": iperf_result["start"],
+        "intervals": [],
+        "end": {"streams": [stream for stream in end.get("streams", []) if not is_sender(stream)]},
+    }
+    upload = {
+        "start": iperf_result["start"],
+        "intervals": [],
+        "end": {"streams": [stream for stream in end.get("streams", []) if is_sender(stream)]},
+    }
+    for key in ("sum", "sum_sent", "sum_received"):
+        reverse_key = "{0}_bidir_reverse".format(key)
+        if key in end and reverse_key in end:
+            upload["end"][key] = end[key]
+            download["end"][key] = end[reverse_key]
+    for interval in iperf_result.get("intervals", []):
+        upload["intervals"].append({
+            "streams": [stream for stream in interval["streams"] if stream.get("sender", True)],
+            "sum": interval["sum"]})
+        download["intervals"].append({
+            "streams": [stream for stream in interval["streams"] if not stream.get("sender", True)],
+            "sum": interval["sum_bidir_reverse"]})
+    return (download, upload)
+
+
+def iperf_streams(mode, iperf_result):
+    """Extracts the per stream throughput from an iperf3 result.
+
+    Args:
+        mode (str): The iperf3 mode (tcp, tcp_r, udp or udp_r).
+        iperf_result (dict): Dictionary containing the iperf3
+        results.
+
+    Returns:
+        list: Throughput of every stream in bits/s.
+    """
+    if mode.startswith("udp"):
+        key = "udp"
+    elif mode.endswith("_r"):
+        key = "receiver"
+    else:
+        key = "sender"
+    return [stream[key]["bits_per_second"] for stream in iperf_result["end"].get("streams", []) if key in stream]
+
+
+def iperf_intervals(iperf_result):
+    """Extracts the per interval series from an iperf3 result.
+
+    Values not reported by iperf3 for the side of the test
+    the client is on (e.g. retransmits when receiving) are
+    set to nan. Omitted warm-up intervals are skipped.
+
+    Args:
+        iperf_result (dict): Dictionary containing the iperf3
+        results.
+
+    Returns:
+        dict: Dictionary of column name and values for the
+        columns start, bits_per_second, retransmits, snd_cwnd,
+        jitter_ms and lost_percent.
+    """
+    nan = float("nan")
+    series = {column: [] for column in interval_columns}
+    for interval in iperf_result.get("intervals", []):
+        summary = interval["sum"]
+        if summary.get("omitted", False):
+            continue
+        series["start"].append(summary["start"])
+        series["bits_per_second"].append(summary["bits_per_second"])
+        series["retransmits"].append(summary.get("retransmits", nan))
+        cwnd = [stream["snd_cwnd"] for stream in interval.get("streams", []) if "snd_cwnd" in stream]
+        series["snd_cwnd"].append(sum(cwnd) if cwnd else nan)
+        series["jitter_ms"].append(summary.get("jitter_ms", nan))
+        series["lost_percent"].append(summary.get("lost_percent", nan))
+    return series
+
+
+def interval_metrics(mode, series):
+    """Derives throughput stability metrics from an iperf3
+    interval series.
+
+    Args:
+        mode (str): The iperf3 mode (tcp, tcp_r, udp or udp_r).
+        series (dict): Dictionary of column name and values
+        from iperf_intervals.
+
+    Returns:
+        dict: Dictionary containing metrics and their values in
+        corresponding key value pairs.
+    """
+    metrics = {}
+    direction = "download" if mode.endswith("_r") else "upload"
+    protocol = mode.split("_")[0]
+    cv = coefficient_of_variation(series["bits_per_second"])
+    if cv is not None:
+        metrics["{0}_cv_{1}".format(direction, protocol)] = cv
+    steady_time = steady_state_time(series["start"], series["bits_per_second"])
+    if steady_time is not None:
+        metrics["{0}_steady_time_{1}".format(direction, protocol)] = steady_time
+    return metrics
+
+
+def latency_metrics(idle_rtts, loaded_rtts):
+    """Derives latency under load metrics from round trip times
+    measured on an idle link and during iperf3 tests.
+
+    Args:
+        idle_rtts (list): Round trip times on the idle link in ms.
+        loaded_rtts (list): Round trip times during iperf3 tests
+        in ms.
+
+    Returns:
+        dict: Dictionary containing metrics and their values in
+        corresponding key value pairs.
+    """
+    metrics = {}
+    for name, rtts in (("idle", idle_rtts), ("loaded", loaded_rtts)):
+        for q in (50, 95, 99):
+            value = percentile(rtts, q)
+            if value is not None:
+                metrics["{0}_latency_p{1}".format(name, q)] = value
+    if "idle_latency_p50" in metrics and "loaded_latency_p50" in metrics:
+        metrics["latency_increase"] = metrics["loaded_latency_p50"] - metrics["idle_latency_p50"]
+    return metrics
+
+
+def echo_metrics(prober):
+    """Extracts the metrics from an echo probe.
+
+    Args:
+        prober (LatencyProber): The stopped prober.
+
+    Returns:
+        dict: Dictionary containing metrics and their values in
+        corresponding key value pairs.
+    """
+    metrics = {"echo_loss": 100.0}
+    if prober.sent > 0:
+        metrics["echo_loss"] = prober.lost * 100 / prober.sent
+    if len(prober.rtts) > 0:
+        metrics["echo_latency"] = percentile(prober.rtts, 50)
+        metrics["echo_latency_p95"] = percentile(prober.rtts, 95)
+    if len(prober.rtts) > 1:
+        metrics["echo_jitter"] = jitter(prober.rtts)
+    return metrics
+
+
+def speedtest_metrics(speedtest_mode, speedtest_result):
+    """Extracts the metrics from a speedtest result.
+
+    Args:
+        speedtest_mode (SpeedTestMode): Speedtest backend used.
+        speedtest_result (dict): Dictionary containing the
+        speedtest results.
+
+    Returns:
+        dict: Dictionary containing metrics and their values in
+        corresponding key value pairs.
+    """
+    metrics = {}
+    if speedtest_mode == SpeedTestMode.OOKLA:
+        metrics["speedtest_jitter"] = speedtest_result["ping"]["jitter"]
+        metrics["speedtest_latency"] = speedtest_result["ping"]["latency"]
+        metrics["speedtest_download_bandwidth"] = speedtest_result["download"]["bandwidth"]
+        metrics["speedtest_download_size"] = speedtest_result["download"]["bytes"]
+        metrics["speedtest_download_elapsed_ms"] = speedtest_result["download"]["elapsed"]
+        metrics["speedtest_upload_bandwidth"] = speedtest_result["upload"]["bandwidth"]
+        metrics["speedtest_upload_size"] = speedtest_result["upload"]["bytes"]
+        metrics["speedtest_upload_elapsed_ms"] = speedtest_result["upload"]["elapsed"]
+
+    elif speedtest_mode == SpeedTestMode.SIVEL:
+        metrics["speedtest_latency"] = speedtest_result["server"]["latency"]
+        metrics["speedtest_download_bandwidth"] = speedtest_result["download"] / 8
+        metrics["speedtest_download_size"] = speedtest_result["bytes_received"]
+        metrics["speedtest_upload_bandwidth"] = speedtest_result["upload"] / 8
+        metrics["speedtest_upload_size"] = speedtest_result["bytes_sent"]
+
+    elif speedtest_mode == SpeedTestMode.LIBRESPEED:
+        metrics["speedtest_jitter"] = speedtest_result["jitter"]
+        metrics["speedtest_latency"] = speedtest_result["ping"]
+        metrics["speedtest_download_bandwidth"] = (speedtest_result["download"] * (1 << 20) / 8)
+        metrics["speedtest_download_size"] = speedtest_result["bytes_received"]
+        metrics["speedtest_upload_bandwidth"] = (speedtest_result["upload"] * (1 << 20) / 8)
+        metrics["speedtest_upload_size"] = speedtest_result["bytes_sent"]
+    return metrics
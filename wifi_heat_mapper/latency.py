@@ -0,0 +1,229 @@
+import asyncio
+import threading
+from contextlib import suppress
+import socket
+import struct
+import time
+import logging
+
+
+class LatencyProber:
+    """Measures round trip times against a UDP or TCP echo server
+    by sending sequence numbered requests at a fixed rate from an
+    asyncio event loop in a background thread.
+
+    Args:
+        ip (str): The ip address of the echo server.
+        port (int): The port of the echo server.
+        interval (float), optional: Time between requests in
+        seconds. Defaults to 0.05.
+        timeout (float), optional: Time to wait for outstanding
+        replies when stopping, in seconds. Defaults to 1.
+        bind_address (str), optional: The wireless interface ip
+        address of the client which is being used to benchmark.
+        protocol (str), optional: 'udp' or 'tcp'. Defaults to 'udp'.
+    """
+    def __init__(self, ip, port, interval=0.05, timeout=1.0, bind_address=None, protocol="udp"):
+        self.ip = ip
+        self.port = int(port)
+        self.protocol = protocol
+        self.interval = interval
+        self.timeout = timeout
+        self.bind_address = bind_address
+        self.rtts = []
+        self.sent = 0
+        self.error = None
+        self._pending = {}
+        self._loop = None
+        self._stopping = None
+        self._drained = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.stop()
+
+    @property
+    def lost(self):
+        """Number of requests without a reply."""
+        return self.sent - len(self.rtts)
+
+    def start(self):
+        """Start sending requests in a daemon thread."""
+        self._loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(ready,), name="latency-prober", daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    def stop(self):
+        """Stop sending requests and wait for outstanding replies.
+
+        Returns:
+            list: Round trip times in ms.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._stopping.set)
+            self._thread.join()
+        return self.rtts
+
+    def received(self, data):
+        """Record the round trip time of an echoed request.
+
+        Args:
+            data (bytes): the echoed datagram.
+
+        Returns:
+            None
+        """
+        if len(data) < 8:
+            return
+        sequence = struct.unpack("!Q", data[:8])[0]
+        sent_at = self._pending.pop(sequence, None)
+        if sent_at is not None:
+            self.rtts.append((time.perf_counter() - sent_at) * 1000)
+        if not self._pending and self._drained is not None:
+            self._drained.set()
+
+    def _run(self, ready):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._probe(ready))
+        finally:
+            ready.set()
+            self._loop.close()
+
+    async def _probe(self, ready):
+        self._stopping = asyncio.Event()
+        self._drained = asyncio.Event()
+        local_addr = (self.bind_address, 0) if self.bind_address else None
+        try:
+            if self.protocol == "tcp":
+                reader, writer = await asyncio.open_connection(self.ip, self.port, local_addr=local_addr)
+                writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                receiver = self._loop.create_task(self._read_stream(reader))
+                send = writer.write
+            else:
+                transport, _ = await self._loop.create_datagram_endpoint(
+                    lambda: EchoClientProtocol(self), remote_addr=(self.ip, self.port), local_addr=local_addr)
+                send = transport.sendto
+        except OSError as err:
+            logging.error("Unable to start latency prober: {0}".format(err))
+            self.error = err
+            return
+        ready.set()
+        try:
+            while not self._stopping.is_set():
+                self._pending[self.sent] = time.perf_counter()
+                send(struct.pack("!Q", self.sent))
+                self.sent += 1
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._stopping.wait(), self.interval)
+            if self._pending:
+                # Wait for the outstanding replies, received sets drained once there are none.
+                self._drained.clear()
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._drained.wait(), self.timeout)
+        finally:
+            if self.protocol == "tcp":
+                receiver.cancel()
+                writer.close()
+            else:
+                transport.close()
+
+    async def _read_stream(self, reader):
+        try:
+            while True:
+                self.received(await reader.readexactly(8))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logging.debug("Latency prober connection closed")
+
+
+class EchoClientProtocol(asyncio.DatagramProtocol):
+    def __init__(self, prober):
+        self.prober = prober
+
+    def datagram_received(self, data, _addr):
+        self.prober.received(data)
+
+    def error_received(self, exc):
+        logging.debug("Latency prober error: {0}".format(exc))
+
+
+def measure_latency(ip, port, duration=1.0, interval=0.05, timeout=1.0, bind_address=None, protocol="udp"):
+    """Measure round trip times for a fixed duration.
+
+    Args:
+        ip (str): The ip address of the echo server.
+        port (int): The port of the echo server.
+        duration (float), optional: Measurement time in seconds.
+        Defaults to 1.
+        interval (float), optional: Time between requests in
+        seconds. Defaults to 0.05.
+        timeout (float), optional: Time to wait for outstanding
+        replies in seconds. Defaults to 1.
+        bind_address (str), optional: The wireless interface ip
+        address of the client which is being used to benchmark.
+        protocol (str), optional: 'udp' or 'tcp'. Defaults to 'udp'.
+
+    Returns:
+        LatencyProber: The stopped prober holding the results.
+    """
+    with LatencyProber(ip, port, interval=interval, timeout=timeout, bind_address=bind_address,
+                       protocol=protocol) as prober:
+        time.sleep(duration)
+    return prober
+
+
+class EchoServerProtocol(asyncio.DatagramProtocol):
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.transport.sendto(data, addr)
+
+
+async def echo_stream(reader, writer):
+    """Echo everything received on a TCP connection."""
+    writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    try:
+        while data := await reader.read(4096):
+            writer.write(data)
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_echo(host, port):
+    """Serve UDP and TCP echo on the same port until cancelled."""
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(EchoServerProtocol, local_addr=(host, port))
+    server = await asyncio.start_server(echo_stream, host, port)
+    print("Echo server listening on {0}:{1} (UDP and TCP)".format(host, port))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        transport.close()
+
+
+def start_echo_server(listen):
+    """Starting point for the echo-server submodule for whm.
+
+    Args:
+        listen (str): the ip address and port to listen on,
+        like 0.0.0.0:7007.
+
+    Returns:
+        None
+    """
+    host, port = listen.rsplit(":", 1)
+    try:
+        asyncio.run(serve_echo(host, int(port)))
+    except KeyboardInterrupt:
+        print("Stopped echo server.")
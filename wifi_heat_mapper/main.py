@@ -13,6 +13,15 @@ def driver():
         "--debug", action="store_true", dest="debug_mode",
         help="print debug statements"
     )
+    parent_parser.add_argument(
+        "--trace", action="store_true", dest="trace",
+        help="print how long the benchmarks, saves and plot stages took")
+    parent_parser.add_argument(
+        "--trace-file", dest="trace_file", required=False, default=None,
+        help="save the traced stages as a Chrome trace json (implies --trace)")
+    parent_parser.add_argument(
+        "--profile", dest="profile_file", required=False, default=None,
+        help="run under cProfile, print the slowest functions and save the stats")
     subparsers = parser.add_subparsers(dest="mode")
     bootstrap = subparsers.add_parser(
         "bootstrap", description="Run the bootstrap configuration generator",
@@ -28,10 +37,37 @@ def driver():
         help="Image path to floor map")
     benchmark.add_argument(
         "--server", "-s", dest="iperf_server", required=False, default=None,
-        help="IP (and port) address of the iperf3 server")
+        help="IP (and port) address of the iperf3 server. Separate multiple servers with commas")
     benchmark.add_argument(
         "--config", "-c", dest="config_file", required=True, default=None,
         help="Path to configuration file")
+    benchmark.add_argument(
+        "--feed", dest="position_feed", required=False, default=None,
+        help="Take positions from a file or UNIX socket (unix:PATH) of t,x,y lines instead of mouse clicks")
+    benchmark.add_argument(
+        "--replay", dest="replay_feed", action="store_true",
+        help="Replay the position feed file in real time instead of following it")
+    benchmark.add_argument(
+        "--record", dest="record_file", required=False, default=None,
+        help="Append the raw output of every tool to a capture file for whm replay")
+    benchmark.add_argument(
+        "--metrics-port", dest="metrics_port", required=False, default=None,
+        help="Serve live survey metrics in the OpenMetrics format on http://HOST:PORT/metrics")
+    benchmark.add_argument(
+        "--metrics-host", dest="metrics_host", required=False, default="127.0.0.1",
+        help="Address to serve the metrics on. Default (127.0.0.1)")
+    replay = subparsers.add_parser(
+        "replay", description="Run the parsers again on a capture from benchmark --record",
+        help="Run the parsers again on a capture from benchmark --record", parents=[parent_parser])
+    replay.add_argument(
+        "--capture", dest="capture_file", required=True, default=None,
+        help="Path to the capture file")
+    replay.add_argument(
+        "--config", "-c", dest="config_file", required=True, default=None,
+        help="Path to the configuration file the capture was recorded with")
+    replay.add_argument(
+        "--output", "-o", dest="output_file", required=False, default="replay.json",
+        help="Save path for the replayed results. Default (replay.json)")
     plot = subparsers.add_parser(
         "plot", description="Generate plots from metrics",
         help="Generate plots from metrics", parents=[parent_parser])
@@ -53,6 +89,69 @@ def driver():
         "--format", "-f", dest="file_type", required=False, default="png",
         help="Export file format for generated plots. Default (png)"
     )
+    plot.add_argument(
+        "--aggregate", "-a", dest="aggregate", required=False, default="mean",
+        help="Aggregation of repeated measurements (mean, median, trimmed, p5, p95). Default (mean)"
+    )
+    plot.add_argument(
+        "--interface", "-i", dest="interface", required=False, default=None,
+        help="Plot the results of an additional wireless interface. Default (target interface)"
+    )
+    plot.add_argument(
+        "--all-bssids", dest="all_bssids", action="store_true",
+        help="Include access points of other networks in the scan plots"
+    )
+    echo_server = subparsers.add_parser(
+        "echo-server", description="Run a UDP and TCP echo server for latency probes",
+        help="Run a UDP and TCP echo server for latency probes", parents=[parent_parser])
+    echo_server.add_argument(
+        "--listen", "-l", dest="listen", required=False, default="0.0.0.0:7007",
+        help="IP address and port to listen on. Default (0.0.0.0:7007)")
+    simulate = subparsers.add_parser(
+        "simulate", description="Run a survey with simulated measurements",
+        help="Run a survey with simulated measurements", parents=[parent_parser])
+    simulate.add_argument(
+        "--map", "-m", dest="floor_map", required=True, default=None,
+        help="Image path to floor map")
+    simulate.add_argument(
+        "--config", "-c", dest="config_file", required=True, default=None,
+        help="Path to configuration file")
+    simulate.add_argument(
+        "--output", "-o", dest="output_file", required=False, default="simulation.json",
+        help="Save path for the simulated results. Default (simulation.json)")
+    simulate.add_argument(
+        "--points", "-n", dest="points", required=False, default=1000,
+        help="Number of random points to survey. Default (1000)")
+    simulate.add_argument(
+        "--aps", dest="aps", required=False, default=3,
+        help="Number of simulated access points. Default (3)")
+    simulate.add_argument(
+        "--seed", dest="seed", required=False, default=None,
+        help="Seed for reproducible surveys. Default (random)")
+    simulate.add_argument(
+        "--latency", dest="latency", required=False, default=0,
+        help="Mean time in seconds every simulated tool call takes. Default (0)")
+    simulate.add_argument(
+        "--failure-rate", dest="failure_rate", required=False, default=0,
+        help="Probability of a failed iperf3 test or speedtest. Default (0)")
+    simulate.add_argument(
+        "--plot", dest="plot", action="store_true",
+        help="Plot the simulated results")
+    perf = subparsers.add_parser(
+        "perf", description="Run performance microbenchmarks",
+        help="Run performance microbenchmarks", parents=[parent_parser])
+    perf.add_argument(
+        "target", choices=["iperf"],
+        help="Benchmark to run. iperf measures the per-test setup cost of libiperf tests")
+    perf.add_argument(
+        "--count", "-n", dest="count", required=False, default=200,
+        help="Number of simulated tests. Default (200)")
+    perf.add_argument(
+        "--server", "-s", dest="iperf_server", required=False, default=None,
+        help="IP (and port) address of a running iperf3 server. Default (local stand-in)")
+    perf.add_argument(
+        "--output", "-o", dest="output_file", required=False, default=None,
+        help="Save the results as json")
     subparsers.add_parser(
         "help", description="Show this help message and exit",
         help="Show this help message and exit")
@@ -74,18 +173,81 @@ def driver():
                             datefmt="%d-%b-%y %H:%M:%S", filename="debug.log")
         logging.debug("Enabled debug mode")
 
+    tracer = None
+    if getattr(args, "trace", False) or getattr(args, "trace_file", None) is not None:
+        from wifi_heat_mapper import tracing
+        tracer = tracing.enable()
+    profiler = None
+    if getattr(args, "profile_file", None) is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+
+    try:
+        if profiler is not None:
+            profiler.runcall(run_mode, args, parser)
+        else:
+            run_mode(args, parser)
+    finally:
+        if profiler is not None:
+            from wifi_heat_mapper.tracing import report_profile
+            report_profile(profiler, args.profile_file)
+        if tracer is not None:
+            tracer.report(args.trace_file)
+
+
+def run_mode(args, parser):
+    """Runs the submodule selected by the arguments."""
     if args.mode == "bootstrap":
         from wifi_heat_mapper.config import start_config
         start_config(args.config_file)
 
     elif args.mode == "benchmark":
-        from wifi_heat_mapper.gui import start_gui
-        start_gui(args.floor_map, args.iperf_server, args.config_file)
+        from wifi_heat_mapper.backends import RecordingBackend, get_backend, set_backend
+        if args.record_file is not None:
+            set_backend(RecordingBackend(args.record_file))
+        metrics_server = None
+        if args.metrics_port is not None:
+            from wifi_heat_mapper.metrics import start_exporter
+            metrics_server = start_exporter(int(args.metrics_port), args.metrics_host)
+            print("Serving metrics on {0}".format(metrics_server.url))
+        try:
+            with get_backend():
+                if args.position_feed is not None:
+                    from wifi_heat_mapper.gui import start_feed
+                    start_feed(args.floor_map, args.iperf_server, args.config_file, args.position_feed,
+                               replay=args.replay_feed)
+                else:
+                    from wifi_heat_mapper.gui import start_gui
+                    start_gui(args.floor_map, args.iperf_server, args.config_file)
+        finally:
+            if metrics_server is not None:
+                from wifi_heat_mapper.metrics import stop_exporter
+                stop_exporter(metrics_server)
 
     elif args.mode == "plot":
         from wifi_heat_mapper.graph import generate_graph
         generate_graph(args.config_file, args.floor_map, levels=int(args.levels), dpi=int(args.dpi),
-                       file_type=args.file_type)
+                       file_type=args.file_type, aggregate=args.aggregate, interface=args.interface,
+                       all_bssids=args.all_bssids)
+
+    elif args.mode == "echo-server":
+        from wifi_heat_mapper.latency import start_echo_server
+        start_echo_server(args.listen)
+
+    elif args.mode == "replay":
+        from wifi_heat_mapper.gui import start_replay
+        start_replay(args.capture_file, args.config_file, output_file=args.output_file)
+
+    elif args.mode == "simulate":
+        from wifi_heat_mapper.gui import start_simulation
+        start_simulation(args.floor_map, None, args.config_file, points=int(args.points), aps=int(args.aps),
+                         seed=int(args.seed) if args.seed is not None else None, latency=float(args.latency),
+                         failure_rate=float(args.failure_rate), output_file=args.output_file, plot=args.plot)
+
+    elif args.mode == "perf":
+        from wifi_heat_mapper.perf import start_perf
+        start_perf(args.target, count=int(args.count), iperf_server=args.iperf_server,
+                   output_file=args.output_file)
 
     elif args.mode == "help":
         parser.print_help()
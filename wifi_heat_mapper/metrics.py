@@ -0,0 +1,217 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from bisect import bisect_left
+import threading
+import logging
+import math
+
+
+FAMILIES = {
+    "whm_points": ("counter", "Benchmark points completed."),
+    "whm_benchmark_duration_seconds": ("histogram", "Duration of every benchmark by mode."),
+    "whm_retries": ("counter", "Retried iperf3 tests and speedtests and iperf3 servers skipped, by kind."),
+    "whm_signal_strength_dbm": ("gauge", "Signal strength of the last benchmark point by interface."),
+    "whm_last_value": ("gauge", "Last value of the main metric of every benchmark mode, in results file units."),
+}
+DURATION_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 15.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+class Registry:
+    """Thread-safe store of the survey metrics, exposed in the
+    OpenMetrics text format.
+
+    Samples are keyed by the family name and a sorted tuple of
+    their labels. Counters and gauges hold a value and histograms
+    hold [bucket counts, sum, count] with DURATION_BUCKETS.
+    """
+    def __init__(self):
+        self.values = {("whm_points", ()): 0.0}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1.0, **labels):
+        """Increase a counter."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0.0) + value
+
+    def set(self, name, value, **labels):
+        """Set a gauge."""
+        with self._lock:
+            self.values[(name, tuple(sorted(labels.items())))] = float(value)
+
+    def observe(self, name, value, **labels):
+        """Add an observation to a histogram."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.setdefault(key, [[0] * len(DURATION_BUCKETS), 0.0, 0])
+            index = bisect_left(DURATION_BUCKETS, value)
+            if index < len(DURATION_BUCKETS):
+                histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def exposition(self):
+        """Get every metric in the OpenMetrics text format.
+
+        Returns:
+            str: the metrics, ending with the EOF marker.
+        """
+        with self._lock:
+            values = sorted(self.values.items())
+            histograms = sorted((key, [list(value[0]), value[1], value[2]]) for key, value in self.histograms.items())
+        lines = []
+        for family, (kind, description) in FAMILIES.items():
+            lines += ["# TYPE {0} {1}".format(family, kind), "# HELP {0} {1}".format(family, description)]
+            suffix = "_total" if kind == "counter" else ""
+            for (name, labels), value in values:
+                if name == family:
+                    lines.append("{0}{1}{2} {3}".format(name, suffix, format_labels(labels), format_value(value)))
+            for (name, labels), (buckets, total, count) in histograms:
+                if name != family:
+                    continue
+                cumulative = 0
+                for bound, bucket in zip(DURATION_BUCKETS, buckets, strict=True):
+                    cumulative += bucket
+                    lines.append("{0}_bucket{1} {2}".format(
+                        name, format_labels(labels + (("le", format_value(bound)),)), cumulative))
+                lines.append("{0}_bucket{1} {2}".format(name, format_labels(labels + (("le", "+Inf"),)), count))
+                lines.append("{0}_count{1} {2}".format(name, format_labels(labels), count))
+                lines.append("{0}_sum{1} {2}".format(name, format_labels(labels), format_value(total)))
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    """Format a tuple of (name, value) labels."""
+    if len(labels) == 0:
+        return ""
+    escaped = ('{0}="{1}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"')
+                                  .replace("\n", "\\n")) for name, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+def format_value(value):
+    """Format a sample value."""
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the registry of the server on /metrics."""
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.registry.exposition().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("Metrics request from {0}: {1}".format(self.address_string(), format % args))
+
+
+class MetricsServer:
+    """Serves a Registry over HTTP from a daemon thread.
+
+    Args:
+        registry (Registry): the metrics to serve.
+        port (int), optional: the port to listen on. Defaults to 0
+        which picks a free port.
+        host (str), optional: the address to listen on. Defaults
+        to 127.0.0.1.
+    """
+    def __init__(self, registry, port=0, host="127.0.0.1"):
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        self.server.registry = registry
+        self.host, self.port = self.server.server_address[:2]
+        self._thread = threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True)
+
+    @property
+    def url(self):
+        """Get the URL of the metrics endpoint."""
+        return "http://{0}:{1}/metrics".format(self.host, self.port)
+
+    def start(self):
+        """Start serving."""
+        self._thread.start()
+        logging.debug("Serving metrics on {0}".format(self.url))
+
+    def stop(self):
+        """Stop serving and close the socket."""
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join(timeout=2)
+
+
+registry = None
+
+
+def start_exporter(port=0, host="127.0.0.1"):
+    """Start recording the survey metrics and serve them.
+
+    Args:
+        port (int), optional: the port to listen on. Defaults to 0
+        which picks a free port.
+        host (str), optional: the address to listen on. Defaults
+        to 127.0.0.1.
+
+    Returns:
+        MetricsServer: the running server.
+    """
+    global registry
+    registry = Registry()
+    server = MetricsServer(registry, port, host)
+    server.start()
+    return server
+
+
+def stop_exporter(server):
+    """Stop a server from start_exporter and stop recording."""
+    global registry
+    server.stop()
+    registry = None
+
+
+def record_point(signals):
+    """Count a completed benchmark point.
+
+    Args:
+        signals (dict): Dictionary of interface and signal
+        strength in dBm.
+    """
+    if registry is None:
+        return
+    registry.inc("whm_points")
+    for interface, signal in signals.items():
+        registry.set("whm_signal_strength_dbm", signal, interface=interface)
+
+
+def record_benchmark(mode, duration, values):
+    """Record a benchmark of run_benchmarks.
+
+    Args:
+        mode (str): the benchmark mode.
+        duration (float): the duration of the benchmark in
+        seconds.
+        values (dict): Dictionary of the main metrics of the mode
+        and their values.
+    """
+    if registry is None:
+        return
+    registry.observe("whm_benchmark_duration_seconds", duration, mode=mode)
+    for metric, value in values.items():
+        registry.set("whm_last_value", value, mode=mode, metric=metric)
+
+
+def record_retry(kind):
+    """Count a retry, such as iperf3, iperf3_busy or speedtest."""
+    if registry is not None:
+        registry.inc("whm_retries", kind=kind)
@@ -1,14 +1,26 @@
 from wifi_heat_mapper.debugger import log_arguments
+from wifi_heat_mapper.metrics import record_retry
 import subprocess
 from shutil import which
 import re
 import socket
 import json
 import iperf3
+import ctypes
+import ctypes.util
 import importlib
 from enum import IntEnum
 import os
+import signal
+import time
+import threading
 import logging
+from contextlib import contextmanager, suppress
+
+
+# libiperf redirects the process wide stdout and stderr, so only one
+# library test may run at a time.
+libiperf_lock = threading.Lock()
 
 
 class TColor:
@@ -81,6 +93,10 @@ class ExternalError(Exception):
     pass
 
 
+class ServerBusyError(ExternalError):
+    pass
+
+
 def check_application(name):
     """Check if application is available in the
     current environment.
@@ -160,59 +176,261 @@ def process_iw(target_interface):
         dict: A dictionary containing the metrics and
         their values as corresponding (key, value) pairs.
     """
-    verify_interface(target_interface)
+    return parse_iw(read_iw(target_interface))
 
-    try:
-        iw_info = get_application_output(
-            ["iw {0} info".format(target_interface)],
-            shell=True, timeout=10).replace("\t", " ")
 
-        if iw_info == "invalid":
-            print("The interface {0} is not a wireless interface".format(target_interface))
+def read_iw(target_interface):
+    """Run the iw commands of process_iw and get their output.
+
+    Args:
+        target_interface (str): The network interface to
+        capture metrics from.
+
+    Returns:
+        dict: A dictionary containing the 'info', 'station' and
+        'survey' output, and the 'link' and 'iwconfig' output if
+        the fallbacks were needed.
+    """
+    verify_interface(target_interface)
+
+    iw = {}
+    iw["info"] = get_application_output(["iw {0} info".format(target_interface)], shell=True, timeout=10)
+    if iw["info"] == "invalid":
+        print("The interface {0} is not a wireless interface".format(target_interface))
+        exit(1)
+    if len(re.findall(r"(?<=ssid )(.*)", iw["info"].replace("\t", " "))) == 0:
+        print("iw {0} info command cannot find required SSID. Trying iw {0} link".format(target_interface))
+        iw["link"] = get_application_output(["iw {0} link".format(target_interface)], shell=True, timeout=10)
+        if iw["link"] == "invalid":
+            print("iw {0} link command failed.".format(target_interface))
             exit(1)
+    iw["station"] = get_application_output(["iw {0} station dump".format(target_interface)],
+                                           shell=True, timeout=10)
+    if "signal avg: " not in iw["station"].replace("\t", " "):
+        # Use fallback iwconfig command. This is not ideal. Need to rewrite this entire portion targeting nl80211
+        iw["iwconfig"] = get_application_output(["iwconfig {0}".format(target_interface)])
+    iw["survey"] = get_application_output(["iw {0} survey dump".format(target_interface)], shell=True, timeout=10)
+    return iw
+
+
+def parse_iw(iw):
+    """Parse the output of the iw commands run by read_iw.
 
+    Args:
+        iw (dict): A dictionary containing the output of the
+        iw commands from read_iw.
+
+    Returns:
+        dict: A dictionary containing the metrics and
+        their values as corresponding (key, value) pairs.
+    """
+    try:
+        iw_info = iw["info"].replace("\t", " ")
         results = {}
         results["interface"] = re.findall(r"(?<=Interface )(.*)", iw_info)[0]
         results["interface_mac"] = re.findall(r"(?<=addr )(.*)", iw_info)[0]
         if not verify_mac(results["interface_mac"]):
-            print("The interface {0} has an invalid MAC address".format(target_interface))
+            print("The interface {0} has an invalid MAC address".format(results["interface"]))
             exit(1)
         tmp = re.findall(r"(?<=channel )(.*?)(?=\,)", iw_info)[0].split(" ")
         results["channel"] = int(tmp[0])
         results["channel_frequency"] = int(tmp[1].replace("(", ""))
 
-        try:
+        if "link" in iw:
+            results["ssid"] = re.findall(r"(?<=SSID: )(.*)", iw["link"].replace("\t", " "))[0]
+        else:
             results["ssid"] = re.findall(r"(?<=ssid )(.*)", iw_info)[0]
-        except IndexError:
-            print("iw {0} info command cannot find required SSID. Trying iw {0} link".format(target_interface))
-
-            iw_link = get_application_output(
-                ["iw {0} link".format(target_interface)],
-                shell=True, timeout=10).replace("\t", " ")
-
-            if iw_link == "invalid":
-                print("iw {0} link command failed.".format(target_interface))
-                exit(1)
 
-            results["ssid"] = re.findall(r"(?<=SSID: )(.*)", iw_link)[0]
-
-        iw_info = get_application_output(["iw {0} station dump".format(target_interface)],
-                                         shell=True, timeout=10).replace("\t", " ")
-        results["ssid_mac"] = re.findall(r"(?<=Station )(.*)(?= \()", iw_info)[0]
+        iw_station = iw["station"].replace("\t", " ")
+        results["ssid_mac"] = re.findall(r"(?<=Station )(.*)(?= \()", iw_station)[0]
         if not verify_mac(results["ssid_mac"]):
             print("The station {0} has an invalid MAC address".format(results["ssid"]))
             exit(1)
-        try:
-            results["signal_strength"] = int(re.findall(r"(?<=signal avg: )(.*)", iw_info)[0].split(" ")[0])
-        except IndexError:
-            # Use fallback iwconfig command. This is not ideal. Need to rewrite this entire portion targeting nl80211
-            iwconfig = get_application_output(["iwconfig {0}".format(target_interface)])
-            results["signal_strength"] = int(re.findall(r"(?<=Signal level=)(.*)(?= dBm)", iwconfig)[0])
+        if "iwconfig" in iw:
+            results["signal_strength"] = int(re.findall(r"(?<=Signal level=)(.*)(?= dBm)", iw["iwconfig"])[0])
+        else:
+            results["signal_strength"] = int(re.findall(r"(?<=signal avg: )(.*)", iw_station)[0].split(" ")[0])
+        results["station"] = parse_station_dump(iw_station)
     except IndexError:
         raise ParseError("Unable to parse iw.") from None
+
+    results.update(parse_iw_survey(iw["survey"]))
     return results
 
 
+def parse_station_dump(iw_station):
+    """Parse the link metrics of the first station of the output
+    of iw station dump. Metrics the driver does not report are
+    left out.
+
+    The tx_packets, tx_retries, tx_failed and beacon_loss counters
+    count since the interface associated, see station_metrics for
+    their change over a benchmark point. HT MCS indices (0-31) are
+    stored per spatial stream (0-7) like VHT and HE indices.
+
+    Args:
+        iw_station (str): The output of iw <interface> station
+        dump.
+
+    Returns:
+        dict: A dictionary containing the metrics and their
+        values as corresponding (key, value) pairs.
+    """
+    station = iw_station.split("Station ")[1] if "Station " in iw_station else iw_station
+    metrics = {}
+
+    for key in ("tx packets", "tx retries", "tx failed", "beacon loss"):
+        value = re.search(r"{0}:\s*(\d+)".format(key), station)
+        if value is not None:
+            metrics[key.replace(" ", "_")] = int(value.group(1))
+
+    expected = re.search(r"expected throughput:\s*([\d.]+)\s*Mbps", station)
+    if expected is not None:
+        metrics["expected_throughput_bits"] = float(expected.group(1)) * 1000000
+
+    for direction in ("tx", "rx"):
+        bitrate = re.search(r"{0} bitrate:\s*([\d.]+) MBit/s(.*)".format(direction), station)
+        if bitrate is None:
+            continue
+        metrics["{0}_bitrate_bits".format(direction)] = float(bitrate.group(1)) * 1000000
+        flags = bitrate.group(2)
+        mcs = re.search(r"(?:^|\s)(?:\w+-)?MCS (\d+)", flags)
+        nss = re.search(r"NSS (\d+)", flags)
+        if nss is not None:
+            metrics["{0}_nss".format(direction)] = int(nss.group(1))
+        if mcs is not None:
+            metrics["{0}_mcs".format(direction)] = int(mcs.group(1))
+            if nss is None and re.search(r"(?:^|\s)MCS", flags):
+                # HT rates encode the spatial streams in the MCS index.
+                metrics["{0}_mcs".format(direction)] = int(mcs.group(1)) % 8
+                metrics["{0}_nss".format(direction)] = int(mcs.group(1)) // 8 + 1
+        if direction == "tx":
+            width = re.search(r"(\d+)MHz", flags)
+            metrics["channel_width"] = int(width.group(1)) if width is not None else 20
+    return metrics
+
+
+def parse_iw_survey(iw_survey):
+    """Parse the in-use channel of the output of iw survey dump.
+
+    Args:
+        iw_survey (str): The output of iw <interface> survey dump.
+
+    Returns:
+        dict: A dictionary containing the 'noise' in dBm and the
+        channel 'active', 'busy', 'receive' and 'transmit' times
+        in ms, if reported by the driver. Empty if there is no
+        in-use channel.
+    """
+    fields = {
+        "noise": r"noise:\s*(-?\d+) dBm",
+        "channel_active_time": r"channel active time:\s*(\d+) ms",
+        "channel_busy_time": r"channel busy time:\s*(\d+) ms",
+        "channel_receive_time": r"channel receive time:\s*(\d+) ms",
+        "channel_transmit_time": r"channel transmit time:\s*(\d+) ms",
+    }
+    survey = {}
+    for block in iw_survey.split("Survey data from"):
+        if "[in use]" not in block:
+            continue
+        for key, pattern in fields.items():
+            value = re.search(pattern, block)
+            if value is not None:
+                survey[key] = int(value.group(1))
+        break
+    return survey
+
+
+def scan_iw(target_interface):
+    """Scan for access points on a wireless interface.
+
+    A new scan requires root privileges, otherwise the results
+    of the last scan are used.
+
+    Args:
+        target_interface (str): The network interface to
+        scan on.
+
+    Returns:
+        dict: A dictionary of BSSID and a dictionary containing
+        the 'ssid', 'signal' in dBm, 'frequency' in MHz and
+        'channel' of the access point. Empty if scanning failed.
+    """
+    return parse_iw_scan(read_iw_scan(target_interface))
+
+
+def read_iw_scan(target_interface):
+    """Run iw scan, falling back to iw scan dump, and get the
+    output.
+
+    Args:
+        target_interface (str): The network interface to
+        scan on.
+
+    Returns:
+        str: The output of the scan, empty if scanning failed.
+    """
+    iw_scan = get_application_output(["iw", "dev", target_interface, "scan"], timeout=30)
+    if iw_scan in ("invalid", "timeout", "unavailable"):
+        logging.debug("iw scan failed with {0}, falling back to scan dump".format(iw_scan))
+        iw_scan = get_application_output(["iw", "dev", target_interface, "scan", "dump"], timeout=10)
+        if iw_scan in ("invalid", "timeout", "unavailable"):
+            logging.warning("Unable to scan on {0}".format(target_interface))
+            return ""
+    return iw_scan
+
+
+def parse_iw_scan(iw_scan):
+    """Parse the output of iw scan.
+
+    Args:
+        iw_scan (str): The output of iw dev <interface> scan.
+
+    Returns:
+        dict: A dictionary of BSSID and a dictionary containing
+        the 'ssid', 'signal' in dBm, 'frequency' in MHz and
+        'channel' of the access point.
+    """
+    table = {}
+    for block in re.split(r"^(?=BSS )", iw_scan, flags=re.MULTILINE):
+        bssid = re.match(r"BSS ([0-9A-Fa-f:]{17})", block)
+        signal = re.search(r"^\s*signal: (-?[\d.]+) dBm", block, flags=re.MULTILINE)
+        frequency = re.search(r"^\s*freq: ([\d.]+)", block, flags=re.MULTILINE)
+        if bssid is None or signal is None or frequency is None:
+            continue
+        ssid = re.search(r"^\s*SSID: (.*)$", block, flags=re.MULTILINE)
+        frequency = int(float(frequency.group(1)))
+        table[bssid.group(1).lower()] = {
+            "ssid": ssid.group(1).strip() if ssid is not None else "",
+            "signal": float(signal.group(1)),
+            "frequency": frequency,
+            "channel": frequency_to_channel(frequency),
+        }
+    return table
+
+
+def frequency_to_channel(frequency):
+    """Convert a Wi-Fi center frequency to a channel number.
+
+    Args:
+        frequency (int): The frequency in MHz.
+
+    Returns:
+        int: The channel number, 0 if unknown.
+    """
+    if frequency == 2484:
+        return 14
+    if 2412 <= frequency < 2484:
+        return (frequency - 2407) // 5
+    if frequency == 5935:
+        return 2
+    if 5950 < frequency <= 7125:
+        return (frequency - 5950) // 5
+    if 5000 <= frequency <= 5900:
+        return (frequency - 5000) // 5
+    return 0
+
+
 def verify_mac(mac):
     """Verify if a MAC address is valid.
 
@@ -252,8 +470,117 @@ def verify_iperf(ip, port):
         return False
 
 
+class IperfRunner:
+    """Runs libiperf tests for a whole survey while keeping the per-test
+    setup warm.
+
+    The libiperf path is resolved once instead of by every
+    iperf3.Client and stdout and stderr are redirected to a devnull
+    file descriptor opened once. libiperf test objects are not
+    reusable, so every test still gets its own iperf3.Client.
+    """
+    def __init__(self):
+        self.lib_name = None
+        self._null_fd = None
+        self._save_fds = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def open(self):
+        """Resolve libiperf and open the devnull and saved stdout and
+        stderr file descriptors."""
+        if self._null_fd is not None:
+            return
+        self.lib_name = ctypes.util.find_library("libiperf") or "libiperf.so.0"
+        self._null_fd = os.open(os.devnull, os.O_RDWR)
+        self._save_fds = [os.dup(1), os.dup(2)]
+
+    def close(self):
+        """Close the file descriptors opened by open."""
+        if self._null_fd is None:
+            return
+        for fd in [self._null_fd] + self._save_fds:
+            os.close(fd)
+        self._null_fd = None
+        self._save_fds = None
+
+    @contextmanager
+    def silenced(self):
+        """Redirect stdout and stderr to devnull like
+        suppress_stdout_stderr, reusing the open file descriptors."""
+        self.open()
+        os.dup2(self._null_fd, 1)
+        os.dup2(self._null_fd, 2)
+        try:
+            yield
+        finally:
+            os.dup2(self._save_fds[0], 1)
+            os.dup2(self._save_fds[1], 2)
+
+    def client(self):
+        """Get a new iperf3.Client using the resolved libiperf."""
+        self.open()
+        return iperf3.Client(lib_name=self.lib_name)
+
+
+def new_iperf_client(ip, port, bind_address, download=True, protocol="tcp", num_streams=1, duration=None,
+                     omit=None, window_size=None, bandwidth=None, bidirectional=False, runner=None):
+    """Set up the iperf3.Client of a test. The arguments are the
+    same as run_iperf.
+
+    Returns:
+        iperf3.Client: the client, ready to run.
+    """
+    client = iperf3.Client() if runner is None else runner.client()
+    client.server_hostname = ip
+    client.port = port
+    client.bind_address = bind_address
+    client.reverse = False
+    client.verbose = False
+    if download:
+        client.reverse = True
+    client.protocol = protocol
+    client.num_streams = num_streams
+    if duration:
+        client.duration = duration
+    if omit:
+        client.omit = omit
+    if bandwidth:
+        client.bandwidth = bandwidth
+    if window_size:
+        # Not exposed by the iperf3 package, set it on the libiperf test directly.
+        client.lib.iperf_set_test_socket_bufsize.restype = None
+        client.lib.iperf_set_test_socket_bufsize.argtypes = (ctypes.c_void_p, ctypes.c_int)
+        client.lib.iperf_set_test_socket_bufsize(client._test, window_size)
+    if bidirectional:
+        client.reverse = False
+        client.lib.iperf_set_test_bidirectional.restype = None
+        client.lib.iperf_set_test_bidirectional.argtypes = (ctypes.c_void_p, ctypes.c_int)
+        client.lib.iperf_set_test_bidirectional(client._test, 1)
+    return client
+
+
+def silenced_output(runner=None):
+    """Get the context manager silencing libiperf during a test.
+
+    Args:
+        runner (IperfRunner), optional: Runner sharing the open
+        file descriptors. Defaults to None which opens new ones.
+
+    Returns:
+        contextmanager: the redirection of stdout and stderr.
+    """
+    return suppress_stdout_stderr() if runner is None else runner.silenced()
+
+
 @log_arguments
-def run_iperf(ip, port, bind_address, download=True, protocol="tcp", retry=0):
+def run_iperf(ip, port, bind_address, download=True, protocol="tcp", num_streams=1, duration=None, omit=None,
+              window_size=None, bandwidth=None, bidirectional=False, runner=None, retry=0):
     """Run iperf3 and return the json results.
 
     Args:
@@ -267,21 +594,32 @@ def run_iperf(ip, port, bind_address, download=True, protocol="tcp", retry=0):
         protocol (str), optional: 'tcp' if testing using tcp
         protocol. 'udp' if testing using udp protocol.
         Defaults to 'tcp'
+        num_streams (int), optional: Number of parallel
+        streams. Defaults to 1.
+        duration (int), optional: Test duration in seconds.
+        Defaults to None which uses the iperf3 default.
+        omit (int), optional: Warm-up seconds to discard.
+        Defaults to None which uses the iperf3 default.
+        window_size (int), optional: Socket buffer (window)
+        size in bytes. Defaults to None which uses the
+        system default.
+        bandwidth (int), optional: UDP target bandwidth in
+        bits/s. Defaults to None which uses the iperf3
+        default.
+        bidirectional (bool), optional: True to test upload
+        and download at the same time, download is ignored.
+        Requires iperf3 3.7 or newer. Defaults to False.
+        runner (IperfRunner), optional: Runner sharing the
+        setup across tests. Defaults to None which sets up
+        every test from scratch.
         retry (int), optional: The retry count.
 
     Returns:
         dict: Dictionary containing the iperf3 results.
     """
-    client = iperf3.Client()
-    client.server_hostname = ip
-    client.port = port
-    client.bind_address = bind_address
-    client.reverse = False
-    client.verbose = False
-    if download:
-        client.reverse = True
-    client.protocol = protocol
-    with suppress_stdout_stderr():
+    client = new_iperf_client(ip, port, bind_address, download, protocol, num_streams, duration, omit,
+                              window_size, bandwidth, bidirectional, runner)
+    with libiperf_lock, silenced_output(runner):
         iperf_result = client.run()
     iperf_result_json = iperf_result.json
     try:
@@ -290,18 +628,350 @@ def run_iperf(ip, port, bind_address, download=True, protocol="tcp", retry=0):
     except ValueError:
         logging.error("Output from iperf3 : {0}".format(iperf_result_json))
         logging.exception("Unable to parse iperf3 result")
+        if is_server_busy(iperf_result_json.get("error")):
+            raise ServerBusyError("iperf3 server {0}:{1} is busy".format(ip, port)) from None
         if retry == 2:
             raise ExternalError("External Error generated from iperf3: {0}".format(iperf_result_json["error"])) from\
                   None
         else:
             logging.warning("Rerunning iperf3 with retry count {0}".format(retry + 1))
-            run_iperf(ip, port, bind_address, download, protocol, retry + 1)
+            record_retry("iperf3")
+            return run_iperf(ip, port, bind_address, download, protocol, num_streams, duration, omit, window_size,
+                             bandwidth, bidirectional, runner, retry + 1)
     return iperf_result_json
 
 
 @log_arguments
-def run_speedtest(mode, bind_address, libre_speed_server_list=None, retry=0):
-    """Run speedtest and return the json results.
+def run_iperf_stream(ip, port, bind_address, download=True, protocol="tcp", omit=1, tolerance=0.1,
+                     stable_intervals=3, duration=10, num_streams=1, window_size=None, bandwidth=None,
+                     bidirectional=False, early_stop=True, retry=0):
+    """Run the iperf3 binary with streamed json output and end the
+    test early once throughput is stable.
+
+    Interval reports are consumed as they arrive. The first omit
+    seconds are discarded as warm-up. Once the last stable_intervals
+    reports are all within tolerance of their mean the test is
+    stopped and the reported throughput is that of the stable
+    intervals.
+    UDP upload and bidirectional tests always run for duration as
+    loss and jitter are only known to the server.
+
+    Args:
+        ip (str): The ip address of the iperf3 server.
+        port (str): The port of the iperf3 server.
+        bind_address (str): The wireless interface ip
+        address of the client which is being used to
+        benchmark.
+        download (bool), optional: True if testing download,
+        False if testing upload. Defaults to True.
+        protocol (str), optional: 'tcp' if testing using tcp
+        protocol. 'udp' if testing using udp protocol.
+        Defaults to 'tcp'
+        omit (int), optional: Warm-up seconds to discard.
+        Defaults to 1.
+        tolerance (float), optional: Relative tolerance for
+        stable throughput. Defaults to 0.1.
+        stable_intervals (int), optional: Number of stable
+        intervals required to end the test. Defaults to 3.
+        duration (int), optional: Max test duration in
+        seconds. Defaults to 10.
+        num_streams (int), optional: Number of parallel
+        streams. Defaults to 1.
+        window_size (int), optional: Socket buffer (window)
+        size in bytes. Defaults to None which uses the
+        system default.
+        bandwidth (int), optional: UDP target bandwidth in
+        bits/s. Defaults to None which uses the iperf3
+        default.
+        bidirectional (bool), optional: True to test upload
+        and download at the same time, download is ignored.
+        Defaults to False.
+        early_stop (bool), optional: False to always run for
+        duration. Defaults to True.
+        retry (int), optional: The retry count.
+
+    Returns:
+        dict: Dictionary containing the iperf3 results in the
+        same layout as run_iperf.
+    """
+    iperf_args = ["iperf3", "-c", ip, "-p", str(port), "-B", bind_address, "--json-stream",
+                  "-t", str(duration), "-O", str(omit), "-P", str(num_streams)]
+    if window_size:
+        iperf_args += ["-w", str(window_size)]
+    if bandwidth:
+        iperf_args += ["-b", str(bandwidth)]
+    if bidirectional:
+        iperf_args.append("--bidir")
+    elif download:
+        iperf_args.append("-R")
+    if protocol == "udp":
+        iperf_args.append("-u")
+    early_stop = early_stop and not bidirectional and (protocol == "tcp" or download)
+
+    start = None
+    end = None
+    error = None
+    intervals = []
+    stopped = False
+    process = subprocess.Popen(iperf_args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                               universal_newlines=True)
+    timeout = duration + omit + 10
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        process.kill()
+
+    watchdog = threading.Timer(timeout, kill)
+    watchdog.start()
+    try:
+        for line in process.stdout:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if event.get("event") == "start":
+                start = event["data"]
+            elif event.get("event") == "interval":
+                intervals.append(event["data"])
+                if early_stop and is_stable(intervals, tolerance, stable_intervals):
+                    logging.debug("iperf3 throughput stable after {0} intervals".format(len(intervals)))
+                    stopped = True
+                    break
+            elif event.get("event") == "end":
+                end = event["data"]
+            elif event.get("event") == "error":
+                error = event["data"]
+    finally:
+        watchdog.cancel()
+        if process.poll() is None:
+            process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    if stopped:
+        end = summarize_intervals(intervals, protocol, stable_intervals)
+        start["test_start"]["duration"] = sum(interval["sum"]["seconds"] for interval in intervals
+                                              if not interval["sum"].get("omitted", False))
+
+    if start is None or end is None:
+        if error is None:
+            if timed_out.is_set():
+                error = "no results, iperf3 was killed after {0}s".format(timeout)
+            elif not supports_json_stream():
+                error = "no results, iperf3 3.17 or newer is required for streamed output"
+            else:
+                error = "no results, iperf3 exited with code {0}".format(process.returncode)
+        logging.error("Output from iperf3 : {0}".format(error))
+        if is_server_busy(error):
+            raise ServerBusyError("iperf3 server {0}:{1} is busy".format(ip, port))
+        if retry == 2:
+            raise ExternalError("External Error generated from iperf3: {0}".format(error)) from None
+        logging.warning("Rerunning iperf3 with retry count {0}".format(retry + 1))
+        record_retry("iperf3")
+        return run_iperf_stream(ip, port, bind_address, download, protocol, omit, tolerance,
+                                stable_intervals, duration, num_streams, window_size, bandwidth, bidirectional,
+                                early_stop, retry + 1)
+
+    return {"start": start, "intervals": intervals, "end": end}
+
+
+def supports_json_stream():
+    """Check if the iperf3 binary is 3.17 or newer, the first
+    version with streamed json output.
+
+    Returns:
+        bool: True if --json-stream is supported, False otherwise.
+    """
+    match = re.search(r"iperf (\d+)\.(\d+)", get_application_output(["iperf3", "--version"], timeout=10))
+    return match is not None and (int(match.group(1)), int(match.group(2))) >= (3, 17)
+
+
+@log_arguments
+def probe_udp_capacity(ip, port, bind_address, download=True, loss_threshold=1.0, start_rate=10000000,
+                       max_rate=10000000000, probe_duration=2, max_time=30, precision=0.05, window_size=None,
+                       streamed=False, runner=None):
+    """Search for the highest UDP target bandwidth that keeps
+    packet loss under a threshold.
+
+    The rate is doubled from start_rate until loss exceeds the
+    threshold, then the highest lossless rate is narrowed down by
+    binary search. No new probe is started once max_time would be
+    exceeded.
+
+    Args:
+        ip (str): The ip address of the iperf3 server.
+        port (str): The port of the iperf3 server.
+        bind_address (str): The wireless interface ip
+        address of the client which is being used to
+        benchmark.
+        download (bool), optional: True if testing download,
+        False if testing upload. Defaults to True.
+        loss_threshold (float), optional: Max packet loss in
+        percent. Defaults to 1.0.
+        start_rate (int), optional: First rate to probe in
+        bits/s. Defaults to 10 Mbit/s.
+        max_rate (int), optional: Highest rate to probe in
+        bits/s. Defaults to 10 Gbit/s.
+        probe_duration (int), optional: Duration of every
+        probe in seconds. Defaults to 2.
+        max_time (int), optional: Max total probe time in
+        seconds. Defaults to 30.
+        precision (float), optional: Relative precision of the
+        binary search. Defaults to 0.05.
+        window_size (int), optional: Socket buffer size in
+        bytes. Defaults to None which uses the system default.
+        streamed (bool), optional: True to run the iperf3
+        binary with run_iperf_stream instead of libiperf.
+        Defaults to False.
+        runner (IperfRunner), optional: Runner sharing the
+        libiperf setup across probes. Defaults to None.
+
+    Returns:
+        dict: Dictionary containing the highest lossless
+        'rate' in bits/s with its 'lost_percent', 'jitter_ms'
+        and the number of 'probes' run. The rate is 0 if no
+        lossless rate was found.
+    """
+    started = time.monotonic()
+    found = {"rate": 0, "lost_percent": 100.0, "jitter_ms": 0.0, "probes": 0}
+
+    def probe(rate):
+        if streamed:
+            result = run_iperf_stream(ip, port, bind_address, download=download, protocol="udp", omit=0,
+                                      duration=probe_duration, bandwidth=int(rate), window_size=window_size,
+                                      early_stop=False)
+        else:
+            result = run_iperf(ip, port, bind_address, download=download, protocol="udp", duration=probe_duration,
+                               bandwidth=int(rate), window_size=window_size, runner=runner)
+        found["probes"] += 1
+        summary = result["end"]["sum"]
+        logging.debug("UDP probe at {0} bits/s lost {1}%".format(rate, summary["lost_percent"]))
+        if summary["lost_percent"] <= loss_threshold:
+            found.update(rate=int(rate), lost_percent=summary["lost_percent"], jitter_ms=summary["jitter_ms"])
+            return True
+        return False
+
+    def time_left():
+        return time.monotonic() - started + probe_duration <= max_time
+
+    low, high = 0, None
+    rate = start_rate
+    while rate <= max_rate and time_left():
+        if not probe(rate):
+            high = rate
+            break
+        low = rate
+        rate *= 2
+    if high is None:
+        high = min(rate, max_rate)
+
+    while high - low > precision * high and time_left():
+        rate = (low + high) / 2
+        if probe(rate):
+            low = rate
+        else:
+            high = rate
+
+    return found
+
+
+def is_server_busy(error):
+    """Check if an iperf3 error means the server is running
+    another test.
+
+    Args:
+        error (str): The iperf3 error message.
+
+    Returns:
+        bool: True if the server is busy, False otherwise.
+    """
+    return error is not None and "busy" in str(error).lower()
+
+
+def is_stable(intervals, tolerance, stable_intervals):
+    """Check if the throughput of the last iperf3 intervals is
+    within a tolerance of their mean. Omitted intervals are
+    ignored.
+
+    Args:
+        intervals (list): List of iperf3 interval reports.
+        tolerance (float): Relative tolerance.
+        stable_intervals (int): Number of intervals to check.
+
+    Returns:
+        bool: True if throughput is stable, False otherwise.
+    """
+    values = [interval["sum"]["bits_per_second"] for interval in intervals
+              if not interval["sum"].get("omitted", False)][-stable_intervals:]
+    if len(values) < stable_intervals:
+        return False
+    mean = sum(values) / len(values)
+    return all(abs(value - mean) <= tolerance * mean for value in values)
+
+
+def summarize_intervals(intervals, protocol, stable_intervals=None):
+    """Summarise iperf3 interval reports into the 'end' section
+    of an iperf3 result. Omitted intervals are ignored.
+
+    Args:
+        intervals (list): List of iperf3 interval reports.
+        protocol (str): 'tcp' or 'udp'.
+        stable_intervals (int), optional: Number of trailing
+        intervals the throughput is computed from. Defaults to
+        None which uses all intervals.
+
+    Returns:
+        dict: Dictionary in the layout of the iperf3 'end'
+        section.
+    """
+    intervals = [interval for interval in intervals if not interval["sum"].get("omitted", False)]
+    sums = [interval["sum"] for interval in intervals]
+    stable = intervals[-stable_intervals:] if stable_intervals else intervals
+    summary = {
+        "start": sums[0]["start"],
+        "end": sums[-1]["end"],
+        "seconds": sum(interval_sum["seconds"] for interval_sum in sums),
+        "bytes": sum(interval_sum["bytes"] for interval_sum in sums),
+        "bits_per_second": sum(interval["sum"]["bytes"] for interval in stable) * 8 /
+        sum(interval["sum"]["seconds"] for interval in stable),
+    }
+    streams = []
+    for index in range(len(stable[0].get("streams", []))):
+        stream = {"bits_per_second": sum(interval["streams"][index]["bytes"] for interval in stable) * 8 /
+                  sum(interval["streams"][index]["seconds"] for interval in stable)}
+        if protocol == "udp":
+            streams.append({"udp": stream})
+        else:
+            streams.append({"sender": stream, "receiver": stream})
+    if protocol == "udp":
+        summary["jitter_ms"] = sum(interval_sum.get("jitter_ms", 0) for interval_sum in sums) / len(sums)
+        summary["packets"] = sum(interval_sum.get("packets", 0) for interval_sum in sums)
+        summary["lost_packets"] = sum(interval_sum.get("lost_packets", 0) for interval_sum in sums)
+        summary["lost_percent"] = 0
+        if summary["packets"] > 0:
+            summary["lost_percent"] = summary["lost_packets"] * 100 / summary["packets"]
+        return {"streams": streams, "sum": summary}
+    return {"streams": streams, "sum_sent": summary, "sum_received": summary}
+
+
+# Seconds without output before a phase of the Ookla speedtest is considered stalled.
+OOKLA_STALL_TIMEOUTS = {
+    "start": 30,
+    "ping": 10,
+    "download": 15,
+    "upload": 15,
+}
+
+
+@log_arguments
+def run_speedtest(mode, bind_address, libre_speed_server_list=None, server_id=None, progress=None, retries=2,
+                  backoff=2.0):
+    """Run speedtest and return the json results. Failed tests
+    are retried with exponential backoff.
 
     Args:
         mode (SpeedTestMode): The speedtest backend to use
@@ -313,46 +983,221 @@ def run_speedtest(mode, bind_address, libre_speed_server_list=None, retry=0):
         path to the librespeed server json file.
         Default is None which forces librespeed to use
         global list.
-        retry (int), optional: The retry count.
+        server_id (str), optional: The id of the server to
+        test against. Default is None which lets the backend
+        select a server.
+        progress (function), optional: Called with a progress
+        message while the test runs. Only Ookla reports
+        progress. Default is None.
+        retries (int), optional: Number of retries. Defaults
+        to 2.
+        backoff (float), optional: Wait before the first retry
+        in seconds, doubled on every retry. Defaults to 2.
+
+    Returns:
+        dict: Dictionary containing the speedtest results.
+
+    Raises:
+        ParseError: When the last try did not produce a result.
+    """
+    for retry in range(retries + 1):
+        try:
+            if mode == SpeedTestMode.OOKLA:
+                return run_ookla_speedtest(bind_address, server_id=server_id, progress=progress)
+            elif mode == SpeedTestMode.SIVEL:
+                sivel_args = ["speedtest", "--json", "--source", bind_address]
+                if server_id is not None:
+                    sivel_args += ["--server", str(server_id)]
+                return run_json_speedtest(sivel_args, "Speedtest Sivel")
+            elif mode == SpeedTestMode.LIBRESPEED:
+                libre_args = ["librespeed-cli", "--json", "--source", bind_address, "--mebibytes"]
+                if libre_speed_server_list is not None:
+                    if not os.path.isfile((libre_speed_server_list)):
+                        raise OSError("Invalid server list specified for libre office")
+                    libre_speed_server_list = os.path.abspath(libre_speed_server_list)
+                    libre_args += ["--local-json", libre_speed_server_list]
+                    logging.debug("Libre Args: {0}".format(libre_args))
+                if server_id is not None:
+                    libre_args += ["--server", str(server_id)]
+                return run_json_speedtest(libre_args, "Librespeed CLI")
+        except ParseError:
+            logging.exception("Parse Error has occured.")
+            if retry == retries:
+                raise
+            delay = backoff * 2 ** retry
+            logging.warning("Rerunning Speedtest with retry count {0} in {1}s".format(retry + 1, delay))
+            record_retry("speedtest")
+            time.sleep(delay)
+    raise ValueError("Unsupported speedtest mode {0}".format(mode))
+
+
+def run_ookla_speedtest(bind_address, server_id=None, progress=None, timeout=120):
+    """Run the Ookla speedtest with streamed json lines output.
+    The test is stopped early if a phase stops reporting
+    progress.
+
+    Args:
+        bind_address (str): The wireless interface ip
+        address of the client which is being used to
+        benchmark.
+        server_id (str), optional: The id of the server to
+        test against. Default is None.
+        progress (function), optional: Called with a progress
+        message for every progress event. Default is None.
+        timeout (int), optional: Max test duration in seconds.
+        Defaults to 120.
 
     Returns:
         dict: Dictionary containing the speedtest results.
+
+    Raises:
+        ParseError: When the test did not produce a result.
     """
+    ookla_args = ["speedtest", "-f", "jsonl", "-p", "yes", "-i", bind_address]
+    if server_id is not None:
+        ookla_args += ["--server-id", str(server_id)]
+    state = {"phase": "start", "result": None, "error": None}
+
+    def on_line(line):
+        try:
+            event = json.loads(line)
+        except ValueError:
+            return
+        kind = event.get("type")
+        if kind == "result":
+            state["result"] = event
+        elif kind == "log" and event.get("level") == "error":
+            state["error"] = event.get("message")
+        elif kind in ("ping", "download", "upload"):
+            state["phase"] = kind
+            if progress is not None:
+                progress("Speedtest {0} {1:.0%}".format(kind, event.get(kind, {}).get("progress", 0)))
+
+    reason = stream_application_output(ookla_args, on_line, timeout=timeout,
+                                       stall_timeout=lambda: OOKLA_STALL_TIMEOUTS[state["phase"]])
+    if state["result"] is None:
+        raise ParseError("No result from Speedtest Ookla ({0} during {1}): {2}"
+                         .format(reason, state["phase"], state["error"]))
+    return state["result"]
+
+
+def run_json_speedtest(command, name, timeout=120):
+    """Run a speedtest that prints its json result on exit.
+
+    Args:
+        command (list): The command to run and it's arguments.
+        name (str): The name of the backend for errors.
+        timeout (int), optional: Max test duration in seconds.
+        Defaults to 120.
+
+    Returns:
+        dict: Dictionary containing the speedtest results.
+
+    Raises:
+        ParseError: When the output could not be decoded.
+    """
+    lines = []
+    reason = stream_application_output(command, lines.append, timeout=timeout)
     try:
-        if mode == SpeedTestMode.OOKLA:
-            try:
-                speedtest_result = json.loads(get_application_output(["speedtest", "-f", "json", "-i", bind_address],
-                                                                     timeout=120))
-            except ValueError:
-                raise ParseError("Unable to decode output from Speedtest Ookla") from None
-            return speedtest_result
-        elif mode == SpeedTestMode.SIVEL:
-            try:
-                speedtest_result = json.loads(get_application_output(["speedtest", "--json", "--source", bind_address],
-                                                                     timeout=120))
-            except ValueError:
-                raise ParseError("Unable to decode output from Speedtest Sivel") from None
-            return speedtest_result
-        elif mode == SpeedTestMode.LIBRESPEED:
-            libre_args = ["librespeed-cli", "--json", "--source", bind_address, "--mebibytes"]
-            if libre_speed_server_list is not None:
-                if not os.path.isfile((libre_speed_server_list)):
-                    raise OSError("Invalid server list specified for libre office")
-                libre_speed_server_list = os.path.abspath(libre_speed_server_list)
-                libre_args += ["--local-json", libre_speed_server_list]
-                logging.debug("Libre Args: {0}".format(libre_args))
-            try:
-                librespeed_result = json.loads(get_application_output(libre_args, timeout=120))
-            except ValueError:
-                raise ParseError("Unable to decode output from Librespeed CLI") from None
-            return librespeed_result
-    except ParseError as err:
-        logging.exception("Parse Error has occured.")
-        if retry == 2:
-            raise err
-        else:
-            logging.warning("Rerunning Speedtest with retry count {0}".format(retry + 1))
-            run_speedtest(mode, bind_address, libre_speed_server_list, retry + 1)
+        return json.loads("".join(lines))
+    except ValueError:
+        raise ParseError("Unable to decode output from {0} ({1})".format(name, reason)) from None
+
+
+def stream_application_output(command, on_line, timeout=None, stall_timeout=None):
+    """Run a command and pass its output line by line to a
+    callback as it is written. A watchdog kills the command when
+    it runs too long or stops writing output.
+
+    Args:
+        command (list): The command to run and it's arguments.
+        on_line (function): Called with every line of output.
+        timeout (float, None), optional: Max execution time in
+        seconds. Default is None.
+        stall_timeout (float, function, None), optional: Max time
+        in seconds without output, or a function returning it.
+        Default is None.
+
+    Returns:
+        str: 'exited' if the command exited with a zero exit code,
+        'invalid' for a non-zero exit code, 'timeout' or 'stalled'
+        if it was killed and 'unavailable' if it does not exist.
+    """
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                   universal_newlines=True, start_new_session=True)
+    except FileNotFoundError:
+        return "unavailable"
+
+    def kill():
+        # Kill the whole session so children holding the pipe exit too.
+        with suppress(ProcessLookupError):
+            os.killpg(process.pid, signal.SIGKILL)
+
+    started = time.monotonic()
+    activity = [started]
+    killed = []
+    done = threading.Event()
+
+    def watchdog():
+        while not done.wait(0.5):
+            now = time.monotonic()
+            stall = stall_timeout() if callable(stall_timeout) else stall_timeout
+            if timeout is not None and now - started > timeout:
+                killed.append("timeout")
+            elif stall is not None and now - activity[0] > stall:
+                killed.append("stalled")
+            else:
+                continue
+            logging.warning("Killing {0}: {1}".format(command[0], killed[0]))
+            kill()
+            return
+
+    thread = threading.Thread(target=watchdog, name="watchdog", daemon=True)
+    thread.start()
+    try:
+        for line in process.stdout:
+            activity[0] = time.monotonic()
+            on_line(line)
+    finally:
+        done.set()
+        if process.poll() is None:
+            kill()
+        process.wait()
+        thread.join()
+    if killed:
+        return killed[0]
+    return "exited" if process.returncode == 0 else "invalid"
+
+
+def get_speedtest_server(mode, speedtest_result, libre_speed_server_list=None):
+    """Get the server a speedtest ran against.
+
+    Args:
+        mode (SpeedTestMode): The speedtest backend used.
+        speedtest_result (dict): Dictionary containing the
+        speedtest results.
+        libre_speed_server_list (str), optional: The
+        path to the librespeed server json file.
+
+    Returns:
+        tuple: Containing the server id (None if unknown) and
+        name in the form of (id, name).
+    """
+    server = speedtest_result.get("server", {})
+    if mode == SpeedTestMode.LIBRESPEED:
+        # librespeed only reports the server url, look up its id in the server list.
+        libre_args = ["librespeed-cli", "--list"]
+        if libre_speed_server_list is not None:
+            libre_args += ["--local-json", os.path.abspath(libre_speed_server_list)]
+        for line in get_application_output(libre_args, timeout=60).split("\n"):
+            match = re.match(r"^(\d+): .*\((https?://[^)]*)\)", line)
+            if match is not None and match.group(2) == server.get("url"):
+                return (match.group(1), server.get("name", ""))
+        return (None, server.get("name", ""))
+    if "id" not in server:
+        return (None, server.get("name", ""))
+    return (str(server["id"]), server.get("name", ""))
 
 
 @log_arguments
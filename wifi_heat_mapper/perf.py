@@ -0,0 +1,148 @@
+from wifi_heat_mapper.misc import IperfRunner, new_iperf_client, silenced_output, libiperf_lock, save_json
+from wifi_heat_mapper.servers import IperfServerPool
+import threading
+import socket
+import ctypes
+import time
+
+
+class StandInServer:
+    """A local stand-in for ``iperf3 -s`` which accepts and closes
+    connections on its control port, enough for server checks."""
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(64)
+        self.port = self.sock.getsockname()[1]
+        self._thread = threading.Thread(target=self._accept, name="iperf-stand-in", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self.sock.close()
+        self._thread.join(timeout=2)
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self.sock.accept()
+            except OSError:
+                return
+            connection.close()
+
+
+def setup_test(iperf_ip, iperf_port, runner=None, client=True):
+    """Run the per-test path of run_iperf up to client.run, the
+    client setup and the output redirection, without a test.
+
+    Args:
+        iperf_ip (str): The ip address of the iperf3 server.
+        iperf_port (int): The port of the iperf3 server.
+        runner (IperfRunner), optional: Runner shared by the tests.
+        Defaults to None which sets up the test from scratch.
+        client (bool), optional: False to skip the client setup
+        when libiperf is not installed. Defaults to True.
+    """
+    if client:
+        new_iperf_client(iperf_ip, iperf_port, "127.0.0.1", runner=runner)
+    with libiperf_lock, silenced_output(runner):
+        pass
+
+
+def time_tests(count, pool, runner, client):
+    """Time count tests sent through a server pool.
+
+    Args:
+        count (int): the number of simulated tests.
+        pool (IperfServerPool): the pool picking the server.
+        runner (IperfRunner): Runner shared by the tests, None to
+        set up every test from scratch.
+        client (bool): False to skip the client setup.
+
+    Returns:
+        float: the mean time per test in microseconds.
+    """
+    started = time.perf_counter()
+    for _ in range(count):
+        pool.run(setup_test, runner=runner, client=client)
+    return (time.perf_counter() - started) / count * 1e6
+
+
+def benchmark_iperf_setup(count=200, iperf_server=None):
+    """Measure the per-test setup cost of libiperf tests with and
+    without an IperfRunner.
+
+    Every test goes through IperfServerPool.run like a survey does,
+    so the timings include picking the server next to the client
+    setup and the output redirection of run_iperf.
+
+    Args:
+        count (int), optional: the number of simulated tests.
+        Defaults to 200.
+        iperf_server (tuple), optional: (ip, port) of a running
+        iperf3 server. Defaults to None which starts a local
+        stand-in.
+
+    Returns:
+        dict: Dictionary containing the 'fresh' and 'runner' mean
+        times in microseconds per test and whether libiperf was
+        'available' to time the client setup.
+    """
+    with StandInServer() as stand_in, IperfRunner() as runner:
+        server = iperf_server if iperf_server is not None else ("127.0.0.1", stand_in.port)
+        try:
+            ctypes.CDLL(runner.lib_name)
+            available = True
+        except OSError:
+            available = False
+        pool = IperfServerPool([server], runner=runner)
+        if len(pool.check()) == 0:
+            print("Could not connect to iperf3 server.")
+            exit(1)
+        return {
+            "tests": count,
+            "available": available,
+            "fresh": time_tests(count, pool, None, available),
+            "runner": time_tests(count, pool, runner, available),
+        }
+
+
+def print_timings(report):
+    """Print the per-test timings of benchmark_iperf_setup."""
+    print("{0:>14}{1:>14}{2:>10}".format("Fresh (us)", "Runner (us)", "Speedup"))
+    print("{0:>14.1f}{1:>14.1f}{2:>9.1f}x".format(report["fresh"], report["runner"],
+                                                  report["fresh"] / max(report["runner"], 1e-3)))
+    if not report["available"]:
+        print("libiperf is not installed, the client setup was not measured.")
+
+
+def start_perf(target, count=200, iperf_server=None, output_file=None):
+    """Starting point for the perf submodule for whm.
+
+    Args:
+        target (str): the benchmark to run.
+        count (int), optional: the number of simulated tests.
+        Defaults to 200.
+        iperf_server (str), optional: ip address and port of a
+        running iperf3 server. Defaults to None which starts a
+        local stand-in.
+        output_file (str), optional: path to save the results
+        as json. Defaults to None.
+
+    Returns:
+        None
+    """
+    if target == "iperf":
+        server = None
+        if iperf_server is not None:
+            from wifi_heat_mapper.gui import parse_iperf_server
+            server = parse_iperf_server(iperf_server)
+        report = benchmark_iperf_setup(count, server)
+        print_timings(report)
+    else:
+        print("Unknown benchmark {0}.".format(target))
+        exit(1)
+    if output_file is not None:
+        save_json(output_file, report)
@@ -0,0 +1,156 @@
+from collections import deque
+from bisect import bisect_left, bisect_right
+import subprocess
+from shutil import which
+import threading
+import re
+import logging
+
+
+class RoamListener:
+    """Records connect, disconnect and roam events of the wireless
+    interfaces from a persistent ``iw event -t`` stream in a background
+    thread.
+
+    Events are stored as (t, interface, kind, bssid) tuples where ``t``
+    is a UNIX timestamp in seconds and ``kind`` is one of connected,
+    disconnected or roamed. Only the newest ``max_events`` events are
+    kept.
+
+    Args:
+        max_events (int), optional: number of events to buffer.
+        Defaults to 4096.
+    """
+    EVENT = re.compile(r"^(\d+\.\d+): (\S+) \(phy #\d+\): (.*)$")
+    MAC = re.compile(r"([0-9A-Fa-f]{2}(?::[0-9A-Fa-f]{2}){5})")
+
+    def __init__(self, max_events=4096):
+        self.events = deque(maxlen=max_events)
+        self._lock = threading.Lock()
+        self._process = None
+        self._thread = None
+
+    def start(self):
+        """Start iw event and read it in a daemon thread.
+
+        Returns:
+            bool: True if the listener started, False if iw event
+            could not be run.
+        """
+        iw = which("iw")
+        if iw is None:
+            logging.error("Unable to start iw event, iw is not installed")
+            return False
+        try:
+            self._process = subprocess.Popen([iw, "event", "-t"], stdout=subprocess.PIPE,
+                                             stderr=subprocess.DEVNULL, universal_newlines=True)
+        except OSError:
+            logging.exception("Unable to start iw event")
+            return False
+        self._thread = threading.Thread(target=self._read, name="roam-listener", daemon=True)
+        self._thread.start()
+        logging.debug("Started roam listener")
+        return True
+
+    def stop(self):
+        """Stop iw event and wait for the reader to exit."""
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
+            self._process.wait()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    def add_line(self, line):
+        """Parse an ``iw event -t`` line and buffer the event.
+
+        Args:
+            line (str): line read from iw event.
+
+        Returns:
+            bool: True if the line produced an event, False otherwise.
+        """
+        event = self.EVENT.match(line.strip())
+        if event is None:
+            return False
+        t, interface, message = float(event.group(1)), event.group(2), event.group(3)
+        if message.startswith("connected"):
+            kind = "connected"
+        elif message.startswith("roamed"):
+            kind = "roamed"
+        elif message.startswith("disconnected"):
+            kind = "disconnected"
+        else:
+            return False
+        bssid = self.MAC.search(message)
+        bssid = bssid.group(1).lower() if bssid is not None else None
+        with self._lock:
+            self.events.append((t, interface, kind, bssid))
+        logging.debug("Wireless event on {0}: {1} {2}".format(interface, kind, bssid))
+        return True
+
+    def window(self, interface, start, end):
+        """Get the events of an interface in a time window.
+
+        Args:
+            interface (str): the wireless interface.
+            start (float): UNIX timestamp of the window start.
+            end (float): UNIX timestamp of the window end.
+
+        Returns:
+            tuple: Containing the list of events before the window
+            and the list of events in the window.
+        """
+        with self._lock:
+            events = [event for event in self.events if event[1] == interface]
+        times = [event[0] for event in events]
+        first = bisect_left(times, start)
+        last = bisect_right(times, end)
+        return (events[:first], events[first:last])
+
+    def metrics(self, interface, start, end):
+        """Get the roam count and the time spent disconnected in a
+        time window.
+
+        A roam is a roamed event or a connected event to another
+        access point than the previous connection. Such connected
+        events are reported as roamed.
+
+        Args:
+            interface (str): the wireless interface.
+            start (float): UNIX timestamp of the window start.
+            end (float): UNIX timestamp of the window end.
+
+        Returns:
+            dict: Dictionary containing the 'roam_count',
+            'disconnected_ms' and the 'roam_events' of the window as
+            lists of [t, kind, bssid].
+        """
+        before, events = self.window(interface, start, end)
+        bssid = next((event[3] for event in reversed(before) if event[3] is not None), None)
+        disconnected_since = start if len(before) != 0 and before[-1][2] == "disconnected" else None
+        roam_events = []
+        disconnected = 0.0
+        for t, _, kind, event_bssid in events:
+            roam_events.append([t, kind, event_bssid])
+            if kind == "disconnected":
+                if disconnected_since is None:
+                    disconnected_since = t
+                continue
+            if disconnected_since is not None:
+                disconnected += t - disconnected_since
+                disconnected_since = None
+            if bssid is not None and event_bssid is not None and event_bssid != bssid:
+                roam_events[-1][1] = "roamed"
+            bssid = event_bssid if event_bssid is not None else bssid
+        if disconnected_since is not None:
+            disconnected += end - disconnected_since
+        return {
+            "roam_count": len([event for event in roam_events if event[1] == "roamed"]),
+            "disconnected_ms": disconnected * 1000,
+            "roam_events": roam_events,
+        }
+
+    def _read(self):
+        for line in self._process.stdout:
+            self.add_line(line)
+        logging.debug("Roam listener finished")
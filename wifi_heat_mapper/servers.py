@@ -0,0 +1,154 @@
+from wifi_heat_mapper.misc import IperfRunner, ExternalError, ServerBusyError, verify_iperf
+from wifi_heat_mapper.metrics import record_retry
+import threading
+import random
+import time
+import logging
+
+
+def server_endpoint(server):
+    """Get the ip:port string of a server of an IperfServerPool."""
+    return "{0}:{1}".format(server["ip"], server["port"])
+
+
+class IperfServerPool:
+    """A pool of iperf3 servers shared by benchmarks.
+
+    An iperf3 server only runs one test at a time. Every test is sent
+    to a healthy server that is not in use, preferring the server that
+    ran the fewest tests. A server that reports it is busy is skipped
+    with exponential backoff and a server that fails is taken out of
+    the pool until it passes a health check again.
+
+    Args:
+        servers (list): List of (ip, port) tuples.
+        backoff (float), optional: Initial wait in seconds before
+        retrying a busy server. Defaults to 1.
+        max_backoff (float), optional: Max wait in seconds before
+        retrying a busy or failed server. Defaults to 30.
+        max_wait (float), optional: Max time in seconds to wait for
+        a free server. Defaults to 120.
+        runner (IperfRunner), optional: Runner shared by the tests
+        of the survey. Defaults to a new IperfRunner.
+        check (function), optional: Health check taking the ip and
+        port of a server. Defaults to verify_iperf.
+    """
+    def __init__(self, servers, backoff=1.0, max_backoff=30.0, max_wait=120.0, runner=None, check=None):
+        self.servers = [{
+            "ip": ip,
+            "port": int(port),
+            "healthy": True,
+            "in_use": False,
+            "busy": 0,
+            "available_at": 0.0,
+            "tests": 0,
+        } for ip, port in servers]
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_wait = max_wait
+        self.runner = runner if runner is not None else IperfRunner()
+        self.verify = check if check is not None else verify_iperf
+        self._interfaces = {}
+        self._lock = threading.Lock()
+
+    def check(self):
+        """Health check every server.
+
+        Returns:
+            list: ip:port strings of the healthy servers.
+        """
+        for server in self.servers:
+            server["healthy"] = self.verify(server["ip"], server["port"])
+            if not server["healthy"]:
+                server["available_at"] = time.monotonic() + self.max_backoff
+                logging.warning("iperf3 server {0} is unreachable".format(server_endpoint(server)))
+        return [server_endpoint(server) for server in self.servers if server["healthy"]]
+
+    def for_interface(self, index, servers=None):
+        """Get the pool of an additional wireless interface.
+
+        The interfaces of a survey run their tests at the same time,
+        so each one needs iperf3 servers of its own. By default an
+        interface uses the servers of this pool on their port plus
+        the index of the interface.
+
+        Args:
+            index (int): Index of the interface, starting at 1.
+            servers (list), optional: List of (ip, port) tuples the
+            interface uses instead. Defaults to None.
+
+        Returns:
+            IperfServerPool: The pool of the interface, the same one
+            for every call with the same index.
+        """
+        with self._lock:
+            if index not in self._interfaces:
+                if not servers:
+                    servers = [(server["ip"], server["port"] + index) for server in self.servers]
+                self._interfaces[index] = IperfServerPool(servers, backoff=self.backoff,
+                                                          max_backoff=self.max_backoff, max_wait=self.max_wait,
+                                                          runner=self.runner, check=self.verify)
+            return self._interfaces[index]
+
+    def run(self, function, *args, **kwargs):
+        """Run a test on a free server.
+
+        Args:
+            function (function): The test to run. It is called with
+            the server as iperf_ip and iperf_port keyword arguments
+            next to args and kwargs.
+
+        Returns:
+            tuple: Containing the test result and the ip:port of the
+            server used in the form of (result, endpoint).
+
+        Raises:
+            ExternalError: When no server became free within max_wait
+            or the test failed on the last healthy server.
+        """
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            server = self._acquire(deadline)
+            endpoint = server_endpoint(server)
+            try:
+                result = function(*args, iperf_ip=server["ip"], iperf_port=server["port"], **kwargs)
+            except ServerBusyError:
+                delay = min(self.backoff * 2 ** server["busy"], self.max_backoff) * random.uniform(0.5, 1.0)
+                server["busy"] += 1
+                server["available_at"] = time.monotonic() + delay
+                logging.debug("iperf3 server {0} is busy, retrying in {1:.1f}s".format(endpoint, delay))
+                record_retry("iperf3_busy")
+                continue
+            except ExternalError:
+                server["healthy"] = False
+                server["available_at"] = time.monotonic() + self.max_backoff
+                if not any(other["healthy"] for other in self.servers):
+                    raise
+                logging.warning("iperf3 server {0} failed, trying another server".format(endpoint))
+                record_retry("iperf3_failed")
+                continue
+            finally:
+                with self._lock:
+                    server["in_use"] = False
+            server["busy"] = 0
+            server["tests"] += 1
+            return (result, endpoint)
+
+    def _acquire(self, deadline):
+        while True:
+            now = time.monotonic()
+            for server in self.servers:
+                if not server["healthy"] and server["available_at"] <= now:
+                    server["healthy"] = self.verify(server["ip"], server["port"])
+                    server["available_at"] = now if server["healthy"] else now + self.max_backoff
+            with self._lock:
+                free = [server for server in self.servers
+                        if server["healthy"] and not server["in_use"] and server["available_at"] <= now]
+                if free:
+                    server = min(free, key=lambda server: (server["tests"], random.random()))
+                    server["in_use"] = True
+                    return server
+            if now >= deadline:
+                raise ExternalError("No iperf3 server became available within {0}s".format(self.max_wait))
+            wake = min([server["available_at"] for server in self.servers] + [deadline])
+            time.sleep(min(max(wake - now, 0.1), 1.0))
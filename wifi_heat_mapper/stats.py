@@ -0,0 +1,229 @@
+from scipy.stats import t as student_t
+from scipy.stats import trim_mean
+from array import array
+import numpy as np
+import base64
+import math
+import sys
+
+
+AGGREGATIONS = {
+    "mean": np.mean,
+    "median": np.median,
+    "trimmed": lambda values: trim_mean(values, 0.1),
+    "p5": lambda values: np.percentile(values, 5),
+    "p95": lambda values: np.percentile(values, 95),
+}
+
+
+class RunningStats:
+    """Running mean and variance of a metric using Welford's
+    online algorithm."""
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value):
+        """Add a sample.
+
+        Args:
+            value (float): the sample to add.
+
+        Returns:
+            None
+        """
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    @property
+    def variance(self):
+        """Sample variance, None with less than two samples."""
+        if self.count < 2:
+            return None
+        return self._m2 / (self.count - 1)
+
+    def half_width(self, confidence=0.95):
+        """Get the half-width of the confidence interval of the
+        mean using the Student's t distribution.
+
+        Args:
+            confidence (float), optional: confidence level.
+            Defaults to 0.95.
+
+        Returns:
+            float or None: the half-width, None with less than
+            two samples.
+        """
+        if self.count < 2:
+            return None
+        critical = float(student_t.ppf((1 + confidence) / 2, self.count - 1))
+        return critical * math.sqrt(self.variance / self.count)
+
+    def converged(self, tolerance, confidence=0.95):
+        """Check if the confidence interval half-width is within
+        a tolerance relative to the mean.
+
+        Args:
+            tolerance (float): relative tolerance, e.g. 0.05 for 5%.
+            confidence (float), optional: confidence level.
+            Defaults to 0.95.
+
+        Returns:
+            bool: True if the mean has converged, False otherwise.
+        """
+        half_width = self.half_width(confidence)
+        if half_width is None:
+            return False
+        return half_width <= tolerance * abs(self.mean)
+
+
+def percentile(values, q):
+    """Get a percentile of samples.
+
+    Args:
+        values (list): the samples.
+        q (float): the percentile between 0 and 100.
+
+    Returns:
+        float or None: the percentile, None if there are no
+        samples.
+    """
+    if len(values) == 0:
+        return None
+    return float(np.percentile(values, q))
+
+
+def jitter(values):
+    """Get the jitter of a series as the mean absolute difference
+    between consecutive samples.
+
+    Args:
+        values (list): the series.
+
+    Returns:
+        float or None: the jitter, None with less than two
+        samples.
+    """
+    if len(values) < 2:
+        return None
+    return float(np.mean(np.abs(np.diff(values))))
+
+
+def pack_samples(values):
+    """Pack samples into a base64 string of little-endian float32.
+
+    Args:
+        values (list): the samples to pack.
+
+    Returns:
+        str: the packed samples.
+    """
+    packed = array("f", values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return base64.b64encode(packed.tobytes()).decode("ascii")
+
+
+def unpack_samples(text):
+    """Unpack samples packed by pack_samples.
+
+    Args:
+        text (str): the packed samples.
+
+    Returns:
+        list: the samples.
+    """
+    unpacked = array("f")
+    unpacked.frombytes(base64.b64decode(text))
+    if sys.byteorder == "big":
+        unpacked.byteswap()
+    return unpacked.tolist()
+
+
+def aggregate(values, method="mean"):
+    """Aggregate samples into a single value.
+
+    Args:
+        values (list): the samples to aggregate.
+        method (str), optional: one of mean, median, trimmed
+        (10% trimmed mean), p5 or p95. Defaults to mean.
+
+    Returns:
+        float: the aggregated value.
+    """
+    return float(AGGREGATIONS[method](values))
+
+
+def pack_columns(columns):
+    """Pack a columnar series with pack_samples, dropping
+    columns without any valid sample.
+
+    Args:
+        columns (dict): Dictionary of column name and samples.
+
+    Returns:
+        dict: Dictionary of column name and packed samples.
+    """
+    return {name: pack_samples(values) for name, values in columns.items()
+            if not all(math.isnan(value) for value in values)}
+
+
+def unpack_columns(columns):
+    """Unpack a columnar series packed by pack_columns.
+
+    Args:
+        columns (dict): Dictionary of column name and packed
+        samples.
+
+    Returns:
+        dict: Dictionary of column name and samples.
+    """
+    return {name: unpack_samples(values) for name, values in columns.items()}
+
+
+def coefficient_of_variation(values):
+    """Get the coefficient of variation (standard deviation
+    relative to the mean) of a series.
+
+    Args:
+        values (list): the series.
+
+    Returns:
+        float or None: the coefficient of variation, None if
+        the series is empty or its mean is zero.
+    """
+    if len(values) == 0:
+        return None
+    mean = np.mean(values)
+    if mean == 0:
+        return None
+    return float(np.std(values) / mean)
+
+
+def steady_state_time(times, values, tolerance=0.1):
+    """Get the time after which a series stays within a
+    tolerance of its steady state value. The steady state
+    value is the median of the second half of the series.
+
+    Args:
+        times (list): start time of every sample.
+        values (list): the series.
+        tolerance (float), optional: relative tolerance.
+        Defaults to 0.1.
+
+    Returns:
+        float or None: the time to steady state, None if the
+        series is empty.
+    """
+    if len(values) == 0:
+        return None
+    steady = np.median(values[len(values) // 2:])
+    index = len(values)
+    while index > 0 and abs(values[index - 1] - steady) <= tolerance * abs(steady):
+        index -= 1
+    if index == len(values):
+        index -= 1
+    return float(times[index])
@@ -0,0 +1,205 @@
+from wifi_heat_mapper.misc import save_json
+from functools import wraps
+import pstats
+import threading
+import time
+import os
+
+
+class Tracer:
+    """Records the duration of named spans of a run.
+
+    Spans are stored as (name, detail, start, end, thread id, thread
+    name) tuples with perf_counter timestamps. The detail, such as the
+    benchmark mode or metric, only shows in the Chrome trace.
+    """
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def record(self, name, detail, start, end):
+        """Store a finished span."""
+        thread = threading.current_thread()
+        with self._lock:
+            self.spans.append((name, detail, start, end, thread.ident, thread.name))
+
+    def summary(self):
+        """Get the count, total, mean and max duration in seconds of
+        every span name, slowest total first.
+
+        Returns:
+            list: List of (name, count, total, mean, max) tuples.
+        """
+        durations = {}
+        with self._lock:
+            for name, _, start, end, _, _ in self.spans:
+                durations.setdefault(name, []).append(end - start)
+        rows = [(name, len(values), sum(values), sum(values) / len(values), max(values))
+                for name, values in durations.items()]
+        return sorted(rows, key=lambda row: row[2], reverse=True)
+
+    def print_summary(self):
+        """Print the summary table of the spans."""
+        rows = self.summary()
+        if len(rows) == 0:
+            print("No traced spans.")
+            return
+        print("{0:<32}{1:>8}{2:>14}{3:>12}{4:>12}".format("Span", "Count", "Total (ms)", "Mean (ms)", "Max (ms)"))
+        for name, count, total, mean, longest in rows:
+            print("{0:<32}{1:>8}{2:>14.1f}{3:>12.1f}{4:>12.1f}".format(
+                name, count, total * 1000, mean * 1000, longest * 1000))
+
+    def chrome_trace(self):
+        """Get the spans in the Chrome trace event format, which
+        chrome://tracing and Perfetto open.
+
+        Returns:
+            dict: Dictionary containing the 'traceEvents'.
+        """
+        pid = os.getpid()
+        events = []
+        threads = {}
+        with self._lock:
+            for name, detail, start, end, ident, thread in self.spans:
+                threads[ident] = thread
+                events.append({
+                    "name": name if detail is None else "{0} {1}".format(name, detail),
+                    "cat": name,
+                    "ph": "X",
+                    "ts": (start - self.origin) * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "pid": pid,
+                    "tid": ident,
+                })
+        events += [{"name": "thread_name", "ph": "M", "pid": pid, "tid": ident, "args": {"name": thread}}
+                   for ident, thread in threads.items()]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save_chrome_trace(self, file_path):
+        """Save the spans as a Chrome trace json.
+
+        Returns:
+            bool: True if the trace was saved, False otherwise.
+        """
+        return save_json(file_path, self.chrome_trace())
+
+    def report(self, file_path=None):
+        """Print the summary table and save the Chrome trace if a
+        path is given."""
+        self.print_summary()
+        if file_path is None:
+            return
+        if self.save_chrome_trace(file_path):
+            print("Saved trace to {0}".format(file_path))
+        else:
+            print("Unable to save trace to {0}".format(file_path))
+
+
+class Span:
+    """Times a block of code into a Tracer."""
+    __slots__ = ("detail", "name", "start", "tracer")
+
+    def __init__(self, tracer, name, detail=None):
+        self.tracer = tracer
+        self.name = name
+        self.detail = detail
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self.tracer.record(self.name, self.detail, self.start, time.perf_counter())
+        return False
+
+
+class NullSpan:
+    """Stands in for a Span when tracing is disabled."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+
+tracer = None
+null_span = NullSpan()
+
+
+def enable():
+    """Start recording spans.
+
+    Returns:
+        Tracer: the tracer recording the spans.
+    """
+    global tracer
+    tracer = Tracer()
+    return tracer
+
+
+def disable():
+    """Stop recording spans."""
+    global tracer
+    tracer = None
+
+
+def get_tracer():
+    """Get the active tracer, None if tracing is disabled."""
+    return tracer
+
+
+def report_profile(profiler, file_path, limit=25):
+    """Print the slowest functions of a cProfile run by cumulative
+    time and save its stats for pstats or snakeviz.
+
+    Args:
+        profiler (Profile): the finished profiler.
+        file_path (str): Save path of the stats.
+        limit (int), optional: number of functions to print.
+        Defaults to 25.
+    """
+    pstats.Stats(profiler).sort_stats("cumulative").print_stats(limit)
+    try:
+        profiler.dump_stats(file_path)
+    except OSError:
+        print("Unable to save profile to {0}".format(file_path))
+        return
+    print("Saved profile to {0}".format(file_path))
+
+
+def span(name, detail=None):
+    """Time a block of code when tracing is enabled.
+
+    Args:
+        name (str): the name of the span.
+        detail (str), optional: Appended to the name in the
+        Chrome trace, such as the benchmark mode. Defaults to
+        None.
+
+    Returns:
+        Span or NullSpan: a context manager timing the block.
+    """
+    if tracer is None:
+        return null_span
+    return Span(tracer, name, detail)
+
+
+def traced(name):
+    """Decorator timing every call of a function as a span when
+    tracing is enabled.
+
+    Args:
+        name (str): the name of the span.
+    """
+    def decorator(func):
+        @wraps(func)
+        def new_func(*args, **kwargs):
+            if tracer is None:
+                return func(*args, **kwargs)
+            with Span(tracer, name):
+                return func(*args, **kwargs)
+        return new_func
+    return decorator